@@ -0,0 +1,204 @@
+"""
+Candidate generation for person de-duplication.
+
+Comparing every person with every other person using `Person.match` is
+quadratic in the number of people, which is hopeless for the hundreds of
+thousands of investigators and program officers in the awards. Instead,
+people are grouped into blocks by cheap keys, and only pairs sharing a block
+are compared. A blocker is a function from a list of people to a set of
+(i, j) index pairs, i < j; the candidate pairs are the union of the pairs of
+all blockers used.
+
+Blockers provided:
+
+1.  `phonetic_blocker`: NYSIIS code of the last name plus first initial.
+2.  `sorted_neighborhood_blocker`: people within a sliding window after
+    sorting by normalized name, which catches typos in the leading letters of
+    a last name that the phonetic key maps elsewhere.
+3.  `org_blocker`: same division and last initial.
+
+Recall of the blocking is measured against the exhaustive comparison on a
+sample, since that is the only labeling available for free.
+
+Usage::
+
+    python blocking.py [<people.store> [sample size [threshold]]]
+
+"""
+from __future__ import division
+
+import sys
+import time
+import random
+import itertools
+
+import jellyfish
+
+from personstore import PersonStore
+
+
+# Blocks larger than this are skipped; they are almost always junk keys
+# (e.g. empty names), and their pairs would swamp the candidates.
+MAX_BLOCK_SIZE = 1000
+
+# Default `Person.match` score above which two people are considered the same.
+THRESHOLD = 0.9
+
+
+def _text(value):
+    """Names are stored as utf-8 byte strings; jellyfish wants unicode."""
+    if value is None:
+        return u''
+    if isinstance(value, str):
+        value = value.decode('utf-8', 'replace')
+    return value.strip().upper()
+
+
+def _alpha(value):
+    return u''.join(c for c in _text(value) if c.isalpha())
+
+
+def phonetic_key(person):
+    lname = _alpha(person.lname)
+    if not lname:
+        return None
+    return (jellyfish.nysiis(lname), _alpha(person.fname)[:1])
+
+
+def org_key(person):
+    lname = _alpha(person.lname)
+    if not person.division or not lname:
+        return None
+    return (person.division, lname[0])
+
+
+def name_sort_key(person):
+    return (_alpha(person.lname), _alpha(person.fname), _alpha(person.mname))
+
+
+def block_pairs(people, key, max_block_size=MAX_BLOCK_SIZE):
+    """Return all index pairs of people with the same, non-None `key`."""
+    blocks = {}
+    for i, person in enumerate(people):
+        k = key(person)
+        if k is not None:
+            blocks.setdefault(k, []).append(i)
+
+    pairs = set()
+    for members in blocks.itervalues():
+        if len(members) < 2:
+            continue
+        if max_block_size and len(members) > max_block_size:
+            continue
+        pairs.update(itertools.combinations(members, 2))
+    return pairs
+
+
+def phonetic_blocker(people, max_block_size=MAX_BLOCK_SIZE):
+    return block_pairs(people, phonetic_key, max_block_size)
+
+
+def org_blocker(people, max_block_size=MAX_BLOCK_SIZE):
+    return block_pairs(people, org_key, max_block_size)
+
+
+def sorted_neighborhood_blocker(people, window=5, key=name_sort_key):
+    """Pair each person with the `window` - 1 people that follow it when
+    sorted by `key`.
+    """
+    order = sorted(range(len(people)), key=lambda i: key(people[i]))
+    pairs = set()
+    for pos, i in enumerate(order):
+        for j in order[pos + 1:pos + window]:
+            pairs.add((i, j) if i < j else (j, i))
+    return pairs
+
+
+BLOCKERS = (phonetic_blocker, sorted_neighborhood_blocker)
+
+
+def candidate_pairs(people, blockers=BLOCKERS):
+    """Union of the pairs emitted by each of the `blockers`."""
+    pairs = set()
+    for blocker in blockers:
+        pairs |= blocker(people)
+    return pairs
+
+
+def find_duplicates(people, threshold=THRESHOLD, blockers=BLOCKERS):
+    """Yield (i, j, score) for candidate pairs scoring at least `threshold`.
+    """
+    for i, j in candidate_pairs(people, blockers):
+        score = people[i].match(people[j])
+        if score >= threshold:
+            yield i, j, score
+
+
+def exhaustive_matches(people, threshold=THRESHOLD):
+    """The quadratic reference: every pair scoring at least `threshold`.
+
+    Only suitable for samples.
+    """
+    matches = set()
+    for i, j in itertools.combinations(range(len(people)), 2):
+        if people[i].match(people[j]) >= threshold:
+            matches.add((i, j))
+    return matches
+
+
+def evaluate(people, true_pairs, blockers=BLOCKERS):
+    """Measure the blocking against labeled duplicate pairs.
+
+    :param list people: People to block.
+    :param set true_pairs: (i, j) index pairs, i < j, known to be duplicates.
+    :return: dict with the candidate and total pair counts, the reduction
+        ratio (fraction of pairs never compared) and the recall (fraction of
+        true pairs among the candidates).
+    """
+    start = time.time()
+    candidates = candidate_pairs(people, blockers)
+    elapsed = time.time() - start
+
+    n = len(people)
+    total = n * (n - 1) // 2
+    found = len(candidates & true_pairs)
+    return {
+        'people': n,
+        'total_pairs': total,
+        'candidate_pairs': len(candidates),
+        'reduction_ratio': 1 - len(candidates) / total if total else 0.0,
+        'true_pairs': len(true_pairs),
+        'recall': found / len(true_pairs) if true_pairs else 1.0,
+        'seconds': elapsed
+    }
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else 'people.store'
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    threshold = float(sys.argv[3]) if len(sys.argv) > 3 else THRESHOLD
+
+    people = PersonStore(path)
+
+    # sample whole last-name neighborhoods rather than uniformly, so the
+    # sample contains duplicates at roughly the rate of the full data
+    order = sorted(xrange(len(people)),
+                   key=lambda i: name_sort_key(people[i]))
+    random.seed(0)
+    start = random.randrange(max(1, len(people) - size))
+    sample = [people[i] for i in order[start:start + size]]
+
+    print 'Exhaustive comparison of {} people...'.format(len(sample))
+    true_pairs = exhaustive_matches(sample, threshold)
+
+    for name, blockers in [
+            ('phonetic', (phonetic_blocker,)),
+            ('sorted neighborhood', (sorted_neighborhood_blocker,)),
+            ('org', (org_blocker,)),
+            ('phonetic + sorted neighborhood', BLOCKERS)]:
+        stats = evaluate(sample, true_pairs, blockers)
+        print '{}:'.format(name)
+        print '  pairs compared: {candidate_pairs} of {total_pairs}'.format(
+            **stats)
+        print '  reduction ratio: {reduction_ratio:.5f}'.format(**stats)
+        print '  recall: {recall:.4f} of {true_pairs} matches'.format(**stats)
@@ -1,17 +1,14 @@
+import os
 import sys
-import multiprocessing as mp
 
-from parse import Awards
-from util.num_cpus import available_cpu_count
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db'))
+from scan import collect, award_id
 
 
-def check_stuff(awards, year):
-    print 'Checking year: {}'.format(year)
-    for soup in awards[year]:
-        length = len(soup.find('AwardID').text)
-        if length > 7:
-            print length
-            sys.stdout.flush()
+def long_id(doc):
+    """Length of the AwardID, if longer than the 7 characters expected."""
+    length = len(award_id(doc))
+    return length if length > 7 else None
 
 
 if __name__ == "__main__":
@@ -21,12 +18,5 @@ if __name__ == "__main__":
         print '{} <zipdir>'.format(sys.argv[0])
         sys.exit(1)
 
-    awards = Awards(zipdir)
-    years = awards.years()
-    print 'Checking {} years.'.format(len(years))
-    cpus = available_cpu_count()
-    pool = mp.Pool(processes=cpus)
-    for year in years:
-        pool.apply_async(check_stuff, args=(awards, year))
-    pool.close()
-    pool.join()
+    for year, member, length in collect(zipdir, long_id):
+        print '{}: {}: {}'.format(year, member, length)
@@ -0,0 +1,247 @@
+"""
+Check the retry, resume and skip paths of `get_nsf_data` against a local
+stand-in for the nsf.gov download endpoint.
+
+The server holds a random archive per year and answers as nsf.gov does,
+with an ETag, conditional requests (304) and range requests (206). It can be
+told to fail a year's next requests, with a 503 or by closing the
+connection after `CUT` bytes of the body. Four runs are checked:
+
+    fresh       every year is downloaded; one year gets a 503 and is
+                retried, and one is cut off and resumed from the bytes
+                already written
+    unchanged   a second run gets a 304 for every year and skips it
+    changed     a year whose archive changed on the server is downloaded
+                again
+    stale part  a partial download of an older version of the archive is
+                thrown away rather than resumed
+
+and a number of attempts below 1 must be refused, both by `request_data`
+and on the command line.
+
+Usage::
+
+    python check_download.py [-n years] [-j workers] [-s size]
+
+"""
+import os
+import sys
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+import urlparse
+import SocketServer
+import BaseHTTPServer
+
+import get_nsf_data
+
+
+# Bytes of the body sent before a cut connection is closed.
+CUT = 100000
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _start(self, year, status):
+        with self.server.lock:
+            self.server.requests.append(
+                (year, self.headers.get('Range'), status))
+        self.send_response(status)
+
+    def _send(self, year, status, body='', headers=()):
+        self._start(year, status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        form = urlparse.parse_qs(self.rfile.read(length))
+        year = form['DownloadFileName'][0]
+        with server.lock:
+            body = server.archives[year]
+            failures = server.failures.get(year)
+            failure = failures.pop(0) if failures else None
+
+        if failure == '503':
+            return self._send(year, 503)
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            return self._send(year, 304)
+
+        start = 0
+        status = 200
+        if (self.headers.get('Range') and
+                self.headers.get('If-Range') == etag):
+            start = int(self.headers['Range'].split('=')[1].rstrip('-'))
+            status = 206
+        if failure == 'cut':
+            self._start(year, status)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(body) - start))
+            self.end_headers()
+            self.wfile.write(body[start:start + CUT])
+            self.close_connection = 1
+            return
+        self._send(year, status, body[start:], [('ETag', etag)])
+
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Serves `archives` (year -> bytes) on a free local port.
+
+    :ivar dict failures: Year -> list of '503' or 'cut', one per request
+        to fail, in order.
+    :ivar list requests: (year, Range header, status) of every request
+        answered.
+    """
+    daemon_threads = True
+
+    def __init__(self, archives):
+        BaseHTTPServer.HTTPServer.__init__(
+            self, ('127.0.0.1', 0), StandInHandler)
+        self.archives = archives
+        self.failures = {}
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/download'.format(self.server_port)
+
+
+def report(name, problems):
+    print '{:<10} {}'.format(name, ', '.join(problems) or 'ok')
+    return not problems
+
+
+def check_archives(server, outdir, years):
+    """List the years whose archive on disk is not the served one."""
+    problems = []
+    for year in years:
+        path = os.path.join(outdir, '{}.zip'.format(year))
+        if not os.path.exists(path):
+            problems.append('{} missing'.format(year))
+        elif open(path, 'rb').read() != server.archives[year]:
+            problems.append('{} differs'.format(year))
+        if os.path.exists(path + '.part'):
+            problems.append('{} left a .part file'.format(year))
+    return problems
+
+
+def run(server, outdir, years, workers):
+    """Download `years`; return (problems, requests answered)."""
+    del server.requests[:]
+    failed = get_nsf_data.request_all(
+        years, outdir, workers, url=server.url, backoff=0.01)
+    problems = ['{} failed: {}'.format(year, e)
+                for year, e in sorted(failed.items())]
+    return problems, list(server.requests)
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser(
+        description='Check the downloader against a local stand-in server.')
+    parser.add_argument(
+        '-n', '--years', action='store', type=int, default=4,
+        help='number of years to serve (default: 4, at least 3)')
+    parser.add_argument(
+        '-j', '--workers', action='store', type=int,
+        default=get_nsf_data.WORKERS,
+        help='concurrent downloads (default: {})'.format(
+            get_nsf_data.WORKERS))
+    parser.add_argument(
+        '-s', '--size', action='store', type=int, default=300000,
+        help='bytes per archive (default: 300000)')
+    return parser
+
+
+def main():
+    args = setup_parser().parse_args()
+    if args.years < 3 or args.size <= CUT:
+        print 'need at least 3 years of more than {} bytes'.format(CUT)
+        return 2
+    get_nsf_data.TIMEOUT = 5
+
+    years = [str(2000 + i) for i in range(args.years)]
+    retried, resumed, changed = years[:3]
+    server = StandInServer(
+        dict((year, os.urandom(args.size + i))
+             for i, year in enumerate(years)))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    outdir = tempfile.mkdtemp()
+    ok = True
+    try:
+        server.failures = {retried: ['503'], resumed: ['cut']}
+        problems, requests = run(server, outdir, years, args.workers)
+        problems += check_archives(server, outdir, years)
+        if (retried, None, 503) not in requests or (
+                retried, None, 200) not in requests:
+            problems.append('{} was not retried'.format(retried))
+        if (resumed, 'bytes={}-'.format(CUT), 206) not in requests:
+            problems.append('{} was not resumed'.format(resumed))
+        ok &= report('fresh', problems)
+
+        problems, requests = run(server, outdir, years, args.workers)
+        statuses = sorted(status for _, _, status in requests)
+        if statuses != [304] * len(years):
+            problems.append('answered {}'.format(statuses))
+        ok &= report('unchanged', problems)
+
+        server.archives[changed] = os.urandom(args.size)
+        problems, _ = run(server, outdir, [changed], args.workers)
+        problems += check_archives(server, outdir, [changed])
+        ok &= report('changed', problems)
+
+        # a partial download of the archive as it was before it changed
+        path = os.path.join(outdir, '{}.zip'.format(resumed))
+        os.remove(path)
+        with open(path + '.part', 'wb') as f:
+            f.write(server.archives[resumed][:CUT])
+        get_nsf_data.Manifest(outdir).update(
+            resumed, partial={'etag': '"stale"'}, sha1=None)
+        server.archives[resumed] = os.urandom(args.size)
+        problems, requests = run(server, outdir, [resumed], args.workers)
+        problems += check_archives(server, outdir, [resumed])
+        if any(status != 200 for _, _, status in requests):
+            problems.append('answered {}'.format(requests))
+        ok &= report('stale part', problems)
+
+        problems = []
+        try:
+            get_nsf_data.request_data(years[0], outdir, url=server.url,
+                                      retries=0)
+            problems.append('request_data took retries=0')
+        except ValueError:
+            pass
+        stderr, sys.stderr = sys.stderr, open(os.devnull, 'w')
+        try:
+            for value in ('0', '-1'):
+                try:
+                    get_nsf_data.setup_parser().parse_args(['-r', value])
+                    problems.append('-r {} was accepted'.format(value))
+                except SystemExit:
+                    pass
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+        ok &= report('no retries', problems)
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(outdir)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
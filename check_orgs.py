@@ -1,23 +1,21 @@
+import os
 import sys
-import multiprocessing as mp
 
-from parse import Awards
-from util.num_cpus import available_cpu_count
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db'))
+from scan import collect, award_id
 
 
-def check_orgs(awards, year):
-    print 'Checking year: {}'.format(year)
-    for soup in awards[year]:
-        if len(soup('Organization')) > 1:
-            with open('multiple_orgs.txt', 'a') as f:
-                f.write('{}\n'.format(soup.find('AwardID').text))
-        if len(soup('LongName')) > 2:
-            if len(soup('Directorate')) > 1:
-                with open('multiple_dirs.txt', 'a') as f:
-                    f.write('{}\n'.format(soup.find('AwardID').text))
-            if len(soup('Division')) > 1:
-                with open('multiple_divs.txt', 'a') as f:
-                    f.write('{}\n'.format(soup.find('AwardID').text))
+def org_multiples(doc):
+    """Names of the files this award belongs in, if any."""
+    files = []
+    if len(doc.findall('.//Organization')) > 1:
+        files.append('multiple_orgs.txt')
+    if len(doc.findall('.//LongName')) > 2:
+        if len(doc.findall('.//Directorate')) > 1:
+            files.append('multiple_dirs.txt')
+        if len(doc.findall('.//Division')) > 1:
+            files.append('multiple_divs.txt')
+    return (award_id(doc), files) if files else None
 
 
 if __name__ == "__main__":
@@ -27,12 +25,7 @@ if __name__ == "__main__":
         print '{} <zipdir>'.format(sys.argv[0])
         sys.exit(1)
 
-    awards = Awards(zipdir)
-    years = awards.years()
-    print 'Checking {} years.'.format(len(years))
-    cpus = available_cpu_count()
-    pool = mp.Pool(processes=cpus)
-    for year in years:
-        pool.apply_async(check_orgs, args=(awards, year))
-    pool.close()
-    pool.join()
+    for year, member, (code, files) in collect(zipdir, org_multiples):
+        for fname in files:
+            with open(fname, 'a') as f:
+                f.write('{}\n'.format(code))
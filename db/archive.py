@@ -0,0 +1,174 @@
+"""
+Memory-mapped reading of the award zip archives.
+
+`zipfile.ZipFile.read` seeks and reads the local header and the compressed
+data of each member through a file object, one member at a time. A
+`MappedArchive` instead reads the archive's directory once, into a table of
+data offsets, compressed sizes and CRCs, and maps the whole file into
+memory. A member is then inflated straight from the mapping.
+
+Worker processes forked after an archive is mapped share the mapping, so
+they decompress disjoint members in parallel without reopening the file or
+copying its contents; see `imap`.
+
+Only stored and deflated members are supported, which is all the NSF
+archives use.
+
+"""
+import mmap
+import zlib
+import struct
+import zipfile
+import multiprocessing as mp
+
+
+# Fixed part of a member's local file header; the name and extra field
+# follow it, then the data.
+_LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+_LOCAL_SIGNATURE = 'PK\x03\x04'
+
+# Members inflated per task by `imap`.
+CHUNK_SIZE = 200
+
+
+class MappedArchive(object):
+    """Read-only, memory-mapped zip archive.
+
+    Members may be given by name, `ZipInfo` (from this or any other reading
+    of the archive) or position in the archive.
+
+    :param str path: Path of the zip file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with zipfile.ZipFile(path, 'r') as archive:
+            self.infos = archive.infolist()
+        self.positions = dict(
+            (info.filename, i) for i, info in enumerate(self.infos))
+
+        self._file = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self._file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        except:
+            self._file.close()
+            raise
+        self.offsets = [self._data_offset(info) for info in self.infos]
+
+    def _data_offset(self, info):
+        if info.flag_bits & 0x1:
+            raise NotImplementedError(
+                'encrypted member: {}'.format(info.filename))
+        if info.compress_type not in (zipfile.ZIP_STORED,
+                                      zipfile.ZIP_DEFLATED):
+            raise NotImplementedError('compression method {} of {}'.format(
+                info.compress_type, info.filename))
+
+        header = _LOCAL_HEADER.unpack_from(self.map, info.header_offset)
+        if header[0] != _LOCAL_SIGNATURE:
+            raise zipfile.BadZipfile(
+                'bad local header for {}'.format(info.filename))
+        name_length, extra_length = header[-2:]
+        return (info.header_offset + _LOCAL_HEADER.size + name_length +
+                extra_length)
+
+    def __len__(self):
+        return len(self.infos)
+
+    def close(self):
+        self.map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def namelist(self):
+        return [info.filename for info in self.infos]
+
+    def position(self, member):
+        """Position in the archive of a member name, `ZipInfo` or position.
+        """
+        if isinstance(member, (int, long)):
+            return member
+        if isinstance(member, zipfile.ZipInfo):
+            member = member.filename
+        return self.positions[member]
+
+    def read(self, member):
+        """Return the inflated bytes of a member, checking its CRC."""
+        i = self.position(member)
+        info = self.infos[i]
+        data = buffer(self.map, self.offsets[i], info.compress_size)
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            data = zlib.decompress(data, -zlib.MAX_WBITS)
+        else:
+            data = str(data)
+        if zlib.crc32(data) & 0xffffffff != info.CRC:
+            raise zipfile.BadZipfile(
+                'bad CRC-32 for {}'.format(info.filename))
+        return data
+
+    def iterdata(self, members=None):
+        """Yield (member name, bytes) for the given members, or all."""
+        if members is None:
+            members = range(len(self.infos))
+        for member in members:
+            i = self.position(member)
+            yield self.infos[i].filename, self.read(i)
+
+
+# State of each `imap` worker, set when the pool starts.
+_worker = {}
+
+
+def _init_worker(archives, func):
+    _worker['archives'] = archives
+    _worker['func'] = func
+
+
+def _map_slice(task):
+    key, start, stop = task
+    archive = _worker['archives'][key]
+    func = _worker['func']
+    return [func(name, data) for name, data in
+            archive.iterdata(range(start, stop))]
+
+
+def imap(archives, func=None, keys=None, workers=None, chunk_size=CHUNK_SIZE):
+    """Lazily map `func(name, data)` over the members of several archives,
+    inflating them in `workers` forked processes.
+
+    The archives are mapped in this process before the workers are forked,
+    so every worker reads them from the same mapping. Results come back in
+    archive and member order. Like `scan.scan`, `func` is inherited by the
+    workers rather than pickled, so it may be a lambda.
+
+    :param dict archives: `MappedArchive`s by key, e.g. year.
+    :param func: Function of (member name, bytes); by default, results are
+        the (name, bytes) pairs themselves.
+    :param list keys: Keys of the archives to read, in order; all by default,
+        in sorted order.
+    :param int workers: Number of processes; the CPU count by default.
+    :param int chunk_size: Members per task.
+    """
+    if func is None:
+        func = lambda name, data: (name, data)
+    if keys is None:
+        keys = sorted(archives)
+    tasks = [(key, start, min(start + chunk_size, len(archives[key])))
+             for key in keys
+             for start in range(0, len(archives[key]), chunk_size)]
+
+    pool = mp.Pool(workers, _init_worker, (archives, func))
+    try:
+        for results in pool.imap(_map_slice, tasks):
+            for result in results:
+                yield result
+    finally:
+        # also reached when the consumer stops early, via GeneratorExit
+        pool.terminate()
+        pool.join()
@@ -1,21 +1,37 @@
+import io
 import os
+import re
+import sqlite3
+import hashlib
 import zipfile
 import datetime
+import contextlib
 import cPickle as pickle
-from difflib import SequenceMatcher
 
 import ujson as json
 import nameparser
 
 from bs4 import BeautifulSoup as Soup
+from lxml import etree
 
+from archive import MappedArchive, imap
+from normalize import CountryCodeResolver, StreetNormalizer
 
-with open('../data/address-abbrevs.pickle', 'r') as f:
+
+# relative to this file, so scripts can import it from any directory
+DATADIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+with open(os.path.join(DATADIR, 'address-abbrevs.pickle'), 'r') as f:
     SUBS = pickle.load(f)
 
-with open('../data/country-codes.pickle', 'r') as f:
+STREETS = StreetNormalizer(SUBS)
+
+with open(os.path.join(DATADIR, 'country-codes.pickle'), 'r') as f:
     COUNTRIES = pickle.load(f)
 
+COUNTRY_CODES = CountryCodeResolver(COUNTRIES)
+
 ROLES = {
     'principal investigator': 'pi',
     'co-principal investigator': 'copi',
@@ -32,22 +48,17 @@ def parse_date(date):
 
 def normalize_street(street_address):
     """Sub common street name elements for abbreviations and capitalize."""
-    caps = street_address.upper()
-    stripped = caps.strip('.').strip()
-    for key in SUBS:
-        stripped = stripped.replace(key, SUBS[key])
-    return stripped
+    return STREETS(street_address)
 
 
 def closest_country_code(country):
     """Get the country code for the country name most similar to the given."""
-    caps = country.upper()
-    top = (0, '')
-    for name in COUNTRIES:
-        similarity = SequenceMatcher(None, caps, name).ratio()
-        if similarity > top[0]:
-            top = (similarity, name)
-    return COUNTRIES[top[1]]
+    return COUNTRY_CODES(country)
+
+
+def _itertext(element):
+    """Concatenate all text beneath an lxml element, like `Tag.text`."""
+    return u''.join(element.itertext())
 
 
 class AwardXML(object):
@@ -62,20 +73,8 @@ class AwardXML(object):
         self.instruments = [tag.find('Value').text
                             for tag in soup('AwardInstrument')]
 
-        # all dates are in format: dd/mm/yyyy
-        def find_date(key):
-            text = find_text(key)
-            return parse_date(text) if text else None
-
-        self.effective = find_date('AwardEffectiveDate')
-        self.expires = find_date('AwardExpirationDate')
-        self.first_amended = find_date('MinAmdLetterDate')
-        self.last_amended = find_date('MaxAmdLetterDate')
-
-        # money
-        self.amount = int(find_text('AwardAmount'))
-        self.arra_amount = find_text('ARRAAmount').strip()
-        self.arra_amount = int(self.arra_amount) if self.arra_amount else 0
+        self._set_dates(find_text)
+        self._set_money(find_text)
 
         # organizational data
         tag = soup.find('Directorate')
@@ -84,64 +83,195 @@ class AwardXML(object):
         self.division = tag.find('LongName').text.upper() if tag else u''
 
         # TODO: look up code and phone number for div/dir
-        self.pgm_elements = [{
-            'code': pgm.find('Code').text,
-            'name': pgm.find('Text').text}
+        self.pgm_elements = [
+            self._program(lambda key: pgm.find(key).text)
             for pgm in soup('ProgramElement')]
 
-        self.pgm_refs = [{
-            'code': pgm.find('Code').text,
-            'name': pgm.find('Text').text}
+        self.pgm_refs = [
+            self._program(lambda key: pgm.find(key).text)
             for pgm in soup('ProgramReference')]
 
         # institutions
-        self.institutions = [{
-            'name': tag.find('Name').text,
-            'phone': tag.find('PhoneNumber').text,
-            'street': normalize_street(tag.find('StreetAddress').text),
-            'city': tag.find('CityName').text.upper(),
-            'state': tag.find('StateCode').text.upper(),
-            'country': closest_country_code(tag.find('CountryName').text),
-            'zipcode': tag.find('ZipCode').text}
+        self.institutions = [
+            self._institution(lambda key: tag.find(key).text)
             for tag in soup('Institution')]
 
         # investigators
-        self.people = []
-        for tag in soup('Investigator'):
-            get_text = lambda key: tag.find(key).text
-            email = get_text('EmailAddress').strip()
-            fullname = u'{} {}'.format(
-                get_text('FirstName'), get_text('LastName'))
-
-            start_date = get_text('StartDate').strip()
-            start = parse_date(start_date) if start_date else self.effective
-            end_date = get_text('EndDate').strip()
-            end = parse_date(end_date) if end_date else self.expires
-
-            # TODO: deal with inexact matches
-            role_str = get_text('RoleCode').strip()
-            role = ROLES[role_str.lower()]
-            self.people.append({
-                'email': email if email else None,
-                'name': fullname,
-                'role': role,
-                'start': start,
-                'end': end
-            })
+        self.people = [
+            self._investigator(lambda key: tag.find(key).text)
+            for tag in soup('Investigator')]
 
         # program officers
-        for tag in soup('ProgramOfficer'):
-            self.people.append({
-                'name': tag.text.strip('\n'),
-                'role': 'po',
-                'start': self.effective,
-                'end': self.expires,
-                'email': None
-            })
+        self.people.extend(
+            self._program_officer(tag.text) for tag in soup('ProgramOfficer'))
+
+    @classmethod
+    def from_lxml(cls, data):
+        """Extract award data from raw XML bytes in a single lxml pass.
+
+        This fills exactly the same attributes as the soup-based constructor,
+        but walks the document once with `lxml.etree.iterparse` instead of
+        searching the whole soup tree for every field.
+
+        :param str data: Raw XML for one award, as read from the archive.
+        """
+        self = cls.__new__(cls)
+        first = {}
+        instruments, pgm_elements, pgm_refs = [], [], []
+        institutions, investigators, officers = [], [], []
+
+        def subtext(element):
+            return lambda key: _itertext(element.find('.//' + key))
+
+        for _, elem in etree.iterparse(io.BytesIO(data), events=('end',)):
+            tag = elem.tag
+            if tag in first:
+                continue
+            elif tag in cls._LXML_SCALARS:
+                first[tag] = _itertext(elem)
+            elif tag == 'AwardInstrument':
+                instruments.append(_itertext(elem.find('.//Value')))
+            elif tag == 'ProgramElement':
+                pgm_elements.append(cls._program(subtext(elem)))
+            elif tag == 'ProgramReference':
+                pgm_refs.append(cls._program(subtext(elem)))
+            elif tag == 'Institution':
+                institutions.append(subtext(elem))
+            elif tag == 'Investigator':
+                investigators.append(subtext(elem))
+            elif tag == 'ProgramOfficer':
+                officers.append(_itertext(elem))
+            elif tag in ('Directorate', 'Division'):
+                longname = elem.find('.//LongName')
+                first[tag] = _itertext(longname).upper()
+
+        find_text = lambda key: first[key]
+        self.title = find_text('AwardTitle')
+        self.id = find_text('AwardID')
+        self.abstract = find_text('AbstractNarration').strip()
+        self.instruments = instruments
+
+        self._set_dates(find_text)
+        self._set_money(find_text)
+
+        self.directorate = first.get('Directorate', u'')
+        self.division = first.get('Division', u'')
+        self.pgm_elements = pgm_elements
+        self.pgm_refs = pgm_refs
+        self.institutions = [cls._institution(get) for get in institutions]
+        self.people = [self._investigator(get) for get in investigators]
+        self.people.extend(self._program_officer(text) for text in officers)
+        return self
+
+    # Elements read as plain text by `from_lxml`; the first occurrence wins,
+    # matching `soup.find`.
+    _LXML_SCALARS = frozenset([
+        'AwardTitle', 'AwardID', 'AbstractNarration', 'AwardAmount',
+        'ARRAAmount', 'AwardEffectiveDate', 'AwardExpirationDate',
+        'MinAmdLetterDate', 'MaxAmdLetterDate'
+    ])
+
+    def _set_dates(self, find_text):
+        # all dates are in format: dd/mm/yyyy
+        def find_date(key):
+            text = find_text(key)
+            return parse_date(text) if text else None
+
+        self.effective = find_date('AwardEffectiveDate')
+        self.expires = find_date('AwardExpirationDate')
+        self.first_amended = find_date('MinAmdLetterDate')
+        self.last_amended = find_date('MaxAmdLetterDate')
 
-    def write_json(fpath):
-        with open(fpath, 'w') as f:
-            json.dump(self, fpath)
+    def _set_money(self, find_text):
+        self.amount = int(find_text('AwardAmount'))
+        self.arra_amount = find_text('ARRAAmount').strip()
+        self.arra_amount = int(self.arra_amount) if self.arra_amount else 0
+
+    @staticmethod
+    def _program(get_text):
+        return {'code': get_text('Code'), 'name': get_text('Text')}
+
+    @staticmethod
+    def _institution(get_text):
+        return {
+            'name': get_text('Name'),
+            'phone': get_text('PhoneNumber'),
+            'street': normalize_street(get_text('StreetAddress')),
+            'city': get_text('CityName').upper(),
+            'state': get_text('StateCode').upper(),
+            'country': closest_country_code(get_text('CountryName')),
+            'zipcode': get_text('ZipCode')
+        }
+
+    def _investigator(self, get_text):
+        email = get_text('EmailAddress').strip()
+        fullname = u'{} {}'.format(
+            get_text('FirstName'), get_text('LastName'))
+
+        start_date = get_text('StartDate').strip()
+        start = parse_date(start_date) if start_date else self.effective
+        end_date = get_text('EndDate').strip()
+        end = parse_date(end_date) if end_date else self.expires
+
+        # TODO: deal with inexact matches
+        role_str = get_text('RoleCode').strip()
+        role = ROLES[role_str.lower()]
+        return {
+            'email': email if email else None,
+            'name': fullname,
+            'role': role,
+            'start': start,
+            'end': end
+        }
+
+    def _program_officer(self, text):
+        return {
+            'name': text.strip('\n'),
+            'role': 'po',
+            'start': self.effective,
+            'end': self.expires,
+            'email': None
+        }
+
+    # Dates are stored as proleptic ordinals, the fastest form to decode.
+    _DATE_FIELDS = ('effective', 'expires', 'first_amended', 'last_amended')
+
+    def to_record(self):
+        """Return the extracted fields as a dict of JSON-serializable values.
+        """
+        def ordinal(date):
+            return date.toordinal() if date is not None else None
+
+        record = dict(self.__dict__)
+        record.pop('member', None)
+        for field in self._DATE_FIELDS:
+            record[field] = ordinal(record[field])
+        record['people'] = [
+            dict(person, start=ordinal(person['start']),
+                 end=ordinal(person['end']))
+            for person in self.people]
+        return record
+
+    @classmethod
+    def from_record(cls, record):
+        """Rebuild an award from the dict made by `to_record`."""
+        def date(ordinal):
+            return (datetime.date.fromordinal(ordinal)
+                    if ordinal is not None else None)
+
+        self = cls.__new__(cls)
+        self.__dict__.update(record)
+        for field in cls._DATE_FIELDS:
+            setattr(self, field, date(record[field]))
+        for person in self.people:
+            person['start'] = date(person['start'])
+            person['end'] = date(person['end'])
+        return self
+
+    def write_json(self, f):
+        """Write the award to the open file `f` as one line of JSON."""
+        f.write(json.dumps(self.to_record()))
+        f.write('\n')
 
 
 class NoAwardsFound(Exception):
@@ -154,45 +284,512 @@ class NoAwardsFound(Exception):
         return self.msg
 
 
+class AwardCache(object):
+    """Per-year files of extracted awards, so re-runs skip XML parsing.
+
+    Each year is a JSON Lines file, `<year>.jsonl`. The first line is a
+    header holding the fingerprint of the archive it was built from: a hash
+    of the names, CRCs and sizes in the archive's directory, which is cheap
+    to read. Each following line is one award, as the name of its archive
+    member, a tab, and `AwardXML.to_record` as JSON. A cache file is fresh
+    while its fingerprint matches the archive's.
+
+    Files are written to a temporary name and renamed into place once a
+    whole year has been written, so a cache file is never partial.
+
+    :param str cachedir: Directory to keep the cache files in.
+    """
+
+    VERSION = 1
+
+    def __init__(self, cachedir):
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        self.cachedir = cachedir
+        self._offsets = {}
+
+    def path(self, year):
+        return os.path.join(self.cachedir, '{}.jsonl'.format(year))
+
+    @staticmethod
+    def fingerprint(zipfile_path):
+        sha1 = hashlib.sha1()
+        with zipfile.ZipFile(zipfile_path, 'r') as archive:
+            for info in archive.infolist():
+                sha1.update('{}:{}:{}\n'.format(
+                    info.filename, info.CRC, info.file_size))
+        return sha1.hexdigest()
+
+    def is_fresh(self, year, fingerprint):
+        try:
+            with open(self.path(year), 'rb') as f:
+                header = json.loads(f.readline())
+        except (IOError, ValueError):
+            return False
+        return (header.get('version') == self.VERSION and
+                header.get('fingerprint') == fingerprint)
+
+    @staticmethod
+    def _decode(line):
+        member, _, record = line.partition('\t')
+        award = AwardXML.from_record(json.loads(record))
+        award.member = member.decode('utf-8')
+        return award
+
+    def read(self, year):
+        """Iterate over the cached awards of a year, in archive order."""
+        with open(self.path(year), 'rb') as f:
+            f.readline()
+            for line in f:
+                yield self._decode(line)
+
+    def read_members(self, year, fingerprint, members):
+        """Iterate over the cached awards of the named members of a year.
+
+        The offset of each member's line is indexed on first use, so reading
+        a year chunk by chunk reads the file about once.
+        """
+        key = (year, fingerprint)
+        if key not in self._offsets:
+            offsets = {}
+            with open(self.path(year), 'rb') as f:
+                offset = len(f.readline())
+                for line in f:
+                    offsets[line[:line.index('\t')].decode('utf-8')] = offset
+                    offset += len(line)
+            self._offsets = {key: offsets}
+        offsets = self._offsets[key]
+
+        with open(self.path(year), 'rb') as f:
+            for member in members:
+                f.seek(offsets[member])
+                yield self._decode(f.readline())
+
+    @contextlib.contextmanager
+    def writer(self, year, fingerprint):
+        """Write a year's cache file; yields a function taking each award.
+
+        The file only replaces the old one if the block completes.
+        """
+        path = self.path(year)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            header = {'version': self.VERSION, 'year': year,
+                      'fingerprint': fingerprint}
+            f.write(json.dumps(header))
+            f.write('\n')
+
+            def write(award):
+                f.write(award.member.encode('utf-8'))
+                f.write('\t')
+                award.write_json(f)
+
+            try:
+                yield write
+            except:
+                f.close()
+                os.remove(tmp)
+                raise
+        os.rename(tmp, path)
+
+
+class AwardIndex(object):
+    """Persistent map of AwardIDs to the archive members holding them.
+
+    Kept in an SQLite file with a table of the archives indexed, by file
+    name and fingerprint (see `AwardCache.fingerprint`), and a table of
+    (AwardID, archive file name, member name, offset of the member's local
+    header). `update` indexes the archives that are new or changed since
+    they were indexed, and forgets removed ones, so keeping the index
+    current costs one read of each archive's directory. The offsets order
+    reads by their place in the archive, and tell whether a member is still
+    where it was indexed.
+
+    An AwardID may be in more than one archive; lookups list the latest
+    year first.
+
+    :param str path: The index file; created if missing.
+    """
+
+    _AWARD_ID = re.compile(r'<AwardID>\s*([^<\s]+)\s*</AwardID>')
+
+    # SQLite allows at most 999 bound parameters per statement.
+    _IN_CHUNK = 500
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.text_factory = str
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS archive (
+                filename TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS award (
+                award_id TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                member TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                PRIMARY KEY (award_id, filename)
+            );
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM award').fetchone()[0]
+
+    @classmethod
+    def award_id(cls, data):
+        """The AwardID in raw award XML, or None."""
+        match = cls._AWARD_ID.search(data)
+        return match.group(1) if match else None
+
+    def update(self, explorer, workers=None):
+        """Index the archives of `explorer` that are new or changed.
+
+        :param int workers: Inflate members in this many processes.
+        :return: The number of archives (re)indexed.
+        """
+        indexed = dict(self.conn.execute(
+            'SELECT filename, fingerprint FROM archive'))
+        present = set(explorer.zipfiles)
+        changed = 0
+        with self.conn:
+            for filename in set(indexed) - present:
+                self._forget(filename)
+            for filename in sorted(present):
+                path = os.path.join(explorer.zipdir, filename)
+                fingerprint = AwardCache.fingerprint(path)
+                if indexed.get(filename) == fingerprint:
+                    continue
+                self._forget(filename)
+                self._index(explorer._archive(path), filename, workers)
+                self.conn.execute(
+                    'INSERT INTO archive VALUES (?, ?)',
+                    (filename, fingerprint))
+                changed += 1
+        return changed
+
+    def forget(self, filename):
+        """Drop an archive, so that the next `update` indexes it again."""
+        with self.conn:
+            self._forget(filename)
+
+    def _forget(self, filename):
+        self.conn.execute('DELETE FROM award WHERE filename = ?', (filename,))
+        self.conn.execute(
+            'DELETE FROM archive WHERE filename = ?', (filename,))
+
+    def _index(self, archive, filename, workers=None):
+        award_id = self.award_id
+        if workers:
+            ids = imap({filename: archive},
+                       lambda name, data: award_id(data), workers=workers)
+        else:
+            ids = (award_id(data) for _, data in archive.iterdata())
+        rows = ((code, filename, info.filename, info.header_offset)
+                for info, code in zip(archive.infos, ids) if code)
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO award VALUES (?, ?, ?, ?)', rows)
+
+    def lookup(self, award_id):
+        """List (archive file name, member, offset) of an AwardID."""
+        return self.conn.execute(
+            'SELECT filename, member, offset FROM award WHERE award_id = ? '
+            'ORDER BY filename DESC', (str(award_id),)).fetchall()
+
+    def lookup_many(self, award_ids):
+        """Map each AwardID found to its latest (file name, member, offset).
+        """
+        award_ids = [str(award_id) for award_id in award_ids]
+        found = {}
+        for start in range(0, len(award_ids), self._IN_CHUNK):
+            chunk = award_ids[start:start + self._IN_CHUNK]
+            query = (
+                'SELECT award_id, filename, member, offset FROM award '
+                'WHERE award_id IN ({}) ORDER BY filename'.format(
+                    ', '.join('?' * len(chunk))))
+            for code, filename, member, offset in self.conn.execute(
+                    query, chunk):
+                found[code] = (filename, member, offset)
+        return found
+
+
 class AwardExplorer(object):
-    """Wrapper class that iterates over XML award data, yielding XML Soup."""
+    """Wrapper class that iterates over XML award data, yielding XML Soup.
 
-    def __init__(self, dirpath=None):
+    Awards can be extracted with either of two engines: 'soup' builds a
+    BeautifulSoup tree per award (the original behavior), while 'lxml' uses
+    the single-pass `AwardXML.from_lxml` extractor.
+
+    Given a `cachedir`, whole years are read from an `AwardCache` while it
+    is fresh, and cached as they are read from the archive when it is not.
+    Every award has the name of its archive member as `member`.
+
+    Archives are read through a `MappedArchive`, opened once per archive and
+    reopened only if the file is replaced.
+
+    Single awards are looked up by AwardID with `get` and `get_many`, through
+    an `AwardIndex` kept at `index_path` (by default `award-index.sqlite` in
+    the archive directory). It is brought up to date on first use, and again
+    whenever an archive has been replaced since. An award that is not where
+    the index says has its archive indexed again, and is looked up once
+    more.
+    """
+
+    ENGINES = ('soup', 'lxml')
+
+    INDEX_FILE = 'award-index.sqlite'
+
+    def __init__(self, dirpath=None, engine='soup', cachedir=None,
+                 index_path=None):
         """Set up the file paths to the data using the given directory."""
+        if engine not in self.ENGINES:
+            raise ValueError('unknown extraction engine: {}'.format(engine))
+        self.engine = engine
+        self.cache = AwardCache(cachedir) if cachedir is not None else None
+
         self.zipdir = dirpath if dirpath is not None else os.getcwd()
         self.zipfiles = [f for f in os.listdir(self.zipdir)
                          if f.endswith('.zip')]
+        self._archives = {}
+        self.index_path = index_path or os.path.join(
+            self.zipdir, self.INDEX_FILE)
+        self._index = None
+        self._indexed = None
 
         if not self.zipfiles:
             raise NoAwardsFound(self.zipdir)
 
-    def _iterarchive(self, zipfile_path):
-        with zipfile.ZipFile(zipfile_path, 'r') as archive:
-            for filepath in archive.filelist:
-                yield Soup(archive.read(filepath), 'xml')
+    @staticmethod
+    def _signature(zipfile_path):
+        """Tell a zip file from the files it replaced or is replaced by."""
+        stat = os.stat(zipfile_path)
+        return (stat.st_ino, stat.st_size, stat.st_mtime)
+
+    def _archive(self, zipfile_path):
+        """The `MappedArchive` of a zip file, mapped again if the file was
+        replaced since it was last mapped.
+        """
+        signature = self._signature(zipfile_path)
+        try:
+            mapped_signature, archive = self._archives[zipfile_path]
+        except KeyError:
+            pass
+        else:
+            if mapped_signature == signature:
+                return archive
+            archive.close()
+        archive = MappedArchive(zipfile_path)
+        self._archives[zipfile_path] = (signature, archive)
+        return archive
+
+    def archive(self, year):
+        """Return the `MappedArchive` of a year."""
+        return self._archive(self.zippath(year))
+
+    def _iterdata(self, zipfile_path, members=None):
+        """Yield (member name, raw XML) for the members of an archive."""
+        return self._archive(zipfile_path).iterdata(members)
+
+    def _iterraw(self, zipfile_path, members=None):
+        for _, data in self._iterdata(zipfile_path, members):
+            yield data
 
-    def __getitem__(self, year):
+    def _iterarchive(self, zipfile_path):
+        for data in self._iterraw(zipfile_path):
+            yield Soup(data, 'xml')
+
+    def _extract(self, data, member=None):
+        """Build an `AwardXML` from raw XML using the configured engine."""
+        if self.engine == 'lxml':
+            award = AwardXML.from_lxml(data)
+        else:
+            award = AwardXML(Soup(data, 'xml'))
+        award.member = member
+        return award
+
+    def _iterextract(self, zipfile_path, members=None):
+        return (self._extract(data, member) for member, data in
+                self._iterdata(zipfile_path, members))
+
+    def _itercaching(self, year, zipfile_path, fingerprint):
+        with self.cache.writer(year, fingerprint) as write:
+            for award in self._iterextract(zipfile_path):
+                write(award)
+                yield award
+
+    def zippath(self, year):
+        """Return the path to the zip archive for the given year."""
         filename = '{}.zip'.format(year)
         if filename not in self.zipfiles:
             raise KeyError('{} not present in {}'.format(
                 filename, self.zipdir))
 
-        zipfile_path = os.path.join(self.zipdir, filename)
-        return (AwardXML(soup) for soup in self._iterarchive(zipfile_path))
+        return os.path.join(self.zipdir, filename)
+
+    def __getitem__(self, year):
+        zipfile_path = self.zippath(year)
+        if self.cache is None:
+            return self._iterextract(zipfile_path)
+
+        fingerprint = self.cache.fingerprint(zipfile_path)
+        if self.cache.is_fresh(year, fingerprint):
+            return self.cache.read(year)
+        return self._itercaching(year, zipfile_path, fingerprint)
 
     def __iter__(self):
         return self.iterawards()
 
+    @property
+    def index(self):
+        """The `AwardIndex`, updated when first used and whenever one of the
+        archives has been replaced since it was last updated.
+        """
+        signatures = dict(
+            (filename, self._signature(os.path.join(self.zipdir, filename)))
+            for filename in self.zipfiles)
+        if self._index is None:
+            self._index = AwardIndex(self.index_path)
+        if signatures != self._indexed:
+            self._index.update(self)
+            self._indexed = signatures
+        return self._index
+
+    def _reindex(self, filenames):
+        """Index these archives again, having found the index wrong."""
+        for filename in filenames:
+            self.index.forget(filename)
+        self._indexed = None
+
+    def _read_located(self, location, raw):
+        """Read the award at an index location, or return None if the
+        member is not at the indexed offset.
+        """
+        filename, member, offset = location
+        archive = self._archive(os.path.join(self.zipdir, filename))
+        i = archive.positions.get(member)
+        if i is None or archive.infos[i].header_offset != offset:
+            return None
+        data = archive.read(i)
+        return data if raw else self._extract(data, member)
+
+    def get(self, award_id, raw=False):
+        """Return the award with the given AwardID, from the latest year
+        that has it.
+
+        :param bool raw: Return the raw XML instead of an `AwardXML`.
+        :raises KeyError: If no archive has the award.
+        """
+        for _ in range(2):
+            locations = self.index.lookup(award_id)
+            if not locations:
+                break
+            award = self._read_located(locations[0], raw)
+            if award is not None:
+                return award
+            self._reindex([locations[0][0]])
+        raise KeyError('award not found: {}'.format(award_id))
+
+    def get_many(self, award_ids, raw=False):
+        """Map each of the AwardIDs found to its award, as for `get`.
+
+        Members are read in archive order, so the archives are walked
+        forward once.
+        """
+        found = {}
+        for _ in range(2):
+            located = self.index.lookup_many(award_ids)
+            order = sorted(located, key=lambda code: located[code][::2])
+            missed = set()
+            for code in order:
+                award = self._read_located(located[code], raw)
+                if award is None:
+                    missed.add(located[code][0])
+                else:
+                    found[code] = award
+            if not missed:
+                break
+            self._reindex(missed)
+            award_ids = [code for code in map(str, award_ids)
+                         if code not in found]
+        return found
+
+    def members(self, year):
+        """List the names of the award files in a year's archive."""
+        return self.archive(year).namelist()
+
+    def infolist(self, year):
+        """List the `ZipInfo` of every award file in a year's archive."""
+        return list(self.archive(year).infos)
+
+    def changed(self, year, known):
+        """List the `ZipInfo` of the members of a year that are new, or
+        whose CRC or size differ from when they were last seen.
+
+        :param dict known: Map of member names to their (CRC, size).
+        """
+        return [info for info in self.infolist(year)
+                if known.get(info.filename) != (info.CRC, info.file_size)]
+
+    def iterdata(self, year, members=None):
+        """Iterate over (member name, raw XML) for members of a year.
+
+        :param list members: Names or `ZipInfo`s; all members by default.
+        """
+        return self._iterdata(self.zippath(year), members)
+
+    def itermembers(self, year, members):
+        """Iterate over awards for only the named members of a year.
+
+        A fresh cache is read if there is one, but a partial read never
+        builds one.
+        """
+        zipfile_path = self.zippath(year)
+        if self.cache is not None:
+            fingerprint = self.cache.fingerprint(zipfile_path)
+            if self.cache.is_fresh(year, fingerprint):
+                return self.cache.read_members(year, fingerprint, members)
+        return self._iterextract(zipfile_path, members)
+
     def years(self):
         return [int(year.strip('.zip')) for year in self.zipfiles]
 
     def itersoup(self):
-        for filename in self.zipfiles:
-            zipfile_path = os.path.join(self.zipdir, filename)
-            return self._iterarchive(zipfile_path)
+        for year in sorted(self.years()):
+            for soup in self._iterarchive(self.zippath(year)):
+                yield soup
+
+    def imapdata(self, func=None, years=None, workers=None):
+        """Lazily map `func(member name, raw XML)` over every award, in
+        year and archive order, inflating members in `workers` processes.
+
+        See `archive.imap`; by default the results are (name, raw XML).
+        """
+        if years is None:
+            years = sorted(self.years())
+        archives = dict((year, self.archive(year)) for year in years)
+        return imap(archives, func, years, workers)
+
+    def iterraw(self, workers=None):
+        """Iterate over the raw XML of every award, year by year.
+
+        :param int workers: Inflate members in this many processes.
+        """
+        if workers:
+            for _, data in self.imapdata(workers=workers):
+                yield data
+            return
+        for year in sorted(self.years()):
+            for data in self._iterraw(self.zippath(year)):
+                yield data
 
     def iterawards(self):
-        return (AwardXML(soup) for soup in self.itersoup())
+        for year in sorted(self.years()):
+            for award in self[year]:
+                yield award
 
 
 if __name__ == "__main__":
@@ -0,0 +1,96 @@
+"""
+Time loading one year into a fresh database, with and without
+`db.bulk_load` mode.
+
+Three configurations are run, each on a new database file:
+
+    default     the engine as configured, SQL echo included (sent to
+                /dev/null so the terminal is not the bottleneck)
+    quiet       echo off, SQLite defaults otherwise
+    bulk mode   inside `db.bulk_load()`
+
+Usage::
+
+    python bench_load.py <zipdir> <year> [-b] [-e lxml]
+
+"""
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+import db
+from awards import AwardExplorer
+from parse import parse_years_serial
+
+
+def load_year(awards, year, bulk, dbpath, echo=False, bulk_mode=False):
+    """Create a database at `dbpath`, load `year` into it, return seconds.
+    """
+    db.use_database('sqlite:///' + dbpath, echo=echo)
+    db.Base.metadata.create_all(db.engine)
+
+    start = time.time()
+    if bulk_mode:
+        with db.bulk_load():
+            parse_years_serial(awards, [year], bulk)
+    else:
+        parse_years_serial(awards, [year], bulk)
+    elapsed = time.time() - start
+
+    db.Session.remove()
+    db.engine.dispose()
+    return elapsed
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser(
+        description='Time loading one year with and without bulk-load mode.')
+    parser.add_argument(
+        'zipdir', action='store',
+        help='directory containing the <year>.zip award archives')
+    parser.add_argument('year', action='store', type=int)
+    parser.add_argument(
+        '-b', '--bulk', action='store_true',
+        help='write with the set-based bulk loader')
+    parser.add_argument(
+        '-e', '--engine', action='store', default='soup',
+        choices=AwardExplorer.ENGINES,
+        help='XML extraction engine (default: soup)')
+    return parser
+
+
+def main():
+    args = setup_parser().parse_args()
+    awards = AwardExplorer(args.zipdir, args.engine)
+    count = len(awards.members(args.year))
+
+    # echo still formats every statement, but does not print it; SQLAlchemy
+    # only adds its stdout handler to a logger without handlers
+    devnull = open(os.devnull, 'w')
+    logger = logging.getLogger('sqlalchemy.engine.base.Engine')
+    logger.handlers = [logging.StreamHandler(devnull)]
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        runs = [('default', dict(echo=True)),
+                ('quiet', dict()),
+                ('bulk mode', dict(bulk_mode=True))]
+        print 'loading {} awards from {}:'.format(count, args.year)
+        for name, options in runs:
+            dbpath = os.path.join(tmpdir, name.replace(' ', '-') + '.db')
+            elapsed = load_year(awards, args.year, args.bulk, dbpath,
+                                **options)
+            print '  {:<10} {:7.2f}s  {:7.1f} awards/s'.format(
+                name, elapsed, count / elapsed)
+    finally:
+        shutil.rmtree(tmpdir)
+        devnull.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
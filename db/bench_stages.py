@@ -0,0 +1,346 @@
+"""
+Benchmark each stage of loading the awards on its own, and keep the results
+for comparison between commits.
+
+Stages, each timed over every award in the given years:
+
+    read        reading and inflating the archive members
+    extract     building `AwardXML` records from the raw XML (this includes
+                normalization, as the extractor does it)
+    normalize   `normalize_street`, `closest_country_code` and `parse_date`
+                on the fields of each award they are applied to, found
+                beforehand with a plain lxml parse
+    persist     `parse_award` into a new SQLite database, commits included
+
+Only the stage itself is timed; the work that feeds it (e.g. extraction for
+the persist stage) is not. Every stage runs in a new interpreter, so its
+peak RSS is its own, and caches start cold. The RSS after imports, before
+the stage starts, is reported alongside as the baseline.
+
+Results are printed and written as JSON (by default to
+`bench-<commit>.json`). Given an earlier results file, stages that got
+slower or bigger by more than the tolerance are reported, and the exit
+status is 1. A corpus to run on can be made with `gen_corpus.py`.
+
+Usage::
+
+    python bench_stages.py <zipdir> [year ...] [-e lxml] [-s read,extract]
+        [-r repeat] [-o results.json] [-c earlier.json] [-t 0.1]
+
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import datetime
+import resource
+import tempfile
+import subprocess
+
+from lxml import etree
+
+
+STAGES = ('read', 'extract', 'normalize', 'persist')
+
+# Relative change in a stage's awards/s or peak RSS reported as a regression.
+TOLERANCE = 0.1
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def peak_rss():
+    """Peak resident set size of this process so far, in KiB."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def _timed(stage):
+    """Run `stage(awards, years, engine)`, which returns (count, seconds),
+    and report it with the memory figures.
+    """
+    def run(awards, years, engine):
+        baseline = peak_rss()
+        count, seconds = stage(awards, years, engine)
+        return {
+            'awards': count,
+            'seconds': seconds,
+            'awards_per_sec': count / seconds if seconds else None,
+            'peak_rss_kb': peak_rss(),
+            'baseline_rss_kb': baseline
+        }
+    return run
+
+
+def _extractor(engine):
+    from awards import AwardXML, Soup
+    if engine == 'lxml':
+        return AwardXML.from_lxml
+    return lambda data: AwardXML(Soup(data, 'xml'))
+
+
+@_timed
+def stage_read(awards, years, engine):
+    count = 0
+    start = time.time()
+    for year in years:
+        for _ in awards.iterdata(year):
+            count += 1
+    return count, time.time() - start
+
+
+@_timed
+def stage_extract(awards, years, engine):
+    extract = _extractor(engine)
+    count = 0
+    seconds = 0.0
+    for year in years:
+        for _, data in awards.iterdata(year):
+            start = time.time()
+            extract(data)
+            seconds += time.time() - start
+            count += 1
+    return count, seconds
+
+
+def _normalization_inputs(data):
+    """The raw values an award's extraction normalizes:
+    (streets, countries, dates).
+    """
+    doc = etree.fromstring(data)
+    text = lambda path: [u''.join(e.itertext()) for e in doc.iterfind(path)]
+    streets = text('.//Institution/StreetAddress')
+    countries = text('.//Institution/CountryName')
+    dates = [date.strip() for date in
+             text('.//AwardEffectiveDate') + text('.//AwardExpirationDate') +
+             text('.//MinAmdLetterDate') + text('.//MaxAmdLetterDate') +
+             text('.//Investigator/StartDate') +
+             text('.//Investigator/EndDate')]
+    return streets, countries, [date for date in dates if date]
+
+
+@_timed
+def stage_normalize(awards, years, engine):
+    from awards import normalize_street, closest_country_code, parse_date
+
+    inputs = [_normalization_inputs(data) for year in years
+              for _, data in awards.iterdata(year)]
+    start = time.time()
+    for streets, countries, dates in inputs:
+        for street in streets:
+            normalize_street(street)
+        for country in countries:
+            closest_country_code(country)
+        for date in dates:
+            parse_date(date)
+    return len(inputs), time.time() - start
+
+
+@_timed
+def stage_persist(awards, years, engine):
+    import db
+    from parse import parse_award
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        db.use_database('sqlite:///' + os.path.join(tmpdir, 'bench.db'))
+        db.Base.metadata.create_all(db.engine)
+        session = db.Session()
+        count = 0
+        seconds = 0.0
+        for year in years:
+            for award in awards[year]:
+                start = time.time()
+                parse_award(award, session)
+                seconds += time.time() - start
+                count += 1
+            start = time.time()
+            session.commit()
+            seconds += time.time() - start
+        db.Session.remove()
+        db.engine.dispose()
+    finally:
+        shutil.rmtree(tmpdir)
+    return count, seconds
+
+
+RUNNERS = {
+    'read': stage_read,
+    'extract': stage_extract,
+    'normalize': stage_normalize,
+    'persist': stage_persist
+}
+
+
+def run_stage(stage, zipdir, years, engine):
+    """Run one stage in a new interpreter; return its result dict."""
+    command = [sys.executable, os.path.abspath(__file__),
+               os.path.abspath(zipdir)] + [
+        str(year) for year in years] + ['-e', engine, '--run-stage', stage]
+    output = subprocess.check_output(command, cwd=HERE)
+    return json.loads(output.splitlines()[-1])
+
+
+def best_of(runs):
+    """Combine repeated runs of a stage: the fastest time, the largest RSS.
+    """
+    best = dict(min(runs, key=lambda run: run['seconds']))
+    best['peak_rss_kb'] = max(run['peak_rss_kb'] for run in runs)
+    best['runs'] = len(runs)
+    return best
+
+
+def git_commit():
+    """Return (commit hash, whether the tree has local changes), or
+    (None, None) outside a git checkout.
+    """
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=HERE).strip()
+        status = subprocess.check_output(
+            ['git', 'status', '--porcelain', '--untracked-files=no'],
+            cwd=HERE)
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status.strip())
+
+
+def benchmark(zipdir, years, engine, stages=STAGES, repeat=1):
+    """Run the stages and return the results as a JSON-serializable dict."""
+    commit, dirty = git_commit()
+    results = {
+        'commit': commit,
+        'dirty': dirty,
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'zipdir': os.path.abspath(zipdir),
+        'years': years,
+        'engine': engine,
+        'stages': {}
+    }
+    for stage in stages:
+        runs = [run_stage(stage, zipdir, years, engine)
+                for _ in range(repeat)]
+        results['stages'][stage] = best_of(runs)
+    return results
+
+
+def compare(old, new, tolerance=TOLERANCE):
+    """List (stage, measure, old value, new value) for every stage that got
+    slower or bigger by more than `tolerance` (a fraction).
+    """
+    regressions = []
+    for stage, result in sorted(new['stages'].items()):
+        before = old['stages'].get(stage)
+        if before is None:
+            continue
+        if (before['awards_per_sec'] and result['awards_per_sec'] <
+                before['awards_per_sec'] * (1 - tolerance)):
+            regressions.append((stage, 'awards_per_sec',
+                                before['awards_per_sec'],
+                                result['awards_per_sec']))
+        if result['peak_rss_kb'] > before['peak_rss_kb'] * (1 + tolerance):
+            regressions.append((stage, 'peak_rss_kb', before['peak_rss_kb'],
+                                result['peak_rss_kb']))
+    return regressions
+
+
+def report(results, old=None):
+    print '{:<10} {:>8} {:>9} {:>11} {:>13} {:>9}'.format(
+        'stage', 'awards', 'seconds', 'awards/s', 'peak RSS MiB', 'change')
+    for stage in STAGES:
+        result = results['stages'].get(stage)
+        if result is None:
+            continue
+        change = ''
+        before = old and old['stages'].get(stage)
+        if before and before['awards_per_sec']:
+            change = '{:+.1%}'.format(
+                result['awards_per_sec'] / before['awards_per_sec'] - 1)
+        print '{:<10} {:>8} {:>9.2f} {:>11.1f} {:>13.1f} {:>9}'.format(
+            stage, result['awards'], result['seconds'],
+            result['awards_per_sec'] or 0, result['peak_rss_kb'] / 1024.0,
+            change)
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser(
+        description='Time each stage of loading awards, separately.')
+    parser.add_argument(
+        'zipdir', action='store',
+        help='directory containing the <year>.zip award archives')
+    parser.add_argument(
+        'years', action='store', nargs='*', type=int,
+        help='restrict the benchmark to these years (default: all years)')
+    parser.add_argument(
+        '-e', '--engine', action='store', default='soup',
+        choices=('soup', 'lxml'),
+        help='XML extraction engine (default: soup)')
+    parser.add_argument(
+        '-s', '--stages', action='store', default=','.join(STAGES),
+        help='comma-separated stages to run (default: all)')
+    parser.add_argument(
+        '-r', '--repeat', action='store', type=int, default=1,
+        help='runs per stage; the fastest is kept (default: 1)')
+    parser.add_argument(
+        '-o', '--output', action='store', default=None,
+        help='file to write the results to (default: bench-<commit>.json)')
+    parser.add_argument(
+        '-c', '--compare', action='store', default=None, metavar='FILE',
+        help='results of an earlier run to report regressions against')
+    parser.add_argument(
+        '-t', '--tolerance', action='store', type=float, default=TOLERANCE,
+        help='relative change reported as a regression (default: 0.1)')
+    parser.add_argument(
+        '--run-stage', action='store', default=None, choices=STAGES,
+        help=argparse.SUPPRESS)
+    return parser
+
+
+def main():
+    args = setup_parser().parse_args()
+
+    from awards import AwardExplorer
+    awards = AwardExplorer(args.zipdir, args.engine)
+    years = args.years or sorted(awards.years())
+
+    if args.run_stage:
+        result = RUNNERS[args.run_stage](awards, years, args.engine)
+        print json.dumps(result)
+        return 0
+
+    stages = [stage.strip() for stage in args.stages.split(',')]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        print 'unknown stages: {}'.format(', '.join(sorted(unknown)))
+        return 2
+
+    old = None
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+
+    results = benchmark(args.zipdir, years, args.engine, stages, args.repeat)
+    report(results, old)
+
+    output = args.output or 'bench-{}.json'.format(
+        (results['commit'] or 'unknown')[:10])
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print 'results written to {}'.format(output)
+
+    if old is not None:
+        regressions = compare(old, results, args.tolerance)
+        for stage, measure, before, after in regressions:
+            print 'REGRESSION {} {}: {:.1f} -> {:.1f}'.format(
+                stage, measure, before, after)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
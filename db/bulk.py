@@ -0,0 +1,269 @@
+"""
+Set-based loading of parsed awards.
+
+`parse.parse_award` resolves every entity through `UniqueMixin.as_unique`,
+which costs a SELECT per distinct entity and several flushes per award. The
+`BulkLoader` here buffers a batch of `AwardXML` records instead and writes
+them with a handful of statements per table: one SELECT per table to find the
+rows that already exist, and `INSERT OR IGNORE` executemany statements for the
+rest. The rows written are the same as those the ORM path writes.
+
+"""
+import db
+
+
+# SQLite allows at most 999 bound parameters per statement.
+IN_CHUNK = 500
+
+
+def award_row(award):
+    """Map an `AwardXML` record onto the columns of the award table."""
+    return dict(
+        # general info
+        code=award.id,
+        title=award.title,
+        abstract=award.abstract if award.abstract else None,
+        instrument=','.join(award.instruments),
+
+        # all dates are in format: dd/mm/yyyy
+        effective=award.effective,
+        expires=award.expires,
+        first_amended=award.first_amended,
+        last_amended=award.last_amended,
+
+        # money
+        amount=award.amount,
+        arra_amount=award.arra_amount
+    )
+
+
+def _chunks(seq, size=IN_CHUNK):
+    seq = list(seq)
+    for start in range(0, len(seq), size):
+        yield seq[start:start + size]
+
+
+class _KeyedTable(object):
+    """Rows of one table with a natural key, resolved to primary keys.
+
+    Rows are queued in first-seen order, because with `INSERT OR IGNORE` the
+    first row for a key wins, just as the first `as_unique` call does.
+    """
+
+    def __init__(self, model, key_columns, lookup_column):
+        self.table = model.__table__
+        self.key_columns = key_columns
+        self.lookup = self.table.c[lookup_column]
+        self.ids = {}
+        self.pending = {}
+        self.order = []
+
+    def key(self, row):
+        return tuple(row[col] for col in self.key_columns)
+
+    def add(self, row):
+        key = self.key(row)
+        if key not in self.ids and key not in self.pending:
+            self.pending[key] = row
+            self.order.append(key)
+        return key
+
+    def _select(self, conn, keys):
+        """Fill `self.ids` for any of the given keys already in the table."""
+        cols = [self.table.c.id] + [self.table.c[c] for c in self.key_columns]
+        idx = self.key_columns.index(self.lookup.name)
+        wanted = set(keys)
+        values = set(key[idx] for key in keys)
+        for chunk in _chunks(values):
+            query = db.sa.select(cols).where(self.lookup.in_(chunk))
+            for row in conn.execute(query):
+                key = tuple(row[1:])
+                if key in wanted:
+                    self.ids[key] = row[0]
+
+    def resolve(self, conn):
+        """Insert the pending rows that are new and look up all their ids."""
+        if not self.pending:
+            return
+
+        self._select(conn, self.order)
+        new = [self.pending[key] for key in self.order if key not in self.ids]
+        if new:
+            conn.execute(self.table.insert().prefix_with('OR IGNORE'), new)
+            self._select(conn, [key for key in self.order
+                                if key not in self.ids])
+        self.pending = {}
+        self.order = []
+
+    def __getitem__(self, key):
+        return self.ids[key]
+
+
+class BulkLoader(object):
+    """Buffer parsed awards and write them to the DB a batch at a time.
+
+    The loader writes through the session's connection, so its statements
+    are part of the session's transaction; commit the session as usual.
+    Resolved ids are remembered across batches.
+
+    :type  session: `sqlalchemy.Session`
+    :param session: The active session object for the DB.
+    :param int batch_size: Number of awards to buffer before writing.
+    """
+
+    def __init__(self, session, batch_size=500):
+        self.session = session
+        self.batch_size = batch_size
+        self.awards = []
+
+        self.award = _KeyedTable(db.Award, ['code'], 'code')
+        self.directorate = _KeyedTable(db.Directorate, ['name'], 'name')
+        self.division = _KeyedTable(db.Division, ['name'], 'name')
+        self.program = _KeyedTable(db.Program, ['code'], 'code')
+        self.address = _KeyedTable(
+            db.Address, ['street', 'city', 'state', 'country', 'zipcode'],
+            'street')
+        self.institution = _KeyedTable(db.Institution, ['phone'], 'phone')
+        self.person = _KeyedTable(
+            db.Person, ['fname', 'lname', 'mname'], 'lname')
+
+    def add(self, award):
+        """Queue one `AwardXML` record, writing the batch once it is full."""
+        self.awards.append(award)
+        if len(self.awards) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered awards."""
+        if not self.awards:
+            return
+
+        conn = self.session.connection()
+        awards, self.awards = self.awards, []
+
+        # Entities without foreign keys first.
+        people = []
+        for award in awards:
+            self.award.add(award_row(award))
+            self.directorate.add({'name': award.directorate})
+            for inst in award.institutions:
+                self.address.add({
+                    'street': inst['street'],
+                    'city': inst['city'],
+                    'state': inst['state'],
+                    'country': inst['country'],
+                    'zipcode': inst['zipcode']
+                })
+            for person in award.people:
+                row = db.Person.parse_name(person['name'])
+                row['email'] = person['email']
+                people.append(self.person.add(row))
+
+        self.award.resolve(conn)
+        self.directorate.resolve(conn)
+        self.address.resolve(conn)
+        self._resolve_people(conn)
+
+        # Divisions belong to the directorate of the last award naming them,
+        # as `directorate.divisions.append(division)` leaves them.
+        div_dirs = {}
+        for award in awards:
+            dir_id = self.directorate[(award.directorate,)]
+            self.division.add({'name': award.division, 'dir_id': dir_id})
+            div_dirs[(award.division,)] = dir_id
+        self.division.resolve(conn)
+        self._update(conn, db.Division.__table__, 'dir_id',
+                     [(self.division[key], dir_id)
+                      for key, dir_id in div_dirs.items()])
+
+        # Program references are created before the elements of each award.
+        for award in awards:
+            for pgm in award.pgm_refs:
+                self.program.add({'code': pgm['code'], 'name': pgm['name'],
+                                  'div_id': None})
+            div_id = self.division[(award.division,)]
+            for pgm in award.pgm_elements:
+                self.program.add({'code': pgm['code'], 'name': pgm['name'],
+                                  'div_id': div_id})
+        self.program.resolve(conn)
+
+        # Institutions point at the address of their last appearance.
+        inst_addrs = {}
+        for award in awards:
+            for inst in award.institutions:
+                addr_key = self.address.key(inst)
+                self.institution.add({
+                    'name': inst['name'],
+                    'phone': inst['phone'],
+                    'address_id': self.address[addr_key]
+                })
+                inst_addrs[(inst['phone'],)] = self.address[addr_key]
+        self.institution.resolve(conn)
+        self._update(conn, db.Institution.__table__, 'address_id',
+                     [(self.institution[key], addr_id)
+                      for key, addr_id in inst_addrs.items()])
+
+        # Association rows, keyed on their composite primary keys.
+        related, funding, roles, affiliations = [], [], [], []
+        people = iter(people)
+        for award in awards:
+            award_id = self.award[(award.id,)]
+            ref_ids = [self.program[(pgm['code'],)] for pgm in award.pgm_refs]
+            for pgm in award.pgm_elements:
+                pgm_id = self.program[(pgm['code'],)]
+                related.extend({'pgm1_id': pgm_id, 'pgm2_id': ref_id}
+                               for ref_id in ref_ids if ref_id != pgm_id)
+                funding.append({'pgm_id': pgm_id, 'award_id': award_id})
+
+            person_ids = []
+            for person in award.people:
+                person_id = self.person[next(people)]
+                person_ids.append(person_id)
+                roles.append({
+                    'person_id': person_id,
+                    'award_id': award_id,
+                    'role': person['role'],
+                    'start': person['start'],
+                    'end': person['end']
+                })
+
+            inst_ids = [self.institution[(inst['phone'],)]
+                        for inst in award.institutions]
+            affiliations.extend(
+                {'person_id': person_id, 'institution_id': inst_id,
+                 'award_id': award_id}
+                for person_id in person_ids for inst_id in inst_ids)
+
+        for model, rows in ((db.RelatedPrograms, related),
+                            (db.Funding, funding),
+                            (db.Role, roles),
+                            (db.Affiliation, affiliations)):
+            if rows:
+                conn.execute(
+                    model.__table__.insert().prefix_with('OR IGNORE'), rows)
+
+    def _resolve_people(self, conn):
+        """Resolve people, retrying without email on email collisions.
+
+        The email column is unique too, so a new name that reuses an email
+        already on file is ignored by `INSERT OR IGNORE`. The ORM path would
+        fail outright there; here the person is kept without the email.
+        """
+        pending = dict(self.person.pending)
+        self.person.resolve(conn)
+        missing = [key for key in pending if key not in self.person.ids]
+        for key in missing:
+            row = dict(pending[key], email=None)
+            self.person.add(row)
+        self.person.resolve(conn)
+
+    @staticmethod
+    def _update(conn, table, column, pairs):
+        """Set `column` for each (id, value) pair with one executemany."""
+        if not pairs:
+            return
+        stmt = table.update().where(
+            table.c.id == db.sa.bindparam('_id')).values(
+            {column: db.sa.bindparam('_value')})
+        conn.execute(stmt, [{'_id': row_id, '_value': value}
+                            for row_id, value in pairs])
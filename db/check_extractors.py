@@ -0,0 +1,60 @@
+"""
+Check that the lxml extraction engine produces exactly the same `AwardXML`
+fields as the BeautifulSoup engine, award by award and field by field.
+
+Usage::
+
+    python check_extractors.py <zipdir> [year ...]
+
+"""
+import sys
+
+from awards import AwardExplorer, AwardXML, Soup
+
+
+FIELDS = (
+    'id', 'title', 'abstract', 'instruments',
+    'effective', 'expires', 'first_amended', 'last_amended',
+    'amount', 'arra_amount', 'directorate', 'division',
+    'pgm_elements', 'pgm_refs', 'institutions', 'people'
+)
+
+
+def compare(data):
+    """Return a list of (field, soup value, lxml value) mismatches."""
+    expected = AwardXML(Soup(data, 'xml'))
+    actual = AwardXML.from_lxml(data)
+    return [(field, getattr(expected, field), getattr(actual, field))
+            for field in FIELDS
+            if getattr(expected, field) != getattr(actual, field)]
+
+
+def check_year(awards, year):
+    """Compare both engines on every award in a year; return #mismatches."""
+    print 'Checking year: {}'.format(year)
+    path = awards.zippath(year)
+    checked = mismatched = 0
+    for data in awards._iterraw(path):
+        checked += 1
+        diffs = compare(data)
+        if diffs:
+            mismatched += 1
+            for field, expected, actual in diffs:
+                print '{}: {}: soup={!r} lxml={!r}'.format(
+                    year, field, expected, actual)
+    print '{}: {} awards checked, {} mismatched'.format(
+        year, checked, mismatched)
+    return mismatched
+
+
+if __name__ == "__main__":
+    try:
+        zipdir = sys.argv[1]
+    except IndexError:
+        print '{} <zipdir> [year ...]'.format(sys.argv[0])
+        sys.exit(1)
+
+    awards = AwardExplorer(zipdir)
+    years = [int(year) for year in sys.argv[2:]] or awards.years()
+    failures = sum(check_year(awards, year) for year in years)
+    sys.exit(1 if failures else 0)
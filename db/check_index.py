@@ -0,0 +1,134 @@
+"""
+Check that a bounded `UniqueIndex` does not change what a load writes.
+
+The given years are loaded serially into fresh databases three times:
+
+    unbounded   with the per-session dict of the unique recipe
+    bounded     with a `UniqueIndex` of `size` entries, so most keys are
+                evicted and looked up again
+    warmed      the first year as unbounded, the rest with a bounded index
+                warmed from the database, so hits return rows by their
+                stored column values
+
+Every run must write the same rows, and the indexed runs may not issue
+more UPDATE statements than the unbounded one.
+
+Usage::
+
+    python check_index.py <zipdir> <year> [year ...] [-s size] [-e lxml]
+
+"""
+import os
+import sys
+import shutil
+import hashlib
+import argparse
+import tempfile
+
+import db
+from awards import AwardExplorer
+from check_queries import StatementCounter
+from mixins import UniqueIndex
+from parse import parse_years_serial, warm_index
+
+
+class UpdateCounter(StatementCounter):
+    """Count the UPDATE statements executed on an engine."""
+
+    def _count(self, conn, cursor, statement, *args):
+        if statement.startswith('UPDATE'):
+            self.count += 1
+
+
+def digest():
+    """Hash the rows of every table, in primary key order."""
+    digests = {}
+    for table in db.Base.metadata.sorted_tables:
+        md5 = hashlib.md5()
+        for row in db.engine.execute(
+                table.select().order_by(*table.primary_key.columns)):
+            md5.update(repr(tuple(row)))
+        digests[table.name] = md5.hexdigest()
+    return digests
+
+
+def load(awards, years, dbpath, size=None, warm=False):
+    """Load `years` into a new database at `dbpath`.
+
+    :return: (`digest` of the tables, UPDATE statements, index stats)
+    """
+    db.use_database('sqlite:///' + dbpath)
+    db.Base.metadata.create_all(db.engine)
+    stats = None
+    with UpdateCounter(db.engine) as updates:
+        if warm:
+            parse_years_serial(awards, years[:1])
+            db.Session.remove()
+            index = warm_index(db.Session(), size)
+            parse_years_serial(awards, years[1:], index=index)
+            stats = index.stats()
+        elif size is not None:
+            index = UniqueIndex(size)
+            parse_years_serial(awards, years, index=index)
+            stats = index.stats()
+        else:
+            parse_years_serial(awards, years)
+    db.Session.remove()
+    digests = digest()
+    db.engine.dispose()
+    return digests, updates.count, stats
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser(
+        description='Check that a bounded unique-key index writes the same '
+                    'rows as the unbounded recipe.')
+    parser.add_argument(
+        'zipdir', action='store',
+        help='directory containing the <year>.zip award archives')
+    parser.add_argument('years', action='store', nargs='+', type=int)
+    parser.add_argument(
+        '-s', '--size', action='store', type=int, default=20,
+        help='entries in the bounded index (default: 20)')
+    parser.add_argument(
+        '-e', '--engine', action='store', default='soup',
+        choices=AwardExplorer.ENGINES,
+        help='XML extraction engine (default: soup)')
+    return parser
+
+
+def main():
+    args = setup_parser().parse_args()
+    awards = AwardExplorer(args.zipdir, args.engine)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        runs = [('unbounded', dict()),
+                ('bounded', dict(size=args.size)),
+                ('warmed', dict(size=args.size, warm=True))]
+        ok = True
+        expected = None
+        for name, options in runs:
+            dbpath = os.path.join(tmpdir, name + '.db')
+            digests, updates, stats = load(
+                awards, args.years, dbpath, **options)
+            if expected is None:
+                expected, most = digests, updates
+                problems = []
+            else:
+                problems = ['{} differs'.format(table)
+                            for table in sorted(digests)
+                            if digests[table] != expected[table]]
+                if updates > most:
+                    problems.append('{} more UPDATEs'.format(updates - most))
+            ok &= not problems
+            print '{:<10} {:>6} UPDATEs {} {}'.format(
+                name, updates, ', '.join(problems) or 'ok',
+                stats if stats is not None else '')
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""
+Check that the bulk reads of `query` take a bounded number of statements.
+
+Each reader is run over a database with every association proxy and loaded
+attribute touched, counting the statements issued. It must issue at most
+one statement for the objects plus one per eagerly loaded collection, per
+batch, however many objects there are; the same walk done with plain lazy
+loading is counted for comparison.
+
+Usage::
+
+    python check_queries.py [year ...] [--db url] [-b batch_size]
+
+"""
+import sys
+import argparse
+
+import sqlalchemy as sa
+
+import db
+import query
+
+
+class StatementCounter(object):
+    """Count the statements executed on an engine, while in `with`."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _count(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        sa.event.listen(self.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc_info):
+        sa.event.remove(self.engine, 'before_cursor_execute', self._count)
+        return False
+
+
+def walk_award(award):
+    query.award_report(award)
+    list(award.people)
+
+
+def walk_person(person):
+    for award in person.awards:
+        award.code
+    for institution in person.institutions:
+        institution.name
+
+
+def walk_institution(institution):
+    institution.address
+    for person in institution.people:
+        person.full_name
+
+
+def check(name, objects, lazy_objects, walk, collections, batch_size):
+    """Count the statements of walking `objects` with `walk`, and of
+    walking `lazy_objects` (the same objects, lazily loaded).
+
+    :param int collections: Collections eagerly loaded per batch.
+    :return: True if the eager walk stayed within its bound.
+    """
+    with StatementCounter(db.engine) as eager:
+        count = 0
+        for obj in objects:
+            walk(obj)
+            count += 1
+    db.Session.remove()
+
+    with StatementCounter(db.engine) as lazy:
+        for obj in lazy_objects:
+            walk(obj)
+    db.Session.remove()
+
+    batches = max(1, -(-count // batch_size))
+    bound = batches * (1 + collections)
+    ok = eager.count <= bound
+    print '{:<14} {:>7} objects {:>6} statements (bound {:>5}), ' \
+          'lazily {:>7} statements {}'.format(
+              name, count, eager.count, bound, lazy.count,
+              'ok' if ok else 'FAILED')
+    return ok
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser(
+        description='Count the statements of the bulk readers in query.py.')
+    parser.add_argument(
+        'years', action='store', nargs='*', type=int,
+        help='read the awards of these years (default: all awards)')
+    parser.add_argument(
+        '-b', '--batch-size', action='store', type=int,
+        default=query.BATCH_SIZE,
+        help='objects per batch (default: {})'.format(query.BATCH_SIZE))
+    parser.add_argument(
+        '--db', action='store', default=None, metavar='URL',
+        help='database to read (default: the one in db.py)')
+    return parser
+
+
+def main():
+    args = setup_parser().parse_args()
+    if args.db:
+        db.use_database(args.db)
+    else:
+        db.engine.echo = False
+
+    ok = True
+    size = args.batch_size
+    for start, end in [query.year_range(year) for year in args.years] or [
+            (None, None)]:
+        lazy = db.Session().query(db.Award).order_by(
+            db.Award.effective, db.Award.id)
+        if start is not None:
+            lazy = lazy.filter(db.Award.effective >= start,
+                               db.Award.effective < end)
+        ok &= check(
+            'awards {}'.format(start.year) if start else 'awards',
+            query.awards(db.Session(), start, end, batch_size=size), lazy,
+            walk_award, 3, size)
+
+    ok &= check(
+        'people', query.people(db.Session(), batch_size=size),
+        db.Session().query(db.Person).order_by(db.Person.id),
+        walk_person, 2, size)
+    ok &= check(
+        'institutions', query.institutions(db.Session(), batch_size=size),
+        db.Session().query(db.Institution).order_by(db.Institution.id),
+        walk_institution, 1, size)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+Check `normalize_street` against the original one-substitution-at-a-time
+implementation.
+
+With no arguments, checks the pinned corpus in
+../datainfo/street-normalization-corpus.tsv (raw address, expected output).
+Given a zip directory, checks every institution street address in the
+archives instead. Addresses for which the original implementation depends on
+the iteration order of the abbreviation table are reported separately; the
+single-pass normalizer is only expected to agree on the rest.
+
+Usage::
+
+    python check_streets.py [<zipdir> [year ...]]
+
+"""
+import os
+import sys
+import codecs
+
+from lxml import etree
+
+from awards import AwardExplorer, SUBS, normalize_street
+
+
+CORPUS = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'datainfo',
+    'street-normalization-corpus.tsv')
+
+
+def sequential(street_address, keys):
+    """The original implementation, applying `keys` in the given order."""
+    caps = street_address.upper()
+    stripped = caps.strip('.').strip()
+    for key in keys:
+        stripped = stripped.replace(key, SUBS[key])
+    return stripped
+
+
+# Orders that expose order dependence: the table's own iteration order, its
+# reverse, and shortest or longest keys first.
+ORDERS = [
+    list(SUBS),
+    list(reversed(list(SUBS))),
+    sorted(SUBS, key=len),
+    sorted(SUBS, key=len, reverse=True)
+]
+
+
+def original(street_address):
+    """Return the original result, or None if it depends on key order."""
+    results = set(sequential(street_address, keys) for keys in ORDERS)
+    return results.pop() if len(results) == 1 else None
+
+
+def iter_corpus(path=CORPUS):
+    with codecs.open(path, 'r', 'utf-8') as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                continue
+            raw, expected = line.rstrip('\n').split('\t')
+            yield raw, expected
+
+
+def iter_archive_streets(awards, years):
+    for year in years:
+        for data in awards._iterraw(awards.zippath(year)):
+            root = etree.fromstring(data)
+            for street in root.iter('StreetAddress'):
+                yield u''.join(street.itertext())
+
+
+def check(pairs):
+    """Compare `normalize_street` to the expected results.
+
+    :param pairs: (raw address, expected) pairs; an expected value of None
+        means the original result is order-dependent.
+    :return: The number of mismatches.
+    """
+    checked = order_dependent = mismatched = 0
+    for raw, expected in pairs:
+        checked += 1
+        if expected is None:
+            order_dependent += 1
+            continue
+        actual = normalize_street(raw)
+        if actual != expected:
+            mismatched += 1
+            print u'{!r}: expected {!r}, got {!r}'.format(
+                raw, expected, actual).encode('utf-8')
+    print '{} addresses checked, {} order-dependent, {} mismatched'.format(
+        checked, order_dependent, mismatched)
+    return mismatched
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        awards = AwardExplorer(sys.argv[1])
+        years = [int(year) for year in sys.argv[2:]] or awards.years()
+        seen = set(iter_archive_streets(awards, years))
+        pairs = ((raw, original(raw)) for raw in sorted(seen))
+    else:
+        pairs = iter_corpus()
+
+    sys.exit(1 if check(pairs) else 0)
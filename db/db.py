@@ -1,7 +1,7 @@
 import re
 import sys
+import contextlib
 
-import nameparser
 import sqlalchemy as sa
 import sqlalchemy.orm as saorm
 
@@ -16,13 +16,86 @@ from sqlalchemy import (
 )
 
 from mixins import BasicMixin, UniqueMixin
+from normalize import NameParser
 
 
+# Shared by every `Person.parse_name` call; see `NameParser`.
+NAMES = NameParser()
+
 engine = sa.create_engine('sqlite:///nsf-award-data.db', echo=True)
 session_factory = saorm.sessionmaker(bind=engine)
 Session = saorm.scoped_session(session_factory)
 Base = declarative_base()
 
+# Set on every connection made while in `bulk_load` mode: write-ahead
+# logging, syncing only at checkpoints, a 256 MiB page cache and up to 1 GiB
+# of memory-mapped I/O.
+BULK_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -262144),
+    ('mmap_size', 1 << 30),
+    ('temp_store', 'MEMORY')
+)
+
+
+def use_database(url, echo=False):
+    """Point `engine` and `Session` at the database at `url`."""
+    global engine
+    engine = sa.create_engine(url, echo=echo)
+    Session.remove()
+    Session.configure(bind=engine)
+    return engine
+
+
+def _set_bulk_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in BULK_PRAGMAS:
+        cursor.execute('PRAGMA {}={}'.format(name, value))
+    cursor.close()
+
+
+def _secondary_indexes():
+    return [index for table in Base.metadata.sorted_tables
+            for index in table.indexes]
+
+
+@contextlib.contextmanager
+def bulk_load():
+    """Configure `engine` for loading lots of data, for the `with` block.
+
+    Echo is turned off, every new connection gets the `BULK_PRAGMAS`, and
+    the secondary indexes are dropped, to be built once at the end instead
+    of row by row. Unique constraints stay, since the loaders depend on
+    them. Afterwards, the indexes are created (including any missing from
+    an older database), the journal mode is put back and pooled connections
+    are closed, so new ones get the default settings again.
+
+    Enter it before opening any sessions.
+    """
+    echo = engine.echo
+    engine.echo = False
+    with engine.connect() as conn:
+        journal_mode = conn.execute('PRAGMA journal_mode').scalar()
+        existing = set(index['name'] for table in Base.metadata.sorted_tables
+                       for index in sa.inspect(conn).get_indexes(table.name))
+        for index in _secondary_indexes():
+            if index.name in existing:
+                index.drop(conn)
+
+    sa.event.listen(engine, 'connect', _set_bulk_pragmas)
+    try:
+        yield engine
+    finally:
+        sa.event.remove(engine, 'connect', _set_bulk_pragmas)
+        Session.remove()
+        engine.dispose()
+        with engine.connect() as conn:
+            for index in _secondary_indexes():
+                index.create(conn)
+            conn.execute('PRAGMA journal_mode={}'.format(journal_mode))
+        engine.echo = echo
+
 
 class Directorate(UniqueMixin, Base):
     id = Column(Integer, primary_key=True)
@@ -54,7 +127,7 @@ class Division(UniqueMixin, Base):
     phone = Column(String(15), unique=True)
     dir_id = Column(
         Integer, ForeignKey('directorate.id', ondelete='CASCADE'),
-        nullable=False)
+        nullable=False, index=True)
     programs = saorm.relationship(
         'Program', backref='division',
         cascade='all, delete-orphan', passive_deletes=True)
@@ -78,7 +151,8 @@ class Program(UniqueMixin, Base):
     id = Column(Integer, primary_key=True)
     code = Column(CHAR(4), unique=True, nullable=False)
     name = Column(String(80))
-    div_id = Column(CHAR(4), ForeignKey('division.id', ondelete='CASCADE'))
+    div_id = Column(CHAR(4), ForeignKey('division.id', ondelete='CASCADE'),
+                    index=True)
 
     related_programs = association_proxy(
         '_related_programs', 'secondary',
@@ -136,7 +210,7 @@ class RelatedPrograms(UniqueMixin, Base):
     @classmethod
     def unique_filter(cls, query, pgm1_id, pgm2_id):
         return query.filter(
-            RelatedPrograms.pgm1_id == pgm1_id and
+            RelatedPrograms.pgm1_id == pgm1_id,
             RelatedPrograms.pgm2_id == pgm2_id)
 
 
@@ -175,9 +249,10 @@ class Funding(UniqueMixin, Base):
         primary_key=True)
     award_id = Column(
         Integer, ForeignKey('award.id', ondelete='CASCADE'),
-        primary_key=True)
+        primary_key=True, index=True)
 
-    program = saorm.relationship('Program', uselist=False, single_parent=True)
+    program = saorm.relationship(
+        'Program', uselist=False) # single_parent=True)
     award = saorm.relationship(
         'Award', uselist=False, # single_parent=True,
         backref=saorm.backref(
@@ -190,12 +265,16 @@ class Funding(UniqueMixin, Base):
         self.award = award
 
     @classmethod
-    def unique_hash(cls, pgm_id, award_id):
-        return (pgm_id, award_id)
+    def unique_hash(cls, pgm, award):
+        return (pgm.id, award.id)
+
+    @classmethod
+    def unique_row_hash(cls, row):
+        return (row['pgm_id'], row['award_id'])
 
     @classmethod
     def unique_filter(cls, query, pgm, award):
-        return query.filter(Funding.pgm_id == pgm.id and
+        return query.filter(Funding.pgm_id == pgm.id,
                             Funding.award_id == award.id)
 
 
@@ -242,26 +321,29 @@ class Address(UniqueMixin, Base):
         return (street, city, state, country, zipcode)
 
     @classmethod
-    def unique_filter(cls, query, *args, **kwargs):
-        return query.filter_by(*args)
+    def unique_filter(cls, query, street, city, state, country, zipcode,
+                      *args, **kwargs):
+        return query.filter_by(street=street, city=city, state=state,
+                               country=country, zipcode=zipcode)
 
 
 class Institution(UniqueMixin, Base):
     id = Column(Integer, primary_key=True)
     name = Column(String(100), nullable=False)
     phone = Column(String(15), unique=True)
-    address_id = Column(Integer, ForeignKey('address.id', ondelete='SET NULL'))
+    address_id = Column(Integer, ForeignKey('address.id', ondelete='SET NULL'),
+                        index=True)
     address = saorm.relationship('Address', uselist=False)
 
-    people = association_proxy('_people', 'person')
+    people = association_proxy('affiliations', 'person')
 
     @classmethod
     def unique_hash(cls, name, phone, *args, **kwargs):
         return phone
 
     @classmethod
-    def unique_filter(cls, query, *args, **kwargs):
-        return query.filter_by(*args)
+    def unique_filter(cls, query, name, phone, *args, **kwargs):
+        return query.filter_by(phone=phone)
 
 
 class Person(UniqueMixin, Base):
@@ -283,25 +365,29 @@ class Person(UniqueMixin, Base):
     )
 
     @classmethod
-    def unique_hash(cls, *args, **kwargs):
-        return args
+    def unique_hash(cls, fname, lname, mname, *args, **kwargs):
+        return (fname, lname, mname)
 
     @classmethod
-    def unique_filter(cls, query, *args, **kwargs):
-        return query.filter_by(*args)
+    def unique_filter(cls, query, fname, lname, mname, *args, **kwargs):
+        return query.filter_by(fname=fname, lname=lname, mname=mname)
+
+    @staticmethod
+    def parse_name(name):
+        """Split a full name into the name columns of the person table."""
+        parts = NAMES(name)
+        return {
+            'fname': parts['first'].strip('.'),
+            'lname': parts['last'].strip('.'),
+            'mname': parts['middle'].strip('.'),
+            'title': parts['title'].strip('.'),
+            'suffix': parts['suffix'].strip('.'),
+            'nickname': parts['nickname'].strip('.')
+        }
 
     @classmethod
     def from_fullname(cls, session, name, email=None):
-        parsed_name = nameparser.HumanName(name)
-        return cls.as_unique(session,
-            fname=parsed_name.first.strip('.'),
-            lname=parsed_name.last.strip('.'),
-            mname=parsed_name.middle.strip('.'),
-            title=parsed_name.title.strip('.'),
-            suffix=parsed_name.suffix.strip('.'),
-            nickname=parsed_name.nickname.strip('.'),
-            email=email
-        )
+        return cls.as_unique(session, email=email, **cls.parse_name(name))
 
     @hybrid_property
     def full_name(self):
@@ -346,7 +432,7 @@ class Author(UniqueMixin, Base):
 
     @classmethod
     def unique_filter(cls, query, person_id, award_id, *args, **kwargs):
-        return query.filter(Role.person_id == person_id and
+        return query.filter(Role.person_id == person_id,
                             Role.award_id == award_id)
 
 
@@ -356,14 +442,17 @@ class Role(UniqueMixin, Base):
         primary_key=True)
     award_id = Column(
         Integer, ForeignKey('award.id', ondelete='CASCADE'),
-        primary_key=True)
+        primary_key=True, index=True)
     role = Column(Enum('pi', 'copi', 'fpi', 'po'))
     start = Column(Date)
     end = Column(Date)
 
-    award = saorm.relationship('Award', uselist=False, single_parent=True)
+    award = saorm.relationship(
+        'Award', uselist=False, # single_parent=True,
+        backref=saorm.backref('roles', passive_deletes=True)
+    )
     person = saorm.relationship(
-        'Person', uselist=False, single_parent=True,
+        'Person', uselist=False, # single_parent=True,
         backref=saorm.backref(
             'roles', cascade='all, delete-orphan', passive_deletes=True)
     )
@@ -379,9 +468,13 @@ class Role(UniqueMixin, Base):
     def unique_hash(cls, person, award, *args, **kwargs):
         return (person.id, award.id)
 
+    @classmethod
+    def unique_row_hash(cls, row):
+        return (row['person_id'], row['award_id'])
+
     @classmethod
     def unique_filter(cls, query, person, award, *args, **kwargs):
-        return query.filter(Role.person_id == person.id and
+        return query.filter(Role.person_id == person.id,
                             Role.award_id == award.id)
 
 
@@ -391,10 +484,10 @@ class Affiliation(UniqueMixin, Base):
         primary_key=True)
     institution_id = Column(
         Integer, ForeignKey('institution.id', ondelete='CASCADE'),
-        primary_key=True)
+        primary_key=True, index=True)
     award_id = Column(
         Integer, ForeignKey('award.id', ondelete='CASCADE'),
-        primary_key=True)
+        primary_key=True, index=True)
 
     person = saorm.relationship(
         'Person',
@@ -423,16 +516,33 @@ class Affiliation(UniqueMixin, Base):
     def unique_hash(cls, person, institution, award, *args, **kwargs):
         return (person.id, institution.id, award.id)
 
+    @classmethod
+    def unique_row_hash(cls, row):
+        return (row['person_id'], row['institution_id'], row['award_id'])
+
     @classmethod
     def unique_filter(cls, query, person, institution, award,
                       *args, **kwargs):
         return query.filter(
-            Affiliation.person_id == person.id and
-            Affiliation.institution_id == institution.id and
+            Affiliation.person_id == person.id,
+            Affiliation.institution_id == institution.id,
             Affiliation.award_id == award.id
         )
 
 
+class ArchiveMember(BasicMixin, Base):
+    """An award file ingested from a year's zip archive, as it was then.
+
+    The CRC and size come from the member's `ZipInfo`, so later runs can
+    tell unchanged members apart without reading them.
+    """
+    year = Column(Integer, primary_key=True)
+    name = Column(String(50), primary_key=True)
+    crc = Column(Integer, nullable=False)
+    size = Column(Integer, nullable=False)
+    award_code = Column(CHAR(7))
+
+
 def main():
     Base.metadata.drop_all(engine)
     Base.metadata.create_all(engine)
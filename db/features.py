@@ -0,0 +1,520 @@
+"""
+Hashed bag-of-words features of award abstracts, for topic modelling and
+community detection.
+
+Abstracts are streamed in chunks, from the award table or from the parsed
+awards of the zip archives, and each is tokenized and hashed into one of
+`n_features` columns. No vocabulary is kept, so memory stays constant
+however many abstracts there are. The result is a sparse CSR matrix of term
+counts, one row per abstract, with `keys` mapping the rows back to
+`award.id` (or, for archives, to the AwardID).
+
+The matrix is written as raw arrays in a directory:
+
+    data.f32     the nonzero values
+    indices.i32  their columns
+    indptr.i64   where each row starts in `data` and `indices`
+    keys.i64     the award of each row
+    df.i64       the number of rows with each column, for TF-IDF
+    meta.json    the vectorizer settings and array sizes
+
+and `HashedFeatures` maps the files rather than reading them. TF-IDF is
+applied while reading, from the document frequencies, so one matrix serves
+both.
+
+The input is split into partitions: ranges of award ids, or years. Each
+partition is featurized into a shard of its own, by a pool of processes if
+asked, and the shards are merged in partition order. Every partition is
+ordered by key, so the output is the same byte for byte whatever the number
+of processes.
+
+Features are built in a temporary directory next to the output one and
+renamed into place when complete, so a failed run leaves the previous
+features as they were. Only a directory holding a `meta.json` is replaced.
+
+Usage::
+
+    python features.py <outdir> [-z zipdir [-y year ...]] [-j workers]
+        [-b bits] [--signed] [--sublinear] [--db url]
+
+"""
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import shutil
+import argparse
+import resource
+import tempfile
+import multiprocessing as mp
+
+import numpy as np
+import scipy.sparse as sp
+import sqlalchemy as sa
+
+import db
+
+
+# Hashed columns, as a power of two.
+BITS = 20
+
+# Abstracts vectorized and written per chunk.
+CHUNK_SIZE = 1000
+
+# Partitions of the award table per process, so uneven ones balance out.
+PARTITIONS_PER_WORKER = 4
+
+# Hashes of tokens remembered; cleared when full.
+TOKEN_CACHE = 200000
+
+STOP_WORDS = frozenset("""
+    a about above after again against all also am an and any are as at be
+    because been before being below between both but by can could did do
+    does doing down during each few for from further had has have having he
+    her here hers herself him himself his how i if in into is it its itself
+    just me more most my myself no nor not now of off on once only or other
+    our ours ourselves out over own same she should so some such than that
+    the their theirs them themselves then there these they this those
+    through to too under until up very was we were what when where which
+    while who whom why will with would you your yours yourself yourselves
+""".split())
+
+# Markup left in the abstracts, e.g. "<br/>" and "&lt;br/&gt;".
+_MARKUP = re.compile(r'<[^>]*>|&\w+;')
+_TOKEN = re.compile(r'[a-z][a-z0-9]+')
+
+# The arrays of a feature directory: (file name, dtype) by array.
+FILES = {
+    'data': ('data.f32', np.float32),
+    'indices': ('indices.i32', np.int32),
+    'indptr': ('indptr.i64', np.int64),
+    'keys': ('keys.i64', np.int64),
+    'df': ('df.i64', np.int64)
+}
+META = 'meta.json'
+
+
+def _path(path, name):
+    return os.path.join(path, FILES[name][0])
+
+
+class HashingVectorizer(object):
+    """Turn texts into rows of hashed term counts.
+
+    Tokens are lowercased runs of letters and digits starting with a
+    letter, at least two characters long, without the `STOP_WORDS`. Each is
+    hashed with CRC-32, which is the same in every process and on every
+    platform, into one of `2 ** bits` columns.
+
+    :param int bits: Number of columns, as a power of two.
+    :param bool signed: Add or subtract each count, by one more bit of the
+        hash, so collisions tend to cancel out rather than add up.
+    :param bool sublinear: Use 1 + log(count) instead of the count.
+    """
+
+    def __init__(self, bits=BITS, signed=False, sublinear=False):
+        self.bits = bits
+        self.n_features = 1 << bits
+        self.signed = signed
+        self.sublinear = sublinear
+        self._hashes = {}
+
+    def settings(self):
+        return {'bits': self.bits, 'signed': self.signed,
+                'sublinear': self.sublinear}
+
+    def tokenize(self, text):
+        return [token for token in _TOKEN.findall(
+                    _MARKUP.sub(' ', text).lower())
+                if token not in STOP_WORDS]
+
+    def _hash(self, token):
+        """Return the (column, sign) of a token."""
+        try:
+            return self._hashes[token]
+        except KeyError:
+            if len(self._hashes) >= TOKEN_CACHE:
+                self._hashes.clear()
+            value = zlib.crc32(token.encode('utf-8')) & 0xffffffff
+            sign = -1 if self.signed and value >> 31 else 1
+            hashed = self._hashes[token] = (
+                value & (self.n_features - 1), sign)
+            return hashed
+
+    def transform(self, texts):
+        """Vectorize texts into a CSR matrix, one row each."""
+        data, indices, indptr = [], [], [0]
+        for text in texts:
+            counts = {}
+            for token in self.tokenize(text):
+                column, sign = self._hash(token)
+                counts[column] = counts.get(column, 0) + sign
+            for column in sorted(counts):
+                count = counts[column]
+                if count:
+                    indices.append(column)
+                    data.append(count)
+            indptr.append(len(indices))
+
+        data = np.array(data, dtype=np.float32)
+        if self.sublinear:
+            data = np.sign(data) * (1 + np.log(np.abs(data)))
+        return sp.csr_matrix(
+            (data, np.array(indices, dtype=np.int32),
+             np.array(indptr, dtype=np.int64)),
+            shape=(len(texts), self.n_features))
+
+
+class FeatureWriter(object):
+    """Append rows of features to a feature directory.
+
+    Rows are written to the files as they come; only the document
+    frequencies are held in memory.
+    """
+
+    def __init__(self, path, vectorizer, key):
+        self.path = path
+        self.vectorizer = vectorizer
+        self.key = key
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.files = dict(
+            (name, open(_path(path, name), 'wb'))
+            for name in ('data', 'indices', 'indptr', 'keys'))
+        self.df = np.zeros(vectorizer.n_features, dtype=np.int64)
+        self.rows = 0
+        self.nnz = 0
+        np.zeros(1, dtype=np.int64).tofile(self.files['indptr'])
+
+    def write(self, keys, texts):
+        """Vectorize the texts and append them, as the rows of `keys`."""
+        matrix = self.vectorizer.transform(texts)
+        matrix.data.astype(np.float32).tofile(self.files['data'])
+        matrix.indices.astype(np.int32).tofile(self.files['indices'])
+        (matrix.indptr[1:] + self.nnz).astype(np.int64).tofile(
+            self.files['indptr'])
+        np.asarray(keys, dtype=np.int64).tofile(self.files['keys'])
+        self.df += np.bincount(matrix.indices,
+                               minlength=self.vectorizer.n_features)
+        self.rows += len(keys)
+        self.nnz += matrix.nnz
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.df.tofile(_path(self.path, 'df'))
+        _write_meta(self.path, self.vectorizer.settings(), self.key,
+                    self.rows, self.nnz)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        self.close()
+        return False
+
+
+def _write_meta(path, settings, key, rows, nnz):
+    meta = dict(settings, key=key, rows=rows, nnz=nnz,
+                n_features=1 << settings['bits'])
+    with open(os.path.join(path, META), 'w') as f:
+        json.dump(meta, f, indent=2, sort_keys=True)
+
+
+class HashedFeatures(object):
+    """A feature directory, memory-mapped.
+
+    :param str path: Directory written by `FeatureWriter` or `merge`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META)) as f:
+            self.meta = json.load(f)
+        self.n_features = self.meta['n_features']
+        self.key = self.meta['key']
+        self.data, self.indices, self.indptr, self.keys, self.df = [
+            self._map(name) for name in
+            ('data', 'indices', 'indptr', 'keys', 'df')]
+
+    def _map(self, name):
+        filename, dtype = _path(self.path, name), FILES[name][1]
+        if not os.path.getsize(filename):
+            return np.empty(0, dtype=dtype)
+        return np.memmap(filename, dtype=dtype, mode='r')
+
+    def __len__(self):
+        return len(self.keys)
+
+    def matrix(self):
+        """All rows, as a CSR matrix over the mapped arrays."""
+        return sp.csr_matrix(
+            (self.data, self.indices, self.indptr),
+            shape=(len(self), self.n_features), copy=False)
+
+    def idf(self):
+        """Smoothed inverse document frequency of each column:
+        log((1 + rows) / (1 + df)) + 1.
+        """
+        return (np.log((1.0 + len(self)) / (1.0 + self.df)) +
+                1).astype(np.float32)
+
+    def chunks(self, size=CHUNK_SIZE, tfidf=False):
+        """Yield (keys, CSR matrix) for consecutive chunks of rows.
+
+        With `tfidf`, counts are weighted by `idf` and every row is
+        scaled to unit length.
+        """
+        idf = self.idf() if tfidf else None
+        for start in range(0, len(self), size):
+            stop = min(start + size, len(self))
+            first, last = self.indptr[start], self.indptr[stop]
+            chunk = sp.csr_matrix(
+                (np.array(self.data[first:last]),
+                 np.array(self.indices[first:last]),
+                 np.array(self.indptr[start:stop + 1]) - first),
+                shape=(stop - start, self.n_features))
+            if tfidf:
+                chunk.data *= idf[chunk.indices]
+                norms = np.sqrt(np.asarray(
+                    chunk.multiply(chunk).sum(axis=1)).ravel())
+                norms[norms == 0] = 1
+                chunk = sp.csr_matrix(sp.diags(1 / norms).dot(chunk))
+            yield np.array(self.keys[start:stop]), chunk
+
+
+def merge(shards, path):
+    """Concatenate shard directories into one, in the order given.
+
+    Arrays are copied a block at a time, so this runs in constant memory.
+    """
+    first = HashedFeatures(shards[0])
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    settings = dict((name, first.meta[name])
+                    for name in ('bits', 'signed', 'sublinear'))
+    df = np.zeros(first.n_features, dtype=np.int64)
+    rows = nnz = 0
+    outputs = dict(
+        (name, open(_path(path, name), 'wb'))
+        for name in ('data', 'indices', 'indptr', 'keys'))
+    try:
+        np.zeros(1, dtype=np.int64).tofile(outputs['indptr'])
+        for shard in shards:
+            features = HashedFeatures(shard)
+            for name in ('data', 'indices', 'keys'):
+                with open(_path(shard, name), 'rb') as f:
+                    shutil.copyfileobj(f, outputs[name])
+            for start in range(1, len(features.indptr), CHUNK_SIZE * 100):
+                (features.indptr[start:start + CHUNK_SIZE * 100] +
+                 nnz).tofile(outputs['indptr'])
+            df += features.df
+            rows += len(features)
+            nnz += features.meta['nnz']
+    finally:
+        for f in outputs.values():
+            f.close()
+    df.tofile(_path(path, 'df'))
+    _write_meta(path, settings, first.key, rows, nnz)
+    return HashedFeatures(path)
+
+
+def db_partitions(engine, parts):
+    """Split the awards with an abstract into `parts` ranges of ids of
+    about equal size.
+
+    :return: List of (first id, id after the last).
+    """
+    award = db.Award.__table__
+    has_abstract = award.c.abstract != None
+    count = engine.execute(
+        sa.select([sa.func.count()]).where(has_abstract)).scalar()
+    if not count:
+        return []
+    bounds = []
+    for part in range(parts):
+        offset = count * part // parts
+        bounds.append(engine.execute(
+            sa.select([award.c.id]).where(has_abstract).order_by(
+                award.c.id).limit(1).offset(offset)).scalar())
+    last = engine.execute(
+        sa.select([sa.func.max(award.c.id)]).where(has_abstract)).scalar()
+    bounds = sorted(set(bounds)) + [last + 1]
+    return zip(bounds[:-1], bounds[1:])
+
+
+def db_abstracts(engine, start, stop, chunk_size=CHUNK_SIZE):
+    """Yield (ids, abstracts) chunks of the awards with ids in
+    [start, stop), by id.
+    """
+    award = db.Award.__table__
+    query = sa.select([award.c.id, award.c.abstract]).where(
+        (award.c.id >= start) & (award.c.id < stop) &
+        (award.c.abstract != None)).order_by(award.c.id)
+    result = engine.execute(query)
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield [row[0] for row in rows], [row[1] for row in rows]
+
+
+def archive_abstracts(zipdir, year, chunk_size=CHUNK_SIZE):
+    """Yield (AwardIDs, abstracts) chunks of the awards of a year, in
+    archive order, leaving out awards without an abstract.
+    """
+    from awards import AwardExplorer
+
+    keys, texts = [], []
+    for award in AwardExplorer(zipdir, 'lxml')[year]:
+        if not award.abstract:
+            continue
+        keys.append(int(award.id))
+        texts.append(award.abstract)
+        if len(keys) == chunk_size:
+            yield keys, texts
+            keys, texts = [], []
+    if keys:
+        yield keys, texts
+
+
+def _featurize_partition(task):
+    """Write the shard of one partition: (source, partition, shard path,
+    vectorizer settings), where source is ('db', url) or ('zip', zipdir).
+    """
+    (kind, location), partition, path, settings = task
+    vectorizer = HashingVectorizer(**settings)
+    if kind == 'db':
+        engine = sa.create_engine(location)
+        chunks = db_abstracts(engine, *partition)
+        key = 'award.id'
+    else:
+        chunks = archive_abstracts(location, partition)
+        key = 'AwardID'
+    with FeatureWriter(path, vectorizer, key) as writer:
+        for keys, texts in chunks:
+            writer.write(keys, texts)
+    if kind == 'db':
+        engine.dispose()
+    return path
+
+
+def featurize(path, url=None, zipdir=None, years=None, workers=1,
+              bits=BITS, signed=False, sublinear=False):
+    """Featurize every abstract into the feature directory `path`.
+
+    Abstracts are read from the database at `url`, or with `zipdir`, from
+    the archives of the given years (all by default).
+
+    :param int workers: Processes featurizing partitions in parallel.
+    :return: The `HashedFeatures` written.
+    :raises ValueError: If `path` exists and is not a feature directory.
+    """
+    path = os.path.abspath(path)
+    if os.path.lexists(path) and not os.path.isfile(os.path.join(path, META)):
+        raise ValueError(
+            '{} exists and is not a feature directory'.format(path))
+
+    settings = {'bits': bits, 'signed': signed, 'sublinear': sublinear}
+    if zipdir is not None:
+        from awards import AwardExplorer
+        source = ('zip', zipdir)
+        partitions = sorted(years or AwardExplorer(zipdir).years())
+    else:
+        engine = sa.create_engine(url)
+        source = ('db', url)
+        partitions = db_partitions(
+            engine, max(1, workers) * PARTITIONS_PER_WORKER)
+        engine.dispose()
+
+    parent, name = os.path.split(path)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    build = tempfile.mkdtemp(prefix='.{}-'.format(name), dir=parent)
+    try:
+        output = os.path.join(build, 'features')
+        shard_dir = os.path.join(build, 'shards')
+        os.makedirs(shard_dir)
+        tasks = [(source, partition,
+                  os.path.join(shard_dir, '{:05d}'.format(i)), settings)
+                 for i, partition in enumerate(partitions)]
+        if not tasks:
+            shard = os.path.join(shard_dir, '00000')
+            FeatureWriter(shard, HashingVectorizer(**settings),
+                          'AwardID' if zipdir else 'award.id').close()
+            shards = [shard]
+        elif workers > 1:
+            pool = mp.Pool(workers)
+            try:
+                shards = pool.map(_featurize_partition, tasks, chunksize=1)
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            shards = [_featurize_partition(task) for task in tasks]
+        merge(shards, output)
+
+        # swap the new features in for the old ones, if any
+        if os.path.lexists(path):
+            os.rename(path, os.path.join(build, 'previous'))
+        os.rename(output, path)
+    finally:
+        shutil.rmtree(build)
+    return HashedFeatures(path)
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser(
+        description='Write hashed term counts of the award abstracts.')
+    parser.add_argument(
+        'outdir', action='store',
+        help='directory to write the features to; an existing feature '
+             'directory is replaced')
+    parser.add_argument(
+        '-z', '--zipdir', action='store', default=None,
+        help='read the abstracts from the archives in this directory '
+             'rather than from the database')
+    parser.add_argument(
+        '-y', '--years', action='store', nargs='+', type=int, default=None,
+        help='with --zipdir, only these years (default: all years)')
+    parser.add_argument(
+        '-j', '--workers', action='store', type=int, default=1,
+        help='featurize with N processes (default: 1)')
+    parser.add_argument(
+        '-b', '--bits', action='store', type=int, default=BITS,
+        help='use 2**BITS columns (default: {})'.format(BITS))
+    parser.add_argument(
+        '--signed', action='store_true',
+        help='alternate the sign of counts by hash, so collisions cancel')
+    parser.add_argument(
+        '--sublinear', action='store_true',
+        help='store 1 + log(count) instead of counts')
+    parser.add_argument(
+        '--db', action='store', default=None, metavar='URL',
+        help='database to read (default: the one in db.py)')
+    return parser
+
+
+def main():
+    args = setup_parser().parse_args()
+    start = time.time()
+    try:
+        features = featurize(
+            args.outdir, args.db or str(db.engine.url), args.zipdir,
+            args.years, args.workers, args.bits, args.signed, args.sublinear)
+    except ValueError as e:
+        print e
+        return 2
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print '{} abstracts, {} nonzeros, {} columns in {}'.format(
+        len(features), features.meta['nnz'], features.n_features,
+        args.outdir)
+    print '{:.2f}s, peak RSS {:.1f} MiB'.format(
+        time.time() - start, rss / 1024.0)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,470 @@
+"""
+Generate synthetic award archives, for benchmarks and for trying out the
+loaders without downloading the real data.
+
+Each year is written as `<year>.zip` holding one `<AwardID>.xml` per award,
+like the archives from nsf.gov. Elements appear in the order of
+docs/raw-schema.xsd, with every optional element present. Values are written
+the way the real archives write them, which is not always the type the
+schema declares: dates are mm/dd/yyyy, role codes are role names, and
+ARRAAmount is usually empty.
+
+People, institutions and programs are drawn from pools shared by all years,
+with a Zipf-like skew, so a few names and addresses recur very often and
+most rarely, as in the real data. Recurring people and institutions are
+spelled a little differently now and then (middle initial dropped, email
+missing, street abbreviated, country misspelled), so the de-duplication in
+the loaders has something to do.
+
+The output depends only on the arguments: the same seed gives the same
+archives.
+
+Usage::
+
+    python gen_corpus.py <outdir> [year ...] [-n awards per year]
+        [-i investigators] [-s institutions] [-p programs] [-r references]
+        [--people N] [--orgs N] [--seed N]
+
+"""
+import os
+import sys
+import bisect
+import random
+import zipfile
+import argparse
+import datetime
+
+from lxml import etree
+
+
+FIRST_NAMES = [
+    'James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael',
+    'Linda', 'William', 'Elizabeth', 'David', 'Barbara', 'Richard', 'Susan',
+    'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Charles', 'Karen', 'Wei', 'Li',
+    'Xin', 'Yan', 'Hiroshi', 'Yuki', 'Raj', 'Priya', 'Anil', 'Sunita',
+    'Ahmed', 'Fatima', 'Olga', 'Ivan', 'Kwame', 'Amara', 'Carlos', 'Maria',
+    'Jose', u'Jos\xe9', 'Ana', 'Pierre', 'Claire', u'J\xfcrgen', 'Ingrid',
+    'Sean', 'Siobhan', 'Min-Jun', 'Seo-yeon', 'Mohammad', 'Leila'
+]
+
+LAST_NAMES = [
+    'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Miller', 'Davis',
+    'Garcia', 'Rodriguez', 'Wilson', 'Martinez', 'Anderson', 'Taylor',
+    'Thomas', 'Moore', 'Jackson', 'Lee', 'Chen', 'Wang', 'Zhang', 'Liu',
+    'Kim', 'Park', 'Nguyen', 'Patel', 'Singh', 'Tanaka', 'Suzuki', 'Ivanov',
+    'Novak', u'M\xfcller', 'Schmidt', "O'Brien", 'McDonald', 'Mensah',
+    'Okafor', 'Haddad', 'Rossi', 'Dubois', 'van der Berg', 'De La Cruz'
+]
+
+# Last names beyond the common ones are made of these, so large pools do not
+# run out of distinct people.
+SYLLABLES = [
+    'an', 'ber', 'cal', 'dor', 'el', 'fen', 'gar', 'hol', 'is', 'jor', 'kel',
+    'lin', 'mar', 'nor', 'os', 'per', 'quin', 'ros', 'sten', 'tor', 'ul',
+    'val', 'wick', 'yor', 'zan', 'ford', 'son', 'ley', 'ton', 'berg'
+]
+
+SUFFIXES = ['Jr', 'Sr', 'II', 'III', 'PhD']
+
+ORGANIZATIONS = [
+    ('Directorate for Mathematical & Physical Sciences', [
+        'Division Of Mathematical Sciences', 'Division Of Physics',
+        'Division Of Chemistry', 'Division Of Materials Research',
+        'Division Of Astronomical Sciences']),
+    ('Directorate for Computer & Information Science & Engineering', [
+        'Division of Computing and Communication Foundations',
+        'Division Of Computer and Network Systems',
+        'Div Of Information & Intelligent Systems']),
+    ('Directorate for Engineering', [
+        'Div Of Civil, Mechanical, & Manufact Inn',
+        'Div Of Electrical, Commun & Cyber Sys',
+        'Div Of Chem, Bioeng, Env, & Transp Sys']),
+    ('Directorate for Biological Sciences', [
+        'Division Of Environmental Biology',
+        'Div Of Molecular and Cellular Bioscience',
+        'Division Of Integrative Organismal Systems']),
+    ('Directorate for Geosciences', [
+        'Division Of Ocean Sciences', 'Div Of Atmospheric & Geospace Sciences',
+        'Division Of Earth Sciences']),
+    ('Directorate for Education & Human Resources', [
+        'Division Of Undergraduate Education',
+        'Division Of Graduate Education'])
+]
+
+INSTRUMENTS = ['Standard Grant', 'Continuing grant', 'Cooperative Agreement',
+               'Fellowship', 'Contract']
+
+# 'Former Co-Principal Investigator' is left out: the role table does not
+# allow it yet.
+ROLES = ['Principal Investigator', 'Co-Principal Investigator',
+         'Former Principal Investigator']
+
+INSTITUTION_KINDS = [u'University of {}', u'{} State University',
+                     u'{} Institute of Technology', u'{} College',
+                     u'{} University', u'Research Foundation of {}']
+
+STREET_KINDS = [('Street', 'St'), ('Avenue', 'Ave'), ('Boulevard', 'Blvd'),
+                ('Road', 'Rd'), ('Drive', 'Dr'), ('Parkway', 'Pkwy')]
+
+DIRECTIONS = [('North', 'N'), ('South', 'S'), ('East', 'E'), ('West', 'W'),
+              ('', '')]
+
+CITIES = [
+    ('Springfield', 'Illinois', 'IL'), ('Columbus', 'Ohio', 'OH'),
+    ('Cambridge', 'Massachusetts', 'MA'), ('Austin', 'Texas', 'TX'),
+    ('Berkeley', 'California', 'CA'), ('Ann Arbor', 'Michigan', 'MI'),
+    ('Madison', 'Wisconsin', 'WI'), ('Boulder', 'Colorado', 'CO'),
+    ('Seattle', 'Washington', 'WA'), ('Atlanta', 'Georgia', 'GA'),
+    ('Fairfax', 'Virginia', 'VA'), ('Ithaca', 'New York', 'NY'),
+    ('Gainesville', 'Florida', 'FL'), ('Tucson', 'Arizona', 'AZ'),
+    ('Baltimore', 'Maryland', 'MD'), ('Pittsburgh', 'Pennsylvania', 'PA')
+]
+
+# (name, how it is sometimes misspelled); nearly all institutions are in the
+# United States.
+FOREIGN_COUNTRIES = [
+    ('Canada', 'CANADA '), ('United Kingdom', 'England'),
+    ('Germany', 'Germany '), ('Japan', 'JAPAN'),
+    ('Korea, South', 'South Korea'), ('Brazil', 'Brasil')
+]
+
+WORDS = (
+    'collaborative research quantum network graph protein climate ocean '
+    'learning data robust model dynamics structure synthesis theory '
+    'adaptive sensing materials catalysis genome ecology turbulence '
+    'inference optimization scalable infrastructure education workshop '
+    'career early development mechanisms evolution coastal polar '
+    'algorithms systems interfaces energy storage imaging').split()
+
+FOA_NAMES = ['Other Applications NEC', 'Education and Human Resources',
+             'Engineering and Technology', 'Life Sciences']
+
+
+def span(text):
+    """Parse a 'MIN-MAX' (or plain 'N') command line range."""
+    low, _, high = text.partition('-')
+    low = int(low)
+    high = int(high) if high else low
+    if not 0 <= low <= high:
+        raise argparse.ArgumentTypeError('bad range: {}'.format(text))
+    return low, high
+
+
+class Skewed(object):
+    """Draw from a pool with probability falling as 1 / rank ** `s`."""
+
+    def __init__(self, items, s=1.1):
+        self.items = items
+        total = 0.0
+        self.cumulative = []
+        for rank in range(1, len(items) + 1):
+            total += 1.0 / rank ** s
+            self.cumulative.append(total)
+
+    def draw(self, rnd):
+        point = rnd.random() * self.cumulative[-1]
+        return self.items[bisect.bisect(self.cumulative, point)]
+
+    def sample(self, rnd, k):
+        """Draw `k` distinct items (fewer if the pool is smaller)."""
+        k = min(k, len(self.items))
+        chosen = []
+        while len(chosen) < k:
+            item = self.draw(rnd)
+            if item not in chosen:
+                chosen.append(item)
+        return chosen
+
+
+class CorpusGenerator(object):
+    """Build the shared pools once, then generate awards from them.
+
+    :param int people: Size of the pool of investigators and officers.
+    :param int orgs: Size of the pool of institutions.
+    :param tuple investigators: (min, max) investigators per award.
+    :param tuple institutions: (min, max) institutions per award.
+    :param tuple programs: (min, max) program elements per award.
+    :param tuple references: (min, max) program references per award.
+    :param int abstract_words: Mean length of the abstracts.
+    :param int seed: Seed for the pools; each year is seeded from it too.
+    """
+
+    def __init__(self, people=2000, orgs=200, investigators=(1, 4),
+                 institutions=(1, 1), programs=(1, 2), references=(0, 3),
+                 abstract_words=250, seed=0):
+        self.investigators = investigators
+        self.institutions = institutions
+        self.programs = programs
+        self.references = references
+        self.abstract_words = abstract_words
+        self.seed = seed
+
+        rnd = random.Random(seed)
+        self.emails = set()
+        self.people = Skewed([self._person(rnd) for _ in range(people)])
+        self.orgs = Skewed([self._institution(rnd) for _ in range(orgs)])
+        self.officers = Skewed(
+            [self._person(rnd) for _ in range(max(1, people // 50))])
+
+        # each division funds its own program elements; references are shared
+        self.divisions = []
+        for directorate, divisions in ORGANIZATIONS:
+            for division in divisions:
+                elements = Skewed([
+                    (rnd.randint(1000, 8999), self._phrase(rnd, 3).upper())
+                    for _ in range(rnd.randint(5, 15))])
+                self.divisions.append((directorate, division, elements))
+        self.divisions = Skewed(self.divisions, s=0.5)
+        self.refs = Skewed([
+            (rnd.randint(1000, 9999), self._phrase(rnd, 2).upper())
+            for _ in range(200)])
+
+    @staticmethod
+    def _phrase(rnd, words):
+        return ' '.join(rnd.choice(WORDS) for _ in range(words))
+
+    def _person(self, rnd):
+        first = rnd.choice(FIRST_NAMES)
+        if rnd.random() < 0.5:
+            last = rnd.choice(LAST_NAMES)
+        else:
+            last = ''.join(rnd.choice(SYLLABLES)
+                           for _ in range(rnd.randint(2, 3))).capitalize()
+        middle = rnd.choice('ABCDEFGHJKLMNPRSTW') if rnd.random() < 0.4 else ''
+        suffix = rnd.choice(SUFFIXES) if rnd.random() < 0.03 else ''
+        # emails are unique in the database, so they must be in the pool
+        login = u'{}{}'.format(first[0], last).lower().replace(' ', '')
+        domain = rnd.choice(SYLLABLES) + 'u'
+        email = u'{}@{}.edu'.format(login, domain)
+        number = 1
+        while email in self.emails:
+            number += 1
+            email = u'{}{}@{}.edu'.format(login, number, domain)
+        self.emails.add(email)
+        return first, middle, last, suffix, email
+
+    @staticmethod
+    def _institution(rnd):
+        city, state, state_code = rnd.choice(CITIES)
+        place = rnd.choice([city, state, rnd.choice(LAST_NAMES)])
+        name = rnd.choice(INSTITUTION_KINDS).format(place)
+        direction = rnd.choice(DIRECTIONS)
+        kind = rnd.choice(STREET_KINDS)
+        number = rnd.randint(1, 9999)
+        street = rnd.choice(LAST_NAMES + [city])
+        long_street = u' '.join(
+            part for part in (str(number), direction[0], street, kind[0])
+            if part)
+        short_street = u' '.join(
+            part for part in (str(number), direction[1], street, kind[1])
+            if part)
+
+        if rnd.random() < 0.05:
+            country = rnd.choice(FOREIGN_COUNTRIES)
+        else:
+            country = ('United States', 'Untied States')
+        zipcode = '{:05d}{:04d}'.format(rnd.randint(501, 99950),
+                                        rnd.randint(0, 9999))
+        phone = '{}{:07d}'.format(rnd.randint(201, 989),
+                                  rnd.randint(0, 9999999))
+        return {
+            'Name': name,
+            'CityName': city,
+            'ZipCode': zipcode,
+            'PhoneNumber': phone,
+            'StreetAddress': (long_street, short_street),
+            'CountryName': country,
+            'StateName': state,
+            'StateCode': state_code
+        }
+
+    @staticmethod
+    def _date(date):
+        return date.strftime('%m/%d/%Y')
+
+    def award(self, rnd, year, number):
+        """Return the XML of one award, as utf-8 bytes.
+
+        :param rnd: The `random.Random` to draw from.
+        :param int number: Position of the award in the year; with the year,
+            it makes the AwardID.
+        """
+        award_id = '{:02d}{:05d}'.format(year % 100, number)
+        effective = datetime.date(year, 1, 1) + datetime.timedelta(
+            rnd.randint(0, 364))
+        expires = effective + datetime.timedelta(rnd.randint(365, 5 * 365))
+        amended = effective - datetime.timedelta(rnd.randint(0, 60))
+        last_amended = amended + datetime.timedelta(
+            rnd.choice([0, 0, rnd.randint(1, 700)]))
+        directorate, division, elements = self.divisions.draw(rnd)
+
+        root = etree.Element('rootTag')
+        award = etree.SubElement(root, 'Award')
+
+        def add(parent, tag, text=None):
+            element = etree.SubElement(parent, tag)
+            element.text = text
+            return element
+
+        title_words = rnd.randint(3, 12)
+        if rnd.random() < 0.2:
+            title = u'Collaborative Research: ' + self._phrase(
+                rnd, title_words)
+        else:
+            title = self._phrase(rnd, title_words)
+        add(award, 'AwardTitle', title.title())
+        add(award, 'AwardEffectiveDate', self._date(effective))
+        add(award, 'AwardExpirationDate', self._date(expires))
+        amount = rnd.randint(1, 2000) * 500
+        add(award, 'AwardAmount', str(amount))
+        instrument = add(award, 'AwardInstrument')
+        add(instrument, 'Value', rnd.choice(INSTRUMENTS))
+
+        org = add(award, 'Organization')
+        add(org, 'Code', '{:08d}'.format(rnd.randint(1000000, 9999999)))
+        add(add(org, 'Directorate'), 'LongName', directorate)
+        add(add(org, 'Division'), 'LongName', division)
+
+        officer = self.officers.draw(rnd)
+        add(add(award, 'ProgramOfficer'), 'SignBlockName',
+            u' '.join(part for part in officer[:3] if part))
+
+        words = max(0, int(rnd.gauss(self.abstract_words,
+                                     self.abstract_words / 3.0)))
+        add(award, 'AbstractNarration', self._phrase(rnd, words))
+        add(award, 'MinAmdLetterDate', self._date(amended))
+        add(award, 'MaxAmdLetterDate', self._date(last_amended))
+        arra = ''
+        if year in (2009, 2010) and rnd.random() < 0.3:
+            arra = str(rnd.randint(1, amount))
+        add(award, 'ARRAAmount', arra)
+        add(award, 'AwardID', award_id)
+
+        people = self.people.sample(rnd, rnd.randint(*self.investigators))
+        for i, (first, middle, last, suffix, email) in enumerate(people):
+            investigator = add(award, 'Investigator')
+            if middle:
+                if rnd.random() < 0.8:
+                    first = u'{} {}'.format(first, middle)
+                else:
+                    # without the initial this is another person to the
+                    # loader, which must not get the same email
+                    email = ''
+            if suffix:
+                last = u'{} {}'.format(last, suffix)
+            add(investigator, 'FirstName', first)
+            add(investigator, 'LastName', last)
+            add(investigator, 'EmailAddress',
+                email if rnd.random() < 0.8 else '')
+            start = effective if rnd.random() < 0.9 else last_amended
+            add(investigator, 'StartDate', self._date(start))
+            add(investigator, 'EndDate',
+                self._date(expires) if rnd.random() < 0.05 else '')
+            role = ROLES[0] if i == 0 else ROLES[1]
+            if i == 0 and rnd.random() < 0.05:
+                role = ROLES[2]
+            add(investigator, 'RoleCode', role)
+
+        for org in self.orgs.sample(rnd, rnd.randint(*self.institutions)):
+            institution = add(award, 'Institution')
+            for tag in ('Name', 'CityName', 'ZipCode', 'PhoneNumber',
+                        'StreetAddress', 'CountryName', 'StateName',
+                        'StateCode'):
+                value = org[tag]
+                if isinstance(value, tuple):
+                    value = value[rnd.random() < 0.1]
+                add(institution, tag, value)
+
+        foa = add(award, 'FoaInformation')
+        add(foa, 'Code', '{:07d}'.format(rnd.randint(0, 9999999)))
+        add(foa, 'Name', rnd.choice(FOA_NAMES))
+
+        for code, text in elements.sample(rnd, rnd.randint(*self.programs)):
+            element = add(award, 'ProgramElement')
+            add(element, 'Code', str(code))
+            add(element, 'Text', text)
+
+        for code, text in self.refs.sample(rnd, rnd.randint(*self.references)):
+            reference = add(award, 'ProgramReference')
+            add(reference, 'Code', str(code))
+            add(reference, 'Text', text)
+
+        return award_id, etree.tostring(
+            root, xml_declaration=True, encoding='UTF-8')
+
+    def write_year(self, outdir, year, count):
+        """Write `count` awards to `<outdir>/<year>.zip`; return its path."""
+        if count > 100000:
+            raise ValueError('at most 100000 awards per year fit the IDs')
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        path = os.path.join(outdir, '{}.zip'.format(year))
+        rnd = random.Random('{}:{}'.format(self.seed, year))
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for number in range(count):
+                award_id, data = self.award(rnd, year, number)
+                archive.writestr('{}.xml'.format(award_id), data)
+        return path
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser(
+        description='Write synthetic <year>.zip award archives.')
+    parser.add_argument(
+        'outdir', action='store',
+        help='directory to write the archives to')
+    parser.add_argument(
+        'years', action='store', nargs='*', type=int,
+        help='years to generate (default: 2010 2011)')
+    parser.add_argument(
+        '-n', '--awards', action='store', type=int, default=1000,
+        help='awards per year (default: 1000)')
+    parser.add_argument(
+        '-i', '--investigators', action='store', type=span, default=(1, 4),
+        metavar='MIN-MAX', help='investigators per award (default: 1-4)')
+    parser.add_argument(
+        '-s', '--institutions', action='store', type=span, default=(1, 1),
+        metavar='MIN-MAX', help='institutions per award (default: 1)')
+    parser.add_argument(
+        '-p', '--programs', action='store', type=span, default=(1, 2),
+        metavar='MIN-MAX', help='program elements per award (default: 1-2)')
+    parser.add_argument(
+        '-r', '--references', action='store', type=span, default=(0, 3),
+        metavar='MIN-MAX',
+        help='program references per award (default: 0-3)')
+    parser.add_argument(
+        '--people', action='store', type=int, default=None,
+        help='distinct people to draw from (default: one per award)')
+    parser.add_argument(
+        '--orgs', action='store', type=int, default=None,
+        help='distinct institutions to draw from '
+             '(default: one per 20 awards)')
+    parser.add_argument(
+        '--abstract-words', action='store', type=int, default=250,
+        help='mean words per abstract (default: 250)')
+    parser.add_argument(
+        '--seed', action='store', type=int, default=0)
+    return parser
+
+
+def main():
+    args = setup_parser().parse_args()
+    years = args.years or [2010, 2011]
+    total = args.awards * len(years)
+    generator = CorpusGenerator(
+        people=args.people or max(10, total),
+        orgs=args.orgs or max(5, total // 20),
+        investigators=args.investigators,
+        institutions=args.institutions,
+        programs=args.programs,
+        references=args.references,
+        abstract_words=args.abstract_words,
+        seed=args.seed)
+    for year in years:
+        path = generator.write_year(args.outdir, year, args.awards)
+        print 'wrote {} awards to {}'.format(args.awards, path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
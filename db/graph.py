@@ -0,0 +1,327 @@
+"""
+The co-investigator network, as a sparse matrix built straight from `role`.
+
+Walking `Person.awards` and `Award.people` loads every award and person
+through the ORM. Here the (award, person) pairs of `role` are read once, with
+a plain cursor, into NumPy arrays. They form a people x awards incidence
+matrix `B`, and the adjacency matrix of the network is
+
+    A = B W B^T
+
+without its diagonal, in CSR form. `W` is the identity by default, so
+`A[i, j]` is the number of awards people `i` and `j` share. With amount
+weighting, `W` holds each award's amount, so `A[i, j]` is the total amount
+of those awards. Rows and columns are numbered densely; `person_ids` maps
+them back to `person.id`, and `award_ids` does the same for the columns of
+`B`.
+
+A graph is cached as an `.npz` file, together with the roles and weighting
+it was built with and a stamp of its rows: a SHA-1 digest of the rows of
+`read_roles`, read in primary key order, so any change to them (a swapped
+role or amount included) changes the stamp. `cached` reads the rows again,
+and reuses the file while all three match; otherwise it builds the graph
+from the rows just read.
+
+Usage::
+
+    python graph.py [-o graph.npz] [-a] [-r pi,copi,fpi] [-t top]
+        [--db url] [--rebuild]
+
+"""
+import os
+import sys
+import time
+import hashlib
+import argparse
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+import db
+
+
+# Roles that make a person a co-investigator of an award; program officers
+# ('po') are left out.
+INVESTIGATOR_ROLES = ('pi', 'copi', 'fpi')
+
+# Rows fetched from the cursor per round trip.
+FETCH_SIZE = 100000
+
+
+def _select(roles, amount):
+    columns = 'role.award_id, role.person_id'
+    joins = ''
+    if amount:
+        columns += ', coalesce(award.amount, 0) AS amount'
+        joins = ' JOIN award ON award.id = role.award_id'
+    # in primary key order, which the index of the key gives without a sort
+    return ('SELECT {} FROM role{} WHERE role.role IN ({}) '
+            'ORDER BY role.person_id, role.award_id').format(
+                columns, joins,
+                ', '.join("'{}'".format(role) for role in roles))
+
+
+def read_roles(engine, roles=INVESTIGATOR_ROLES, amount=False,
+               fetch_size=FETCH_SIZE, digest=None):
+    """Read the (award id, person id[, amount]) rows of `role` in one pass.
+
+    :param digest: A `hashlib` hash to update with the rows as they are
+        read, in (person id, award id) order.
+    :return: An (n, 2) or, with `amount`, (n, 3) int64 array.
+    """
+    width = 3 if amount else 2
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(_select(roles, amount))
+        chunks = []
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.int64))
+            if digest is not None:
+                digest.update(chunks[-1].tobytes())
+        cursor.close()
+    finally:
+        conn.close()
+    if not chunks:
+        return np.empty((0, width), dtype=np.int64)
+    return np.concatenate(chunks)
+
+
+def stamped_roles(engine, roles=INVESTIGATOR_ROLES, amount=False):
+    """Read the rows as `read_roles` does, along with their stamp.
+
+    :return: (rows, hex SHA-1 digest of the rows)
+    """
+    digest = hashlib.sha1()
+    rows = read_roles(engine, roles, amount, digest=digest)
+    return rows, digest.hexdigest()
+
+
+def stamp(engine, roles=INVESTIGATOR_ROLES, amount=False):
+    """Digest the rows a graph is built from, to tell when they change."""
+    return stamped_roles(engine, roles, amount)[1]
+
+
+class CollaborationGraph(object):
+    """The co-investigator network; see the module docstring.
+
+    :param adjacency: Symmetric people x people `scipy.sparse.csr_matrix`.
+    :param person_ids: `person.id` of each row.
+    :param award_ids: `award.id` of each column of `incidence`.
+    :param incidence: People x awards `csr_matrix`, 1 where the person
+        was an investigator of the award.
+    :param stamp: `stamp` of the rows the graph was built from.
+    :param roles: Roles the graph was built from.
+    :param bool amount: Whether edges are weighed by amount.
+    """
+
+    def __init__(self, adjacency, person_ids, award_ids, incidence,
+                 stamp=None, roles=None, amount=False):
+        self.adjacency = adjacency
+        self.person_ids = person_ids
+        self.award_ids = award_ids
+        self.incidence = incidence
+        self.stamp = stamp
+        self.roles = roles
+        self.amount = amount
+
+    @classmethod
+    def from_roles(cls, rows, amount=False):
+        """Build the graph from the rows of `read_roles`."""
+        people, rows_of = np.unique(rows[:, 1], return_inverse=True)
+        awards, cols_of = np.unique(rows[:, 0], return_inverse=True)
+        shape = (len(people), len(awards))
+
+        incidence = sp.csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows_of, cols_of)),
+            shape=shape)
+        if amount:
+            weights = np.zeros(len(awards), dtype=np.float64)
+            weights[cols_of] = rows[:, 2]
+            weighted = sp.csr_matrix(
+                (weights[cols_of], (rows_of, cols_of)), shape=shape)
+        else:
+            weighted = incidence
+
+        adjacency = weighted.dot(incidence.T).tocsr()
+        adjacency.setdiag(0)
+        adjacency.eliminate_zeros()
+        return cls(adjacency, people, awards, incidence, amount=amount)
+
+    def __len__(self):
+        return len(self.person_ids)
+
+    @property
+    def edges(self):
+        """Number of collaborating pairs."""
+        return self.adjacency.nnz // 2
+
+    def index(self, person_id):
+        """Row of the person with this id; KeyError if not in the graph."""
+        i = np.searchsorted(self.person_ids, person_id)
+        if i == len(self.person_ids) or self.person_ids[i] != person_id:
+            raise KeyError(person_id)
+        return i
+
+    def neighbors(self, person_id):
+        """List the (person id, weight) of a person's co-investigators,
+        heaviest first.
+        """
+        row = self.adjacency.getrow(self.index(person_id))
+        order = np.argsort(-row.data, kind='mergesort')
+        return [(self.person_ids[row.indices[i]], row.data[i])
+                for i in order]
+
+    def awards(self, person_id):
+        """Ids of the awards a person was an investigator of."""
+        row = self.incidence.getrow(self.index(person_id))
+        return self.award_ids[row.indices]
+
+    def degrees(self):
+        """Number of co-investigators of each row."""
+        return np.diff(self.adjacency.indptr)
+
+    def components(self):
+        """Return (number of components, component label of each row)."""
+        return connected_components(self.adjacency, directed=False)
+
+    def save(self, path):
+        """Write the graph to an `.npz` file."""
+        np.savez(
+            path,
+            data=self.adjacency.data, indices=self.adjacency.indices,
+            indptr=self.adjacency.indptr,
+            incidence_indices=self.incidence.indices,
+            incidence_indptr=self.incidence.indptr,
+            person_ids=self.person_ids, award_ids=self.award_ids,
+            stamp=np.array(self.stamp or ''),
+            roles=np.array(self.roles or (), dtype=str),
+            amount=np.array(self.amount))
+
+    @classmethod
+    def load(cls, path):
+        """Read a graph written by `save`.
+
+        Files from before roles and weighting were saved load without a
+        stamp, so that `cached` builds them again.
+        """
+        with np.load(path) as saved:
+            people = len(saved['person_ids'])
+            adjacency = sp.csr_matrix(
+                (saved['data'], saved['indices'], saved['indptr']),
+                shape=(people, people))
+            incidence_indices = saved['incidence_indices']
+            incidence = sp.csr_matrix(
+                (np.ones(len(incidence_indices), dtype=np.int32),
+                 incidence_indices, saved['incidence_indptr']),
+                shape=(people, len(saved['award_ids'])))
+            stamp = roles = None
+            amount = False
+            if 'roles' in saved.files:
+                stamp = str(saved['stamp']) or None
+                roles = tuple(str(role) for role in saved['roles'])
+                amount = bool(saved['amount'])
+            return cls(adjacency, saved['person_ids'], saved['award_ids'],
+                       incidence, stamp, roles, amount)
+
+
+def build(engine, roles=INVESTIGATOR_ROLES, amount=False):
+    """Build the graph of the people with the given roles.
+
+    :param bool amount: Weigh edges by the amounts of the shared awards
+        rather than their number.
+    """
+    return _build(stamped_roles(engine, roles, amount), roles, amount)
+
+
+def _build(stamped, roles, amount):
+    rows, current = stamped
+    graph = CollaborationGraph.from_roles(rows, amount)
+    graph.stamp = current
+    graph.roles = tuple(roles)
+    return graph
+
+
+def cached(engine, path, roles=INVESTIGATOR_ROLES, amount=False,
+           rebuild=False):
+    """Load the graph cached at `path`, or build and cache it if the file
+    is missing, was built from other rows, roles or weighting, or `rebuild`
+    is set.
+    """
+    if rebuild or not os.path.exists(path):
+        graph = build(engine, roles, amount)
+    else:
+        stamped = stamped_roles(engine, roles, amount)
+        graph = CollaborationGraph.load(path)
+        if (graph.stamp == stamped[1] and graph.roles == tuple(roles) and
+                graph.amount == amount):
+            return graph
+        graph = _build(stamped, roles, amount)
+    graph.save(path)
+    return graph
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser(
+        description='Build the co-investigator network and cache it.')
+    parser.add_argument(
+        '-o', '--output', action='store', default='co-investigators.npz',
+        help='file to cache the graph in (default: co-investigators.npz)')
+    parser.add_argument(
+        '-a', '--amount', action='store_true',
+        help='weigh edges by the amounts of the shared awards')
+    parser.add_argument(
+        '-r', '--roles', action='store', default=','.join(INVESTIGATOR_ROLES),
+        help='comma-separated roles to include (default: {})'.format(
+            ','.join(INVESTIGATOR_ROLES)))
+    parser.add_argument(
+        '-t', '--top', action='store', type=int, default=10,
+        help='show the N people with the most co-investigators')
+    parser.add_argument(
+        '--db', action='store', default=None, metavar='URL',
+        help='database to read (default: the one in db.py)')
+    parser.add_argument(
+        '--rebuild', action='store_true',
+        help='rebuild the graph even if the cached one is current')
+    return parser
+
+
+def main():
+    args = setup_parser().parse_args()
+    if args.db:
+        db.use_database(args.db)
+    else:
+        db.engine.echo = False
+
+    roles = tuple(role.strip() for role in args.roles.split(','))
+    unknown = set(roles) - set(db.Role.role.type.enums)
+    if unknown:
+        print 'unknown roles: {}'.format(', '.join(sorted(unknown)))
+        return 2
+
+    start = time.time()
+    graph = cached(db.engine, args.output, roles, args.amount, args.rebuild)
+    seconds = time.time() - start
+    components, _ = graph.components()
+    size = sum(array.nbytes for array in (
+        graph.adjacency.data, graph.adjacency.indices,
+        graph.adjacency.indptr, graph.incidence.indices,
+        graph.incidence.indptr, graph.person_ids, graph.award_ids))
+    print '{} people, {} awards, {} edges, {} components'.format(
+        len(graph), len(graph.award_ids), graph.edges, components)
+    print '{:.2f}s, {:.1f} MiB, cached in {}'.format(
+        seconds, size / 1048576.0, args.output)
+
+    degrees = graph.degrees()
+    for i in np.argsort(-degrees, kind='mergesort')[:args.top]:
+        print '{:>8} {:>6} co-investigators'.format(
+            graph.person_ids[i], degrees[i])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,262 @@
+"""
+Optional instrumentation of award loading.
+
+Nothing is measured until a `Profiler` is enabled with `enable`. It then
+collects, separately for each label (the loaders label by year):
+
+1.  wall time and call counts of the stages of `parse.parse_award`, as
+    marked by `stage`,
+2.  SQL statements, rows affected and execution time, per table and verb,
+    from engine events; rows are None (n/a) for statements the driver
+    reports no row count for, such as SELECTs in sqlite3,
+3.  flushes, the objects they wrote and their time, from session events,
+4.  hits and misses of the `as_unique` caches, per class: a hit is served by
+    the session cache or `UniqueIndex`; a miss is either found by a query or
+    created.
+
+With `cprofile`, a `cProfile.Profile` runs while the profiler is enabled, and
+its stats can be dumped for `pstats` or a viewer.
+
+While disabled, `stage` returns a shared no-op context manager and the
+counting hooks return after one global lookup, so the marked code runs at
+practically full speed.
+
+"""
+import re
+import time
+import cProfile
+from collections import OrderedDict
+
+import sqlalchemy as sa
+
+
+# The enabled `Profiler`, or None.
+ACTIVE = None
+
+
+class _NullStage(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name):
+    """Context manager timing the block as the stage `name`, if enabled."""
+    if ACTIVE is None:
+        return _NULL_STAGE
+    return _Stage(ACTIVE.current['stages'], name)
+
+
+def label(name):
+    """Attribute what follows to `name` (e.g. a year), if enabled."""
+    if ACTIVE is not None:
+        ACTIVE.label = name
+
+
+def count_unique(cls, outcome):
+    """Count an `as_unique` lookup of `cls`: 'hit', 'found' or 'created'."""
+    if ACTIVE is not None:
+        counts = ACTIVE.current['unique'].setdefault(
+            cls.__name__, {'hit': 0, 'found': 0, 'created': 0})
+        counts[outcome] += 1
+
+
+class _Stage(object):
+    __slots__ = ('stages', 'name', 'start')
+
+    def __init__(self, stages, name):
+        self.stages = stages
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.time() - self.start
+        totals = self.stages.get(self.name)
+        if totals is None:
+            self.stages[self.name] = totals = [0, 0.0]
+        totals[0] += 1
+        totals[1] += elapsed
+        return False
+
+
+# Verb and table of the statements the loaders issue.
+_STATEMENT = re.compile(
+    r'\s*(INSERT(?:\s+OR\s+\w+)?\s+INTO|UPDATE|DELETE\s+FROM'
+    r'|SELECT\b.*?\bFROM)'
+    r'\s+"?(\w+)', re.IGNORECASE | re.DOTALL)
+
+
+def _classify(statement):
+    """Return (verb, table) of an SQL statement; table is '' if unknown."""
+    match = _STATEMENT.match(statement)
+    if match is None:
+        words = statement.split(None, 1)
+        return (words[0].upper() if words else ''), ''
+    return match.group(1).split(None, 1)[0].upper(), match.group(2)
+
+
+class Profiler(object):
+    """Collects the measurements described in the module docstring.
+
+    :param bool cprofile: Also run `cProfile` while enabled.
+    """
+
+    def __init__(self, cprofile=False):
+        self.labels = OrderedDict()
+        self.label = None
+        self.cprofile = cProfile.Profile() if cprofile else None
+        self._listeners = []
+        self._statement_start = None
+        self._flush_start = None
+
+    @property
+    def current(self):
+        try:
+            return self.labels[self.label]
+        except KeyError:
+            counters = {'stages': {}, 'sql': {}, 'flushes': [0, 0, 0.0],
+                        'unique': {}}
+            self.labels[self.label] = counters
+            return counters
+
+    def _listen(self, target, event, fn):
+        sa.event.listen(target, event, fn)
+        self._listeners.append((target, event, fn))
+
+    def install(self, engine, session_factory):
+        """Listen to the statements of `engine` and the flushes of sessions
+        made by `session_factory`.
+        """
+        self._listen(engine, 'before_cursor_execute', self._before_execute)
+        self._listen(engine, 'after_cursor_execute', self._after_execute)
+        self._listen(session_factory, 'before_flush', self._before_flush)
+        self._listen(session_factory, 'after_flush_postexec',
+                     self._after_flush)
+
+    def uninstall(self):
+        for target, event, fn in self._listeners:
+            sa.event.remove(target, event, fn)
+        self._listeners = []
+
+    def _before_execute(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        self._statement_start = time.time()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        elapsed = time.time() - (self._statement_start or time.time())
+        key = '{} {}'.format(*_classify(statement)).strip()
+        totals = self.current['sql'].get(key)
+        if totals is None:
+            self.current['sql'][key] = totals = [0, 0, 0.0]
+        totals[0] += 1
+        if cursor.rowcount < 0:
+            totals[1] = None
+        elif totals[1] is not None:
+            totals[1] += cursor.rowcount
+        totals[2] += elapsed
+
+    def _before_flush(self, session, flush_context, instances):
+        self._flush_start = time.time()
+        flushes = self.current['flushes']
+        flushes[1] += len(session.new) + len(session.dirty) + len(
+            session.deleted)
+
+    def _after_flush(self, session, flush_context):
+        flushes = self.current['flushes']
+        flushes[0] += 1
+        flushes[2] += time.time() - (self._flush_start or time.time())
+
+    def summary(self):
+        """Return the measurements as a JSON-serializable dict by label."""
+        summary = OrderedDict()
+        for name, counters in self.labels.items():
+            flushes, objects, seconds = counters['flushes']
+            summary[str(name)] = {
+                'stages': dict(
+                    (stage, {'calls': calls, 'seconds': seconds})
+                    for stage, (calls, seconds) in counters['stages'].items()),
+                'sql': dict(
+                    (key, {'statements': statements, 'rows': rows,
+                           'seconds': seconds})
+                    for key, (statements, rows, seconds)
+                    in counters['sql'].items()),
+                'flushes': {'flushes': flushes, 'objects': objects,
+                            'seconds': seconds},
+                'unique': dict(
+                    (cls, dict(counts)) for cls, counts
+                    in counters['unique'].items())
+            }
+        return summary
+
+    def dump_cprofile(self, path):
+        """Write the `cProfile` stats to `path`, for `pstats`."""
+        self.cprofile.dump_stats(path)
+
+
+def enable(engine, session_factory, cprofile=False):
+    """Start measuring with a new `Profiler`, and return it."""
+    global ACTIVE
+    if ACTIVE is not None:
+        disable()
+    profiler = Profiler(cprofile)
+    profiler.install(engine, session_factory)
+    ACTIVE = profiler
+    if profiler.cprofile is not None:
+        profiler.cprofile.enable()
+    return profiler
+
+
+def disable():
+    """Stop measuring; return the `Profiler` that was enabled, if any."""
+    global ACTIVE
+    profiler, ACTIVE = ACTIVE, None
+    if profiler is not None:
+        if profiler.cprofile is not None:
+            profiler.cprofile.disable()
+        profiler.uninstall()
+    return profiler
+
+
+def format_summary(summary):
+    """Render `Profiler.summary` as lines of text, one block per label."""
+    lines = []
+    for name, counters in summary.items():
+        lines.append('{}:'.format(name))
+        lines.append('  stages:')
+        for stage, totals in sorted(counters['stages'].items(),
+                                    key=lambda item: -item[1]['seconds']):
+            lines.append('    {:<14} {:>8} calls {:>9.3f}s'.format(
+                stage, totals['calls'], totals['seconds']))
+
+        flushes = counters['flushes']
+        lines.append('  flushes: {flushes} writing {objects} objects, '
+                     '{seconds:.3f}s'.format(**flushes))
+
+        lines.append('  sql:')
+        for key, totals in sorted(counters['sql'].items(),
+                                  key=lambda item: -item[1]['seconds']):
+            rows = totals['rows']
+            lines.append('    {:<28} {:>8} stmts {:>8} rows {:>9.3f}s'.format(
+                key, totals['statements'], 'n/a' if rows is None else rows,
+                totals['seconds']))
+
+        lines.append('  unique lookups:')
+        for cls, counts in sorted(counters['unique'].items()):
+            lookups = sum(counts.values())
+            lines.append(
+                '    {:<16} {:>8} hits {:>8} found {:>8} created '
+                '({:.1%} hits)'.format(
+                    cls, counts['hit'], counts['found'], counts['created'],
+                    counts['hit'] / float(lookups) if lookups else 0.0))
+    return lines
@@ -0,0 +1,382 @@
+"""
+Record linkage of institutions.
+
+`Institution.unique_hash` keys on the phone number alone, so name variants
+of one institution ("Univ of Texas at Austin", "University of Texas at
+Austin") with different phones become separate rows. This resolver finds
+them and maps every institution to a canonical one.
+
+Institutions are grouped into blocks by location, and only pairs sharing a
+block are compared:
+
+1.  `zip_key`: country, state and the first five characters of the
+    zipcode.
+2.  `city_key`: country, state and city.
+
+Within a block, only institutions whose names share an informative token
+(not one of `GENERIC_TOKENS`) are paired, so a large block such as a big
+city does not blow up quadratically. Pairs are scored with a symmetric
+variant of Soft TF-IDF (Cohen et al., 2003; see
+docs/duplicate-record-detection.md). Each name's tokens are weighted by
+their inverse document frequency over all names, and a token matches the
+most similar token of the other name if their Jaro-Winkler similarity is at
+least `TOKEN_SIMILARITY`, so abbreviations and typos still count. The score
+is the weighted share of one name's tokens matched in the other, taken
+both ways, whichever is lower; a name with extra informative words ("State")
+does not match the shorter one. Pairs scoring at least `THRESHOLD` are
+linked, and linked institutions form clusters whose canonical institution
+is the one with the lowest id.
+
+Blocks are scored by a pool of processes. The clusters do not depend on the
+order the blocks are scored in, so the mapping is the same for any number
+of processes. It is written to `institution_canonical`, one row per
+institution.
+
+Usage::
+
+    python linkage.py [-j workers] [-t threshold] [-s clusters] [-n]
+        [--db url]
+
+"""
+from __future__ import division
+
+import re
+import sys
+import math
+import time
+import argparse
+import itertools
+import multiprocessing as mp
+
+import jellyfish
+import sqlalchemy as sa
+from sqlalchemy import Column, Integer, FLOAT
+
+import db
+from bulk import _chunks
+from mixins import BasicMixin
+
+
+# Name similarity at or above which two institutions are the same.
+THRESHOLD = 0.9
+
+# Jaro-Winkler similarity at or above which two name tokens match.
+TOKEN_SIMILARITY = 0.9
+
+# Blocks scored per task.
+BLOCKS_PER_TASK = 200
+
+# Tokens too common in institution names to pair candidates by.
+GENERIC_TOKENS = frozenset("""
+    CENTER COLLEGE COMPANY CORPORATION FOUNDATION INSTITUTE RESEARCH SCHOOL
+    STATE TECHNOLOGY UNIVERSITY
+""".split())
+
+# Tokens dropped from names before comparing them.
+NOISE_TOKENS = frozenset("""
+    A AN AND AT FOR IN INC INCORPORATED LLC LTD OF ON THE
+""".split())
+
+# Abbreviations expanded before comparing names.
+ABBREVIATIONS = {
+    u'CO': u'COMPANY',
+    u'COLL': u'COLLEGE',
+    u'CORP': u'CORPORATION',
+    u'CTR': u'CENTER',
+    u'FDN': u'FOUNDATION',
+    u'INST': u'INSTITUTE',
+    u'RES': u'RESEARCH',
+    u'TECH': u'TECHNOLOGY',
+    u'U': u'UNIVERSITY',
+    u'UNIV': u'UNIVERSITY'
+}
+
+_WORD = re.compile(r'[^\W_]+', re.UNICODE)
+
+
+class InstitutionCanonical(BasicMixin, db.Base):
+    institution_id = Column(Integer, primary_key=True)
+    canonical_id = Column(Integer, nullable=False, index=True)
+    score = Column(FLOAT)
+
+
+def tokens(name):
+    """Split a name into uppercase words, with abbreviations expanded and
+    the `NOISE_TOKENS` left out.
+    """
+    if not name:
+        return []
+    words = _WORD.findall(unicode(name).upper())
+    return [ABBREVIATIONS.get(word, word) for word in words
+            if word not in NOISE_TOKENS]
+
+
+def _alnum(value):
+    return u''.join(c for c in (value or u'').upper() if c.isalnum())
+
+
+def zip_key(record):
+    zipcode = _alnum(record['zipcode'])[:5]
+    if not zipcode:
+        return None
+    return (record['country'], record['state'], zipcode)
+
+
+def city_key(record):
+    city = _alnum(record['city'])
+    if not city:
+        return None
+    return (record['country'], record['state'], city)
+
+
+KEYS = (zip_key, city_key)
+
+
+def blocks(records, keys=KEYS):
+    """Group record indexes by each key; yield the blocks of two or more.
+    """
+    for key in keys:
+        grouped = {}
+        for i, record in enumerate(records):
+            k = key(record)
+            if k is not None:
+                grouped.setdefault(k, []).append(i)
+        for members in grouped.itervalues():
+            if len(members) > 1:
+                yield members
+
+
+def block_pairs(records, members):
+    """Pairs (i, j), i < j, of a block's members whose names share an
+    informative token.
+    """
+    by_token = {}
+    for i in members:
+        for token in records[i]['tokens']:
+            if token not in GENERIC_TOKENS:
+                by_token.setdefault(token, []).append(i)
+    pairs = set()
+    for sharing in by_token.itervalues():
+        pairs.update(itertools.combinations(sorted(sharing), 2))
+    return pairs
+
+
+def token_weights(records):
+    """Weigh each record's distinct tokens by their inverse document
+    frequency over the names of all `records`.
+    """
+    df = {}
+    for record in records:
+        for token in set(record['tokens']):
+            df[token] = df.get(token, 0) + 1
+    n = len(records)
+    for record in records:
+        record['weights'] = dict(
+            (token, math.log(n / df[token] + 1))
+            for token in set(record['tokens']))
+
+
+def _coverage(a, b, similarity):
+    """Weighted share of the tokens of `a` that match a token of `b`."""
+    total = matched = 0.0
+    for token, weight in a.iteritems():
+        total += weight
+        if token in b:
+            matched += weight
+            continue
+        best = max(jellyfish.jaro_winkler(token, other) for other in b)
+        if best >= similarity:
+            matched += weight * best
+    return matched / total
+
+
+def name_similarity(a, b, similarity=TOKEN_SIMILARITY):
+    """Similarity of two names, from 0 to 1, given their token weights."""
+    if not a or not b:
+        return 0.0
+    return min(_coverage(a, b, similarity), _coverage(b, a, similarity))
+
+
+# State of each worker, set when the pool starts.
+_worker = {}
+
+
+def _init_worker(records, threshold):
+    _worker['records'] = records
+    _worker['threshold'] = threshold
+
+
+def _score_blocks(task):
+    """Score the candidate pairs of some blocks; return the (i, j, score)
+    of those at or above the threshold, and the number of pairs scored.
+    """
+    records = _worker['records']
+    threshold = _worker['threshold']
+    matches = []
+    scored = 0
+    for members in task:
+        for i, j in block_pairs(records, members):
+            scored += 1
+            score = name_similarity(records[i]['weights'],
+                                    records[j]['weights'])
+            if score >= threshold:
+                matches.append((i, j, score))
+    return matches, scored
+
+
+def load_records(conn):
+    """Read every institution with its address, by id."""
+    institution = db.Institution.__table__
+    address = db.Address.__table__
+    query = sa.select([
+        institution.c.id, institution.c.name, institution.c.phone,
+        address.c.street, address.c.city, address.c.state,
+        address.c.country, address.c.zipcode
+    ]).select_from(institution.outerjoin(
+        address, address.c.id == institution.c.address_id)).order_by(
+        institution.c.id)
+    records = []
+    for row in conn.execute(query):
+        record = dict(row)
+        record['tokens'] = tokens(record['name'])
+        records.append(record)
+    return records
+
+
+def _find(parents, i):
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+
+def clusters(n, matches):
+    """Group indexes 0..n-1 linked by `matches` (i, j, score); return the
+    root index of each, which is the lowest index of its cluster.
+    """
+    parents = range(n)
+    for i, j, _ in matches:
+        root_i, root_j = _find(parents, i), _find(parents, j)
+        if root_i != root_j:
+            parents[max(root_i, root_j)] = min(root_i, root_j)
+    return [_find(parents, i) for i in range(n)]
+
+
+def resolve(records, workers=None, threshold=THRESHOLD):
+    """Link the records; return (root index of each record, best match
+    score of each record or None, stats dict).
+
+    :param int workers: Processes scoring blocks; the CPU count by default,
+        and in this process if 1.
+    """
+    start = time.time()
+    token_weights(records)
+    all_blocks = sorted(blocks(records), key=len, reverse=True)
+    tasks = list(_chunks(all_blocks, BLOCKS_PER_TASK))
+
+    if workers == 1:
+        _init_worker(records, threshold)
+        results = map(_score_blocks, tasks)
+    else:
+        pool = mp.Pool(workers, _init_worker, (records, threshold))
+        try:
+            results = pool.map(_score_blocks, tasks, chunksize=1)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    best = [None] * len(records)
+    matches = []
+    scored = 0
+    for found, count in results:
+        scored += count
+        matches.extend(found)
+        for i, j, score in found:
+            for k in (i, j):
+                if best[k] is None or score > best[k]:
+                    best[k] = score
+    roots = clusters(len(records), matches)
+    stats = {
+        'institutions': len(records),
+        'blocks': len(all_blocks),
+        'largest_block': len(all_blocks[0]) if all_blocks else 0,
+        'pairs_scored': scored,
+        'matches': len(set((i, j) for i, j, _ in matches)),
+        'clusters': len(set(roots)),
+        'seconds': time.time() - start
+    }
+    return roots, best, stats
+
+
+def write_mapping(conn, records, roots, best):
+    """Replace the contents of `institution_canonical`."""
+    table = InstitutionCanonical.__table__
+    table.create(conn, checkfirst=True)
+    conn.execute(table.delete())
+    rows = [{'institution_id': record['id'],
+             'canonical_id': records[root]['id'],
+             'score': best[i]}
+            for i, (record, root) in enumerate(zip(records, roots))]
+    for chunk in _chunks(rows):
+        conn.execute(table.insert(), chunk)
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser(
+        description='Map every institution to a canonical institution.')
+    parser.add_argument(
+        '-j', '--workers', action='store', type=int, default=None,
+        help='score blocks with N processes (default: all CPUs)')
+    parser.add_argument(
+        '-t', '--threshold', action='store', type=float, default=THRESHOLD,
+        help='name similarity at which institutions are the same '
+             '(default: {})'.format(THRESHOLD))
+    parser.add_argument(
+        '-s', '--show', action='store', type=int, default=0, metavar='N',
+        help='print the N largest clusters')
+    parser.add_argument(
+        '-n', '--dry-run', action='store_true',
+        help='do not write the mapping to the database')
+    parser.add_argument(
+        '--db', action='store', default=None, metavar='URL',
+        help='database to resolve (default: the one in db.py)')
+    return parser
+
+
+def main():
+    args = setup_parser().parse_args()
+    if args.db:
+        db.use_database(args.db)
+    else:
+        db.engine.echo = False
+
+    with db.engine.connect() as conn:
+        records = load_records(conn)
+    roots, best, stats = resolve(records, args.workers, args.threshold)
+    print ('{institutions} institutions, {blocks} blocks (largest '
+           '{largest_block}), {pairs_scored} pairs scored, {matches} '
+           'matches, {clusters} clusters in {seconds:.2f}s').format(**stats)
+
+    if args.show:
+        members = {}
+        for i, root in enumerate(roots):
+            members.setdefault(root, []).append(i)
+        largest = sorted((group for group in members.values()
+                          if len(group) > 1), key=len, reverse=True)
+        for group in largest[:args.show]:
+            print u'{}:'.format(records[group[0]]['id']).encode('utf-8')
+            for i in group:
+                print u'    {:>6} {} ({})'.format(
+                    records[i]['id'], records[i]['name'],
+                    records[i]['city']).encode('utf-8')
+
+    if not args.dry_run:
+        with db.engine.begin() as conn:
+            write_mapping(conn, records, roots, best)
+        print 'mapping written to {}'.format(
+            InstitutionCanonical.__tablename__)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
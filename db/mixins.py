@@ -2,8 +2,15 @@
 Mixins for database tables to inherit from.
 """
 import re
+from collections import OrderedDict
+
+import sqlalchemy as sa
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
 
+import instrument
+
 
 class BasicMixin(object):
 
@@ -27,30 +34,301 @@ class BasicMixin(object):
         return classy + args
 
 
+class UniqueIndex(object):
+    """Bounded map from "unique" keys to rows, shareable across sessions.
+
+    By default the unique recipe keeps a plain dict per session, which
+    starts cold and grows without limit. An index attached to a session with
+    `attach` replaces that dict. It can be warmed from the DB with one query
+    per mapped class, and since it remembers column values rather than
+    session-bound objects, it stays valid across sessions and commits.
+
+    Entries are evicted least recently used first once there are more than
+    `maxsize` of them. Objects that are still pending (not yet flushed, so
+    without a primary key) are never evicted, which keeps the recipe from
+    creating duplicates. After a rollback, `clear` the index: it may name rows
+    that were never committed.
+
+    :param int maxsize: Maximum number of keys to keep; None for no limit.
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def attach(self, session):
+        """Use this index for all `as_unique` calls made with `session`."""
+        session._unique_index = self
+        return session
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        """Return hit/miss counts, the hit rate, evictions and size."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / float(lookups) if lookups else 0.0,
+            'evictions': self.evictions,
+            'size': len(self._entries)
+        }
+
+    def warm(self, session, *classes):
+        """Load the keys of all rows of each class, one query per class.
+
+        Keys are computed from each row by the class's `unique_row_hash`.
+        """
+        for cls in classes:
+            mapper = sa.inspect(cls)
+            table = cls.__table__
+            for row in session.execute(table.select()):
+                row = dict(row)
+                key = (cls, cls.unique_row_hash(row))
+                self._store(key, dict(
+                    (prop.key, row[prop.columns[0].name])
+                    for prop in mapper.column_attrs))
+
+    def get(self, session, key):
+        """Return the object for `key` in `session`, or None on a miss."""
+        cls = key[0]
+        try:
+            entry = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+
+        if isinstance(entry, (tuple, dict)):
+            obj = self._instance(session, cls, entry)
+        else:
+            state = sa.inspect(entry)
+            if state.session_id == session.hash_key:
+                obj = entry
+            elif state.identity is not None:
+                entry = self._values(state)
+                obj = self._instance(session, cls, entry)
+            else:
+                # pending in some other session that never flushed it
+                self.misses += 1
+                return None
+
+        self._entries[key] = entry
+        self.hits += 1
+        return obj
+
+    def put(self, key, obj):
+        self._store(key, obj)
+
+    def _store(self, key, entry):
+        self._entries.pop(key, None)
+        self._entries[key] = entry
+        self._evict()
+
+    def _evict(self):
+        if self.maxsize is None:
+            return
+
+        # Each entry is inspected at most once per call, so a table full of
+        # pending objects cannot loop forever.
+        for _ in range(len(self._entries)):
+            if len(self._entries) <= self.maxsize:
+                break
+            key, entry = self._entries.popitem(last=False)
+            if not isinstance(entry, (tuple, dict)):
+                identity = sa.inspect(entry).identity
+                if identity is None:
+                    self._entries[key] = entry
+                    continue
+            self.evictions += 1
+
+    @staticmethod
+    def _values(state):
+        """The column values of a persistent object, or its primary key if
+        some are not loaded.
+        """
+        values = {}
+        for prop in state.mapper.column_attrs:
+            if prop.key not in state.dict:
+                return state.identity
+            values[prop.key] = state.dict[prop.key]
+        return values
+
+    @staticmethod
+    def _instance(session, cls, entry):
+        """Get the object with the primary key or column values `entry`
+        without any SQL.
+
+        Column values not in `entry` are loaded lazily, the first time they
+        are used. Collections are not loaded at all: they start out empty,
+        so appending to them takes no SQL, and only hold what is added to
+        them until the object is expired (e.g. by a commit).
+        """
+        mapper = sa.inspect(cls)
+        if isinstance(entry, dict):
+            values = entry
+            ident = tuple(values[mapper.get_property_by_column(col).key]
+                          for col in mapper.primary_key)
+        else:
+            values = dict(
+                (mapper.get_property_by_column(col).key, value)
+                for col, value in zip(mapper.primary_key, entry))
+            ident = entry
+        obj = session.identity_map.get(
+            mapper.identity_key_from_primary_key(ident))
+        if obj is None:
+            obj = mapper.class_manager.new_instance()
+            for key, value in values.items():
+                setattr(obj, key, value)
+            make_transient_to_detached(obj)
+            for prop in mapper.relationships:
+                if prop.uselist:
+                    set_committed_value(obj, prop.key, [])
+            session.add(obj)
+        return obj
+
+
+class IdAllocator(object):
+    """Client-side primary keys for new rows, reserved in blocks per table.
+
+    Rows get their id when they are created rather than when they are
+    flushed, so objects that refer to them (by id, as the unique hashes of
+    `Funding`, `Role` and `Affiliation` do) can be built without a flush,
+    and many awards can be written in one flush.
+
+    Each block is `block_size` ids after the larger of the table's
+    `MAX(id)` and the end of the previous block, so only one query is made
+    per table per block. Ids are only unique while this is the one writer
+    to the database; ids that are never flushed (e.g. after a rollback)
+    are simply skipped.
+
+    Attach an allocator to a session with `attach`; objects created by
+    `as_unique` on that session then get ids. Only classes with a single
+    integer primary key are given ids.
+
+    :param int block_size: Number of ids to reserve per table at a time.
+    """
+
+    def __init__(self, block_size=1000):
+        self.block_size = block_size
+        self._blocks = {}
+        self._columns = {}
+        self.allocated = 0
+        self.reserved = 0
+
+    def attach(self, session):
+        """Give ids to all objects `as_unique` creates with `session`."""
+        session._id_allocator = self
+        return session
+
+    def stats(self):
+        return {'allocated': self.allocated, 'blocks': self.reserved}
+
+    def _id_column(self, cls):
+        """The key of the integer primary key attribute of `cls`, or None.
+        """
+        try:
+            return self._columns[cls]
+        except KeyError:
+            mapper = sa.inspect(cls)
+            key = None
+            if len(mapper.primary_key) == 1:
+                column = mapper.primary_key[0]
+                if isinstance(column.type, sa.Integer):
+                    key = mapper.get_property_by_column(column).key
+            self._columns[cls] = key
+            return key
+
+    def _reserve(self, session, cls, key):
+        column = getattr(cls, key)
+        highest = session.query(sa.func.max(column)).scalar() or 0
+        block = self._blocks.get(cls)
+        start = max(highest + 1, block[1] if block else 0)
+        self._blocks[cls] = block = [start, start + self.block_size]
+        self.reserved += 1
+        return block
+
+    def allocate(self, session, cls):
+        """Return the next free id of `cls`'s table."""
+        key = self._id_column(cls)
+        if key is None:
+            raise ValueError('{} has no integer primary key'.format(
+                cls.__name__))
+        block = self._blocks.get(cls)
+        if block is None or block[0] >= block[1]:
+            block = self._reserve(session, cls, key)
+        ident = block[0]
+        block[0] += 1
+        self.allocated += 1
+        return ident
+
+    def assign(self, session, obj):
+        """Give `obj` an id, if its class has one to give and it has none.
+        """
+        key = self._id_column(type(obj))
+        if key is not None and getattr(obj, key) is None:
+            setattr(obj, key, self.allocate(session, type(obj)))
+        return obj
+
+
 def _unique(session, cls, hashfunc, queryfunc, constructor, arg, kw):
     """Provide the "guts" to the unique recipe. This function is given a
     Session to work with, and associates a dictionary with the Session() which
-    keeps track of current "unique" keys.
+    keeps track of current "unique" keys. If a `UniqueIndex` is attached to
+    the Session, it is used instead of the dictionary.
     """
+    index = getattr(session, '_unique_index', None)
+    if index is not None:
+        key = (cls, hashfunc(*arg, **kw))
+        obj = index.get(session, key)
+        if obj is None:
+            obj = _query_or_create(
+                session, cls, queryfunc, constructor, arg, kw)
+            index.put(key, obj)
+        else:
+            instrument.count_unique(cls, 'hit')
+        return obj
+
     cache = getattr(session, '_unique_cache', None)
     if cache is None:
         session._unique_cache = cache = {}
 
     key = (cls, hashfunc(*arg, **kw))
     if key in cache:
+        instrument.count_unique(cls, 'hit')
         return cache[key]
     else:
-        with session.no_autoflush:
-            q = session.query(cls)
-            q = queryfunc(q, *arg, **kw)
-            obj = q.first()
-            if not obj:
-                obj = constructor(*arg, **kw)
-                session.add(obj)
+        obj = _query_or_create(session, cls, queryfunc, constructor, arg, kw)
         cache[key] = obj
         return obj
 
 
+def _query_or_create(session, cls, queryfunc, constructor, arg, kw):
+    with session.no_autoflush:
+        q = session.query(cls)
+        q = queryfunc(q, *arg, **kw)
+        obj = q.first()
+        if not obj:
+            obj = constructor(*arg, **kw)
+            allocator = getattr(session, '_id_allocator', None)
+            if allocator is not None:
+                allocator.assign(session, obj)
+            session.add(obj)
+            instrument.count_unique(cls, 'created')
+        else:
+            instrument.count_unique(cls, 'found')
+    return obj
+
+
 class UniqueMixin(BasicMixin):
     @classmethod
     def unique_hash(cls, *arg, **kw):
@@ -60,6 +338,15 @@ class UniqueMixin(BasicMixin):
     def unique_filter(cls, query, *arg, **kw):
         raise NotImplementedError()
 
+    @classmethod
+    def unique_row_hash(cls, row):
+        """Compute `unique_hash` from a dict of a row's column values.
+
+        This works as is for classes whose `unique_hash` takes column values;
+        classes that hash related objects must override it.
+        """
+        return cls.unique_hash(**row)
+
     @classmethod
     def as_unique(cls, session, *arg, **kw):
         return _unique(session, cls,
@@ -0,0 +1,318 @@
+"""
+Precompiled normalizers for the free-text fields of award records.
+
+These are the fast paths behind `awards.closest_country_code`,
+`db.Person.parse_name` and friends.
+They are built once from the lookup tables in ../data and then memoize their
+results, since the same raw values repeat across tens of thousands of awards.
+
+"""
+import re
+import shelve
+from collections import OrderedDict
+from difflib import SequenceMatcher
+
+import nameparser
+
+
+class LRUCache(object):
+    """A dict bounded to `maxsize` entries, evicting least recently used.
+
+    Counts hits and misses of `get`, for reporting cache effectiveness.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / float(lookups) if lookups else 0.0,
+            'size': len(self._data)
+        }
+
+
+class StreetNormalizer(object):
+    """Abbreviate the common elements of street addresses in one pass.
+
+    All substitutions are compiled into a single alternation regex with the
+    longest keys first, so the input is scanned once, left to right, and at
+    each position the longest matching key wins. Replaced text is never
+    scanned again. This agrees with applying the substitutions one by one
+    (the original approach) except where that approach gave different
+    results depending on the order the table happened to be iterated in,
+    e.g. for "WEST VIRGINIA" versus "VIRGINIA".
+
+    Results are memoized, since institution addresses repeat heavily.
+
+    :param dict subs: Map of upper case long forms to their abbreviations.
+    :param int maxsize: Number of normalized addresses to remember.
+    """
+
+    def __init__(self, subs, maxsize=10000):
+        self.subs = subs
+        keys = sorted(subs, key=lambda key: (-len(key), key))
+        self.pattern = re.compile(u'|'.join(re.escape(key) for key in keys))
+        self.memo = LRUCache(maxsize)
+
+    def _sub(self, match):
+        return self.subs[match.group(0)]
+
+    def __call__(self, street_address):
+        normalized = self.memo.get(street_address)
+        if normalized is None:
+            caps = street_address.upper()
+            stripped = caps.strip('.').strip()
+            normalized = self.pattern.sub(self._sub, stripped)
+            self.memo.put(street_address, normalized)
+        return normalized
+
+
+class NameParser(object):
+    """Split full names into their parts with `nameparser.HumanName`,
+    remembering the results.
+
+    `HumanName` is slow, and the same names (program officers above all)
+    appear on thousands of awards. Names are looked up, after collapsing
+    runs of whitespace, in a bounded in-memory memo first and then in an
+    optional persistent store, so they are parsed at most once per store.
+
+    The parts are returned as parsed, without stripping punctuation; that is
+    left to the callers, which differ in what they strip.
+
+    :param int maxsize: Number of parsed names to keep in memory.
+    :param str path: File of a `shelve` store to keep parsed names in across
+        runs; none by default.
+    """
+
+    PARTS = ('first', 'middle', 'last', 'title', 'suffix', 'nickname')
+
+    def __init__(self, maxsize=50000, path=None):
+        self.memo = LRUCache(maxsize)
+        self.store = shelve.open(path, protocol=2) if path else None
+        self.store_hits = 0
+        self.parsed = 0
+
+    @staticmethod
+    def key(name):
+        if isinstance(name, str):
+            name = name.decode('utf-8')
+        return u' '.join(name.split())
+
+    def __call__(self, name):
+        """Return a dict of the `PARTS` of `name`."""
+        key = self.key(name)
+        parts = self.memo.get(key)
+        if parts is None:
+            store_key = key.encode('utf-8')
+            if self.store is not None and store_key in self.store:
+                parts = self.store[store_key]
+                self.store_hits += 1
+            else:
+                human = nameparser.HumanName(key)
+                parts = dict((part, getattr(human, part))
+                             for part in self.PARTS)
+                self.parsed += 1
+                if self.store is not None:
+                    self.store[store_key] = parts
+            self.memo.put(key, parts)
+        return dict(parts)
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    def stats(self):
+        """Memo statistics, plus store hits and the names actually parsed.
+        """
+        stats = self.memo.stats()
+        lookups = self.memo.hits + self.memo.misses
+        stats['store_hits'] = self.store_hits
+        stats['parsed'] = self.parsed
+        stats['hit_rate'] = (1 - self.parsed / float(lookups)
+                             if lookups else 0.0)
+        return stats
+
+
+def _ngrams(text, n):
+    padded = u' {} '.format(text)
+    return set(padded[i:i + n] for i in range(len(padded) - n + 1))
+
+
+class CountryCodeResolver(object):
+    """Map free-text country names to codes by closest name.
+
+    The result is always the code of the name with the highest
+    `SequenceMatcher` ratio, ties going to the name that comes first in the
+    table's iteration order; that is, exactly what a scan of the whole table
+    returns. It is found faster in three ways:
+
+    1.  exact names (nearly all inputs) are a dict lookup,
+    2.  resolved inputs are memoized, and
+    3.  on a true miss, names are scored in order of the number of character
+        n-grams they share with the input, and names whose cheap upper bounds
+        (`real_quick_ratio`, `quick_ratio`) cannot beat the best score so far
+        are never fully scored. One `SequenceMatcher` is kept per name, so
+        their indexes of the name are only built once.
+
+    :param dict countries: Map of upper case country names to codes.
+    :param int n: Length of the n-grams used to order candidates.
+    """
+
+    def __init__(self, countries, n=3):
+        self.countries = countries
+        self.n = n
+        self.names = list(countries)
+        self.rank = dict((name, i) for i, name in enumerate(self.names))
+        self.matchers = {}
+        for name in self.names:
+            matcher = SequenceMatcher(None)
+            matcher.set_seq2(name)
+            self.matchers[name] = matcher
+
+        self.index = {}
+        for name in self.names:
+            for gram in _ngrams(name, n):
+                self.index.setdefault(gram, []).append(name)
+
+        self.memo = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, country):
+        caps = country.upper()
+        try:
+            code = self.memo[caps]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            return code
+
+        self.misses += 1
+        if caps in self.countries:
+            code = self.countries[caps]
+        else:
+            code = self.countries[self.closest(caps)]
+        self.memo[caps] = code
+        return code
+
+    def _candidates(self, caps):
+        """All names, those sharing the most n-grams with `caps` first."""
+        shared = {}
+        for gram in _ngrams(caps, self.n):
+            for name in self.index.get(gram, ()):
+                shared[name] = shared.get(name, 0) + 1
+        ordered = sorted(shared, key=lambda name: (-shared[name],
+                                                   self.rank[name]))
+        rest = [name for name in self.names if name not in shared]
+        return ordered + rest
+
+    def closest(self, caps):
+        """Return the name most similar to the upper case string `caps`."""
+        best, best_ratio, best_rank = '', 0, len(self.names)
+        for name in self._candidates(caps):
+            rank = self.rank[name]
+            matcher = self.matchers[name]
+            matcher.set_seq1(caps)
+
+            # a name can only take over with a higher ratio, or an equal one
+            # and an earlier position in the table
+            def beaten(bound):
+                return (bound < best_ratio or
+                        (bound == best_ratio and rank > best_rank))
+
+            if beaten(matcher.real_quick_ratio()):
+                continue
+            if beaten(matcher.quick_ratio()):
+                continue
+
+            ratio = matcher.ratio()
+            if ratio > 0 and not beaten(ratio):
+                best, best_ratio, best_rank = name, ratio, rank
+        return best
+
+
+def _scan_country_code(countries, country):
+    """The original full-table scan, kept as the benchmark baseline."""
+    caps = country.upper()
+    top = (0, '')
+    for name in countries:
+        similarity = SequenceMatcher(None, caps, name).ratio()
+        if similarity > top[0]:
+            top = (similarity, name)
+    return countries[top[1]]
+
+
+def bench_countries(countries, inputs, repeat=1):
+    """Time the full scan against `CountryCodeResolver` on `inputs`.
+
+    :return: (scan seconds, resolver seconds, number of differing results)
+    """
+    import time
+
+    start = time.time()
+    for _ in range(repeat):
+        expected = [_scan_country_code(countries, x) for x in inputs]
+    scan_time = time.time() - start
+
+    start = time.time()
+    for _ in range(repeat):
+        resolver = CountryCodeResolver(countries)
+        actual = [resolver(x) for x in inputs]
+    resolver_time = time.time() - start
+
+    differ = sum(1 for e, a in zip(expected, actual) if e != a)
+    return scan_time, resolver_time, differ
+
+
+if __name__ == "__main__":
+    import os
+    import cPickle as pickle
+    from awards import DATADIR
+
+    with open(os.path.join(DATADIR, 'country-codes.pickle'), 'r') as f:
+        COUNTRIES = pickle.load(f)
+
+    # mostly exact names, as in the real data, with a tail of variants
+    inputs = ['United States'] * 900 + [
+        'USA', 'U.S.A.', 'Korea, South', 'Russia', 'England', 'Viet Nam',
+        'Taiwan', 'Iran', "People's Republic of China", 'Untied States',
+        'Germany ', 'Brasil', 'Mexico', 'Canada', 'JAPAN'] * 4
+    scan_time, resolver_time, differ = bench_countries(COUNTRIES, inputs)
+    print 'closest_country_code on {} inputs:'.format(len(inputs))
+    print '  full scan: {:.3f}s'.format(scan_time)
+    print '  resolver:  {:.3f}s ({:.0f}x)'.format(
+        resolver_time, scan_time / resolver_time)
+    print '  differing results: {}'.format(differ)
@@ -1,48 +1,397 @@
 import os
 import sys
-
-import nameparser
+import json
+import Queue
+import argparse
+import traceback
+import multiprocessing as mp
 
 import db
+import rollup
+import search
+import instrument
 from awards import AwardExplorer
+from bulk import BulkLoader, award_row, _chunks
+from mixins import IdAllocator, UniqueIndex
+from normalize import NameParser
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from util.num_cpus import available_cpu_count
+
+
+# Archive members handed to a parse worker per task. Small enough that large
+# years are spread over all workers, large enough to amortize queue overhead.
+CHUNK_SIZE = 200
+
+# Parsed awards buffered between the workers and the writer, per worker.
+QUEUE_DEPTH = 500
+
+# Tasks handed out per worker beyond the oldest one not yet written, which
+# bounds the awards the writer holds back to keep them in order.
+TASKS_AHEAD = 2
+
+# Seconds the writer waits for a result before checking on the workers.
+POLL_SECONDS = 1.0
+
+# Awards written per transaction in parallel mode.
+COMMIT_EVERY = 1000
+
+# Awards staged per flush when ids are allocated client-side.
+FLUSH_EVERY = 250
+
+# Every class `parse_award` resolves with `as_unique`.
+UNIQUE_CLASSES = (
+    db.Award, db.Directorate, db.Division, db.Program, db.RelatedPrograms,
+    db.Funding, db.Address, db.Institution, db.Person, db.Role,
+    db.Affiliation
+)
+
+
+def warm_index(session, maxsize=None):
+    """Build a `UniqueIndex` holding the keys of every row already stored."""
+    index = UniqueIndex(maxsize)
+    index.warm(session, *UNIQUE_CLASSES)
+    return index
+
+
+def member_row(year, info, code):
+    """Map an archive member's `ZipInfo` onto an `ArchiveMember` row."""
+    return dict(year=year, name=info.filename, crc=info.CRC,
+                size=info.file_size, award_code=code)
+
+
+def record_members(session, rows):
+    """Record archive members as ingested, replacing earlier records."""
+    if rows:
+        table = db.ArchiveMember.__table__
+        session.execute(table.insert().prefix_with('OR REPLACE'), rows)
+
+
+def award_ids(session, codes):
+    """Look up the primary keys of the awards with the given codes."""
+    award = db.Award.__table__
+    ids = []
+    for chunk in _chunks(codes):
+        query = db.sa.select([award.c.id]).where(award.c.code.in_(chunk))
+        ids.extend(row[0] for row in session.execute(query))
+    return ids
+
+
+def roll_up(session, rows):
+    """Add the awards of ingested `ArchiveMember` rows to the funding
+    totals; see `rollup`.
+    """
+    session.flush()
+    with instrument.stage('rollup'):
+        codes = [row['award_code'] for row in rows if row['award_code']]
+        rollup.add(session, award_ids(session, codes))
+
+
+def forget_changed(session, award_explorer, year):
+    """Find the members of a year's archive that still need ingesting.
 
+    Members that changed since they were ingested have their old award
+    taken out of the funding totals and deleted, with its fundings, roles
+    and affiliations, and their `ArchiveMember` record removed, so they are
+    parsed again from scratch. Shared rows (people, institutions, programs)
+    are kept. Run this before any `as_unique` lookups are cached, or clear
+    the caches afterwards.
 
-def parse_year(award_explorer, year):
-    """Parse all XML award records for a given year, creating DB records."""
+    :return: (the `ZipInfo` of every new or changed member,
+              the number of awards deleted)
+    """
+    table = db.ArchiveMember.__table__
+    known = dict(
+        (row.name, row) for row in
+        session.execute(table.select().where(table.c.year == year)))
+    members = award_explorer.changed(
+        year, dict((name, (row.crc, row.size))
+                   for name, row in known.items()))
+
+    stale = [known[info.filename] for info in members
+             if info.filename in known]
+    codes = [row.award_code for row in stale if row.award_code]
+    ids = award_ids(session, codes)
+    rollup.retract(session, ids)
+
+    award = db.Award.__table__
+    for chunk in _chunks(ids):
+        for model in (db.Funding, db.Role, db.Affiliation):
+            links = model.__table__
+            session.execute(links.delete().where(links.c.award_id.in_(chunk)))
+        session.execute(award.delete().where(award.c.id.in_(chunk)))
+    for chunk in _chunks([row.name for row in stale]):
+        session.execute(table.delete().where(
+            (table.c.year == year) & table.c.name.in_(chunk)))
+    return members, len(ids)
+
+
+def _ingest(session, award_explorer, year, members, loader=None):
+    """Write the awards of the given members, record them as ingested, and
+    add them to the funding totals.
+
+    :param list members: `ZipInfo` of the members to parse.
+    :param loader: A `bulk.BulkLoader`; `parse_award` is used if None.
+    """
+    instrument.label(year)
+    ingested = []
+    infos = dict((info.filename, info) for info in members)
+    if len(infos) == len(award_explorer.members(year)):
+        awards = award_explorer[year]
+    else:
+        awards = award_explorer.itermembers(year, list(infos))
+    for award in awards:
+        if loader is None:
+            parse_award(award, session)
+        else:
+            loader.add(award)
+        ingested.append(member_row(year, infos[award.member], award.id))
+        if len(ingested) % FLUSH_EVERY == 0:
+            session.flush()
+    if loader is not None:
+        loader.flush()
+    record_members(session, ingested)
+    roll_up(session, ingested)
+    return len(ingested)
+
+
+def parse_year(award_explorer, year, bulk=False, index=None,
+               incremental=False, ids=None):
+    """Parse all XML award records for a given year, creating DB records.
+
+    With `bulk`, awards are written in batches by a `bulk.BulkLoader`
+    rather than one at a time through `parse_award`. An `index` is attached
+    to the session so `as_unique` lookups can reuse it, and `ids` (an
+    `IdAllocator`) so `parse_award` can flush once per batch of awards. With
+    `incremental`, only members that are new or changed since the last run
+    are parsed; see `forget_changed`.
+    """
     session = db.Session()
-    for award in award_explorer[year]:
-        parse_award(award, session)
+    if incremental:
+        members, forgotten = forget_changed(session, award_explorer, year)
+        if forgotten and index is not None:
+            index.clear()
+    else:
+        members = award_explorer.infolist(year)
+
+    if index is not None:
+        index.attach(session)
+    if ids is not None:
+        ids.attach(session)
+    loader = BulkLoader(session) if bulk else None
+    _ingest(session, award_explorer, year, members, loader)
     session.commit()
 
 
+def _parse_worker(zipdir, engine, cachedir, tasks, results):
+    """Turn chunks of archive members into `AwardXML` records.
+
+    Reads (task number, year, members) tasks until a None sentinel arrives,
+    and puts a (task number, award) result per award, then (task number,
+    None) when the task is done. On error, puts (None, traceback). Always
+    signals the writer with a None of its own when done, even on error.
+    """
+    try:
+        explorer = AwardExplorer(zipdir, engine, cachedir)
+        for number, year, members in iter(tasks.get, None):
+            for award in explorer.itermembers(year, members):
+                results.put((number, award))
+            results.put((number, None))
+    except Exception:
+        results.put((None, traceback.format_exc()))
+        raise
+    finally:
+        results.put(None)
+
+
+def parse_years_parallel(award_explorer, years, workers=None, bulk=False,
+                         index=None, members=None, ids=None):
+    """Parse the given years with N parse processes and a single DB writer.
+
+    The worker processes only extract `AwardXML` records from the archives;
+    all DB writes happen in this (the calling) process, so SQLite never sees
+    concurrent writers. Records flow through a bounded queue, which keeps
+    memory flat when parsing outpaces the writer.
+
+    Workers finish their chunks of members out of order, but the writer
+    applies awards in year and member order, holding back those of later
+    chunks until the earlier ones are done. Which rows are created first,
+    and so their ids and first-seen values (a person's email, a program's
+    division), are then the same as for `parse_years_serial`. Chunks are
+    handed out at most `TASKS_AHEAD` per worker beyond the oldest one not
+    yet written, so only that many are ever held back.
+
+    If a worker fails, or dies without a word (e.g. killed by the OOM
+    killer), the writer stops, terminates the workers, rolls back what it
+    has not committed and raises `RuntimeError`. Awards committed before
+    that stay, and are skipped by an `--incremental` rerun.
+
+    :param award_explorer: `AwardExplorer` for the zip archive directory.
+    :param list years: The years to parse.
+    :param int workers: Number of parse processes; defaults to the number
+        of available CPUs.
+    :param bool bulk: Write with a `bulk.BulkLoader` instead of `parse_award`.
+    :param index: A `UniqueIndex` for the writer's `as_unique` lookups.
+    :param dict members: Map of years to the `ZipInfo` of the members to
+        parse, e.g. from `forget_changed`; all members by default.
+    :param ids: An `IdAllocator`, so `parse_award` can skip its flushes.
+    :return: The number of awards written.
+    :raises RuntimeError: If a parse worker failed or died.
+    """
+    if workers is None:
+        workers = available_cpu_count()
+    if members is None:
+        members = dict((year, award_explorer.infolist(year))
+                       for year in years)
+
+    cache = award_explorer.cache
+    cachedir = cache.cachedir if cache is not None else None
+
+    tasks = mp.Queue()
+    results = mp.Queue(maxsize=QUEUE_DEPTH * workers)
+    infos = {}
+    chunks = []  # (year, member names) of each task
+    for year in years:
+        names = [info.filename for info in members[year]]
+        infos.update(((year, info.filename), info) for info in members[year])
+        for start in range(0, len(names), CHUNK_SIZE):
+            chunks.append((year, names[start:start + CHUNK_SIZE]))
+    if not chunks:
+        for _ in range(workers):
+            tasks.put(None)
+
+    procs = [mp.Process(target=_parse_worker,
+                        args=(award_explorer.zipdir, award_explorer.engine,
+                              cachedir, tasks, results))
+             for _ in range(workers)]
+    for proc in procs:
+        proc.daemon = True
+        proc.start()
+
+    session = db.Session()
+    if index is not None:
+        index.attach(session)
+    if ids is not None:
+        ids.attach(session)
+    loader = BulkLoader(session) if bulk else None
+    written = committed = 0
+    running = workers
+    ingested = []
+    held = {}  # task number -> awards received, not yet written
+    done = set()  # finished tasks after `next_task`
+    next_task = issued = 0
+    try:
+        while running:
+            while issued < min(len(chunks), next_task + TASKS_AHEAD * workers):
+                tasks.put((issued,) + chunks[issued])
+                issued += 1
+                if issued == len(chunks):
+                    for _ in range(workers):
+                        tasks.put(None)
+
+            try:
+                result = results.get(timeout=POLL_SECONDS)
+            except Queue.Empty:
+                dead = [proc.exitcode for proc in procs if proc.exitcode]
+                if dead:
+                    raise RuntimeError(
+                        'parse worker(s) died with exit code {}'.format(
+                            ', '.join(str(code) for code in dead)))
+                continue
+            if result is None:
+                running -= 1
+                continue
+
+            number, award = result
+            if number is None:
+                raise RuntimeError('a parse worker failed:\n' + award)
+            if award is None:
+                done.add(number)
+            else:
+                held.setdefault(number, []).append(award)
+
+            # write what is in order: the awards of `next_task` so far, and
+            # of the tasks after it once it is done
+            ready = []
+            while True:
+                ready.extend((chunks[next_task][0], award)
+                             for award in held.pop(next_task, ()))
+                if next_task not in done:
+                    break
+                done.remove(next_task)
+                next_task += 1
+
+            for year, award in ready:
+                instrument.label(year)
+                if loader is None:
+                    parse_award(award, session)
+                else:
+                    loader.add(award)
+                ingested.append(
+                    member_row(year, infos[year, award.member], award.id))
+                written += 1
+                if written % FLUSH_EVERY == 0:
+                    session.flush()
+                if written % COMMIT_EVERY == 0:
+                    if loader is not None:
+                        loader.flush()
+                    record_members(session, ingested)
+                    roll_up(session, ingested)
+                    ingested = []
+                    session.commit()
+                    committed = written
+        if loader is not None:
+            loader.flush()
+        record_members(session, ingested)
+        roll_up(session, ingested)
+        session.commit()
+        committed = written
+    except RuntimeError as e:
+        session.rollback()
+        for proc in procs:
+            proc.terminate()
+        raise RuntimeError('{}\n{} awards were committed'.format(
+            e, committed))
+    except:
+        session.rollback()
+        for proc in procs:
+            proc.terminate()
+        raise
+    finally:
+        for proc in procs:
+            proc.join()
+
+    failed = [proc.exitcode for proc in procs if proc.exitcode]
+    if failed:
+        raise RuntimeError(
+            '{} parse worker(s) failed; {} awards were written'.format(
+                len(failed), written))
+    return written
+
+
+def _flush(session):
+    """Flush, unless ids are allocated client-side and it can wait."""
+    if getattr(session, '_id_allocator', None) is None:
+        session.flush()
+
+
 def parse_award(award, session):
     """Parse a single XML file and create all relevant records in DB.
 
+    Each block is timed as a stage by `instrument.stage` while a profiler
+    is enabled. If the session has an `IdAllocator` attached, nothing is
+    flushed: the caller flushes once per batch of awards.
+
     :type  soup: `bs4.BeautifulSoup`
     :param soup: Soup instance wrapping the XML file to parse.
     :type  session: `sqlalchemy.Session`
     :param session: The active session object for the DB.
 
     """
-    new_award = db.Award.as_unique(session,
-        # general info
-        code=award.id,
-        title=award.title,
-        abstract=award.abstract if award.abstract else None,
-        instrument=','.join(award.instruments),
-
-        # all dates are in format: dd/mm/yyyy
-        effective=award.effective,
-        expires=award.expires,
-        first_amended=award.first_amended,
-        last_amended=award.last_amended,
-
-        # money
-        amount=award.amount,
-        arra_amount=award.arra_amount
-    )
-    session.add(new_award)
-    session.flush()
+    with instrument.stage('award'):
+        new_award = db.Award.as_unique(session, **award_row(award))
+        session.add(new_award)
+        _flush(session)
 
     # organization stuff
 
@@ -53,110 +402,279 @@ def parse_award(award, session):
     # no instances of multiple <Organization>, <Directorate>, or <Division>
     # tags found.
 
-    directorate = db.Directorate.as_unique(session, award.directorate)
-    division = db.Division.as_unique(session, award.division)
-    directorate.divisions.append(division)
-    session.add(directorate)
+    # Set the division's side of the link: appending to
+    # `directorate.divisions` would load that collection, autoflushing the
+    # new division before its directorate is set.
+    with instrument.stage('organization'), session.no_autoflush:
+        directorate = db.Directorate.as_unique(session, award.directorate)
+        division = db.Division.as_unique(session, award.division)
+        division.directorate = directorate
+        session.add(directorate)
 
     # TODO: look up code and phone number for div/dir
 
-    related_pgms = []
-    for pgmref in award.pgm_refs:
-        ref = db.Program.as_unique(session, pgmref['code'], pgmref['name'])
-        related_pgms.append(ref)
-        session.add(ref)
-    session.flush()
-
-    pgm_elements = []
-    for pgm in award.pgm_elements:
-        pgm = db.Program.as_unique(
-            session, pgm['code'], pgm['name'], division.id)
-        session.add(pgm)
-        session.flush()
-
-        # Each program reference is related to each program element
-        for related_pgm in related_pgms:
-            if related_pgm.id != pgm.id:
-                session.add(
-                    db.RelatedPrograms.as_unique(session, pgm.id,
-                        related_pgm.id)
-                    )
-
-        # the pgm elements actually fund the award
-        session.add(db.Funding.as_unique(session, pgm, new_award))
-
-    session.flush()
+    with instrument.stage('programs'):
+        related_pgms = []
+        for pgmref in award.pgm_refs:
+            ref = db.Program.as_unique(session, pgmref['code'], pgmref['name'])
+            related_pgms.append(ref)
+            session.add(ref)
+        _flush(session)
+
+        pgm_elements = []
+        for pgm in award.pgm_elements:
+            pgm = db.Program.as_unique(
+                session, pgm['code'], pgm['name'], division.id)
+            session.add(pgm)
+            _flush(session)
+
+            # Each program reference is related to each program element
+            for related_pgm in related_pgms:
+                if related_pgm.id != pgm.id:
+                    session.add(
+                        db.RelatedPrograms.as_unique(session, pgm.id,
+                            related_pgm.id)
+                        )
+
+            # the pgm elements actually fund the award
+            session.add(db.Funding.as_unique(session, pgm, new_award))
+
+        _flush(session)
 
     # institutions
-    institutions = []
-    for inst in award.institutions:
-        institution = db.Institution.as_unique(
-            session,
-            name=inst['name'],
-            phone=inst['phone']
-        )
-        institution.address = db.Address.as_unique(
-            session,
-            street=inst['street'],
-            city=inst['city'],
-            state=inst['state'],
-            country=inst['country'],
-            zipcode=inst['zipcode']
-        )
-        session.add(institution)
-        institutions.append(institution)
+    with instrument.stage('institutions'):
+        institutions = []
+        for inst in award.institutions:
+            institution = db.Institution.as_unique(
+                session,
+                name=inst['name'],
+                phone=inst['phone']
+            )
+            institution.address = db.Address.as_unique(
+                session,
+                street=inst['street'],
+                city=inst['city'],
+                state=inst['state'],
+                country=inst['country'],
+                zipcode=inst['zipcode']
+            )
+            session.add(institution)
+            institutions.append(institution)
 
-    session.flush()
+        _flush(session)
 
     # investigators
-    people = []
-    for person in award.people:
-        new_person = db.Person.from_fullname(
-            session,
-            name=person['name'],
-            email=person['email']
-        )
-        people.append(new_person)
-        session.add(new_person)
-        session.flush()
-
-        # TODO: use actual ids after creating entries in DB
-        session.add(
-            db.Role.as_unique(
+    with instrument.stage('people'):
+        people = []
+        for person in award.people:
+            new_person = db.Person.from_fullname(
                 session,
-                award=new_award,
-                person=new_person,
-                role=person['role'],
-                start=person['start'],
-                end=person['end'])
-        )
-
-    session.flush()
+                name=person['name'],
+                email=person['email']
+            )
+            people.append(new_person)
+            session.add(new_person)
+            _flush(session)
 
-    for person in people:
-        for institution in institutions:
+            # TODO: use actual ids after creating entries in DB
             session.add(
-                db.Affiliation.as_unique(
-                    session, person, institution, new_award)
+                db.Role.as_unique(
+                    session,
+                    award=new_award,
+                    person=new_person,
+                    role=person['role'],
+                    start=person['start'],
+                    end=person['end'])
             )
 
-    session.flush()
+        _flush(session)
+
+    with instrument.stage('affiliations'):
+        for person in people:
+            for institution in institutions:
+                session.add(
+                    db.Affiliation.as_unique(
+                        session, person, institution, new_award)
+                )
+
+        _flush(session)
     return session
 
 
-if __name__ == "__main__":
+def setup_parser():
+    parser = argparse.ArgumentParser(
+        description='Parse zipped NSF award XML into the awards database.')
+
+    parser.add_argument(
+        'zipdir', action='store',
+        help='directory containing the <year>.zip award archives')
+    parser.add_argument(
+        'years', action='store', nargs='*', type=int,
+        help='restrict parsing to these years (default: all years)')
+    parser.add_argument(
+        '-j', '--workers', action='store', type=int, default=0,
+        help='parse with N worker processes and one DB writer; '
+             '-1 uses all available CPUs (default: serial)')
+    parser.add_argument(
+        '-b', '--bulk', action='store_true',
+        help='write awards in set-based batches instead of one at a time')
+    parser.add_argument(
+        '-w', '--warm', action='store_true',
+        help='preload the unique keys of existing rows before parsing')
+    parser.add_argument(
+        '--index-size', action='store', type=int, default=None,
+        help='bound the unique-key index to N entries (default: unbounded)')
+    parser.add_argument(
+        '-i', '--incremental', action='store_true',
+        help='only parse archive members that are new or changed since '
+             'the last run')
+    parser.add_argument(
+        '-c', '--cache', action='store', default=None, metavar='DIR',
+        help='keep parsed awards in DIR, and read years from there while '
+             'their archives are unchanged')
+    parser.add_argument(
+        '-n', '--name-cache', action='store', default=None, metavar='FILE',
+        help='keep parsed person names in FILE across runs')
+    parser.add_argument(
+        '-m', '--bulk-mode', action='store_true',
+        help='load with SQL echo off, SQLite load-time pragmas, and '
+             'secondary indexes built at the end')
+    parser.add_argument(
+        '-a', '--allocate-ids', action='store_true',
+        help='assign primary keys client-side, so awards are flushed in '
+             'batches rather than several times each')
+    parser.add_argument(
+        '-p', '--profile', action='store', nargs='?', const='',
+        default=None, metavar='FILE',
+        help='report time per stage, SQL statements, flushes and unique '
+             'lookups per year; also write them to FILE as JSON if given')
+    parser.add_argument(
+        '--cprofile', action='store', default=None, metavar='FILE',
+        help='run cProfile over the load and dump its stats to FILE')
+    parser.add_argument(
+        '-e', '--engine', action='store', default='soup',
+        choices=AwardExplorer.ENGINES,
+        help='XML extraction engine (default: soup)')
+
+    return parser
+
+
+def main():
+    parser = setup_parser()
+    args = parser.parse_args()
+    if args.bulk_mode:
+        # `db.bulk_load` turns echo off too, but only once the tables below
+        # have been set up
+        db.engine.echo = False
+
+    awards = AwardExplorer(args.zipdir, args.engine, args.cache)
+    years = args.years or sorted(awards.years())
+    db.ArchiveMember.__table__.create(db.engine, checkfirst=True)
+    if search.available(db.engine):
+        search.install(db.engine)
+    elif search.installed(db.engine):
+        # its triggers would fail every insert into award
+        print ('the database has a search index, but this SQLite was built '
+               'without FTS5 and cannot update it')
+        return 2
+    else:
+        print 'warning: SQLite without FTS5; awards will not be searchable'
+    rollup.install(db.engine)
+    if args.name_cache:
+        db.NAMES = NameParser(path=args.name_cache)
+    if args.profile is not None or args.cprofile:
+        instrument.enable(db.engine, db.session_factory,
+                          cprofile=bool(args.cprofile))
+
     try:
-        awards = AwardExplorer(sys.argv[1])
-    except IndexError:
-        print '{} <zipdir>'.format(sys.argv[0])
-        sys.exit(1)
+        if args.bulk_mode:
+            with db.bulk_load():
+                index = load(args, awards, years)
+        else:
+            index = load(args, awards, years)
+    finally:
+        db.NAMES.close()
+        profiler = instrument.disable()
+
+    if profiler is not None:
+        report_profile(profiler, args.profile, args.cprofile)
+    if index is not None:
+        print 'unique index: {}'.format(index.stats())
+    print 'name cache: {}'.format(db.NAMES.stats())
+    return 0
+
+
+def report_profile(profiler, path=None, cprofile_path=None):
+    """Print the per-year summary of `profiler`; write it as JSON to
+    `path`, and dump its cProfile stats to `cprofile_path`, if given.
+    """
+    summary = profiler.summary()
+    for line in instrument.format_summary(summary):
+        print line
+    if path:
+        with open(path, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print 'profile written to {}'.format(path)
+    if cprofile_path:
+        profiler.dump_cprofile(cprofile_path)
+        print 'cProfile stats written to {}'.format(cprofile_path)
+
+
+def load(args, awards, years):
+    """Load the given years as the command line `args` say.
+
+    :return: The `UniqueIndex` used, if any.
+    """
+    # forget changed awards before any unique keys are loaded or cached
+    if args.incremental:
+        session = db.Session()
+        members = {}
+        forgotten = 0
+        for year in years:
+            members[year], deleted = forget_changed(session, awards, year)
+            forgotten += deleted
+        session.commit()
+        print '{} new or changed members, {} stale awards removed'.format(
+            sum(len(infos) for infos in members.values()), forgotten)
+    else:
+        members = dict((year, awards.infolist(year)) for year in years)
+
+    index = None
+    if args.warm:
+        index = warm_index(db.Session(), args.index_size)
+    elif args.index_size is not None:
+        index = UniqueIndex(args.index_size)
+
+    ids = IdAllocator() if args.allocate_ids else None
+    if args.workers:
+        workers = None if args.workers < 0 else args.workers
+        written = parse_years_parallel(
+            awards, years, workers, args.bulk, index, members, ids)
+        print 'wrote {} awards'.format(written)
+    else:
+        parse_years_serial(awards, years, args.bulk, index, members, ids)
+    return index
+
+
+def parse_years_serial(award_explorer, years, bulk=False, index=None,
+                       members=None, ids=None):
+    """Parse the given years in one transaction in this process.
+
+    Arguments are as for `parse_years_parallel`.
+    """
+    if members is None:
+        members = dict((year, award_explorer.infolist(year))
+                       for year in years)
 
-    awardgen = awards[1990]
     session = db.Session()
-
+    if index is not None:
+        index.attach(session)
+    if ids is not None:
+        ids.attach(session)
+    loader = BulkLoader(session) if bulk else None
     try:
-        for award in awardgen:
-            parse_award(award, session)
+        for year in years:
+            _ingest(session, award_explorer, year, members[year], loader)
     except:
         session.rollback()
         print 'ROLLBACK'
@@ -167,3 +685,8 @@ if __name__ == "__main__":
     except:
         session.rollback()
         print 'ROLLBACK'
+        raise
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""
+Bulk reads of awards, people and institutions, with the rows linked to them.
+
+The association proxies of the models (`Award.people`, `Award.institutions`,
+`Person.awards`, `Person.institutions`, `Institution.people`) load their link
+rows lazily, then each linked row, so walking them over many objects costs
+one or two SELECTs per object. The functions here load the links of a whole
+batch of objects at once instead: `selectinload` fetches each collection for
+a batch with one `SELECT ... WHERE <key> IN (...)`, and the many-to-one rows
+behind it (a role's person, an affiliation's institution and its address, a
+program's division and directorate) are `joinedload`ed into that same
+statement. Results are streamed with `yield_per`, so each batch takes a
+fixed number of statements and only one batch is held at a time.
+
+Anything not loaded here still loads lazily when touched.
+
+Usage::
+
+    python query.py <year> [-o report.jsonl] [--db url]
+
+"""
+import sys
+import json
+import argparse
+import datetime
+
+import sqlalchemy.orm as saorm
+
+import db
+from bulk import _chunks
+
+
+# Objects fetched, and their links loaded, per batch.
+BATCH_SIZE = 500
+
+# `db.Program.division` and the other backrefs exist once the mappers are
+# configured.
+saorm.configure_mappers()
+
+
+def year_range(year):
+    """The (start, end) dates of a year, as taken by `awards`."""
+    return datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)
+
+
+def _stream(query, column, ids, batch_size):
+    """Yield the results of `query`, restricted to the given values of
+    `column` if `ids` is not None, streaming `batch_size` at a time.
+    """
+    if ids is None:
+        for result in query.yield_per(batch_size):
+            yield result
+        return
+    for chunk in _chunks(ids):
+        for result in query.filter(column.in_(chunk)).yield_per(batch_size):
+            yield result
+
+
+def awards(session, start=None, end=None, ids=None, batch_size=BATCH_SIZE):
+    """Stream awards with their people, institutions and programs loaded.
+
+    Loaded per award: `roles` with each role's person, `affiliations` with
+    each person, institution and institution address (so `people` and
+    `institutions` are loaded too), and `funding_programs` with each
+    program, its division and the division's directorate.
+
+    :param datetime.date start: Only awards effective on or after this.
+    :param datetime.date end: Only awards effective before this.
+    :param list ids: Only the awards with these primary keys.
+    :param int batch_size: Awards per batch.
+    :return: Iterator of `db.Award`, by effective date then id.
+    """
+    query = session.query(db.Award).options(
+        saorm.selectinload(db.Award.roles).joinedload(db.Role.person),
+        saorm.selectinload(db.Award.affiliations).options(
+            saorm.joinedload(db.Affiliation.person),
+            saorm.joinedload(db.Affiliation.institution).joinedload(
+                db.Institution.address)),
+        saorm.selectinload(db.Award.funding_programs).joinedload(
+            db.Funding.program).joinedload(db.Program.division).joinedload(
+            db.Division.directorate)
+    ).order_by(db.Award.effective, db.Award.id)
+    if start is not None:
+        query = query.filter(db.Award.effective >= start)
+    if end is not None:
+        query = query.filter(db.Award.effective < end)
+    return _stream(query, db.Award.id, ids, batch_size)
+
+
+def people(session, ids=None, batch_size=BATCH_SIZE):
+    """Stream people with their awards and institutions loaded.
+
+    Loaded per person: `roles` with each award (so `awards` is loaded), and
+    `affiliations` with each institution (so `institutions` is loaded).
+
+    :param list ids: Only the people with these primary keys.
+    :return: Iterator of `db.Person`, by id.
+    """
+    query = session.query(db.Person).options(
+        saorm.selectinload(db.Person.roles).joinedload(db.Role.award),
+        saorm.selectinload(db.Person.affiliations).joinedload(
+            db.Affiliation.institution)
+    ).order_by(db.Person.id)
+    return _stream(query, db.Person.id, ids, batch_size)
+
+
+def institutions(session, ids=None, batch_size=BATCH_SIZE):
+    """Stream institutions with their addresses and people loaded.
+
+    Loaded per institution: `address`, and `affiliations` with each person
+    (so `people` is loaded).
+
+    :param list ids: Only the institutions with these primary keys.
+    :return: Iterator of `db.Institution`, by id.
+    """
+    query = session.query(db.Institution).options(
+        saorm.joinedload(db.Institution.address),
+        saorm.selectinload(db.Institution.affiliations).joinedload(
+            db.Affiliation.person)
+    ).order_by(db.Institution.id)
+    return _stream(query, db.Institution.id, ids, batch_size)
+
+
+def award_report(award):
+    """Flatten an award loaded by `awards` into a JSON-serializable dict,
+    without any further queries.
+    """
+    def date(value):
+        return value.isoformat() if value is not None else None
+
+    programs = []
+    for funding in award.funding_programs:
+        program = funding.program
+        division = program.division
+        programs.append({
+            'code': program.code,
+            'name': program.name,
+            'division': division.name if division is not None else None,
+            'directorate': (division.directorate.name
+                            if division is not None else None)
+        })
+
+    institutions = []
+    for institution in set(award.institutions):
+        address = institution.address
+        institutions.append({
+            'name': institution.name,
+            'phone': institution.phone,
+            'city': address.city if address is not None else None,
+            'state': address.state if address is not None else None,
+            'country': address.country if address is not None else None
+        })
+
+    return {
+        'code': award.code,
+        'title': award.title,
+        'effective': date(award.effective),
+        'expires': date(award.expires),
+        'amount': award.amount,
+        'arra_amount': award.arra_amount,
+        'people': [{'fname': role.person.fname,
+                    'mname': role.person.mname or None,
+                    'lname': role.person.lname,
+                    'email': role.person.email,
+                    'role': role.role,
+                    'start': date(role.start),
+                    'end': date(role.end)} for role in award.roles],
+        'institutions': sorted(institutions, key=lambda inst: inst['name']),
+        'programs': programs
+    }
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser(
+        description='Write a report of the awards effective in a year, one '
+                    'JSON object per line.')
+    parser.add_argument(
+        'year', action='store', type=int,
+        help='effective year of the awards to report')
+    parser.add_argument(
+        '-o', '--output', action='store', default=None,
+        help='file to write the report to (default: stdout)')
+    parser.add_argument(
+        '--db', action='store', default=None, metavar='URL',
+        help='database to read (default: the one in db.py)')
+    return parser
+
+
+def main():
+    args = setup_parser().parse_args()
+    if args.db:
+        db.use_database(args.db)
+    else:
+        db.engine.echo = False
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for award in awards(db.Session(), *year_range(args.year)):
+            out.write(json.dumps(award_report(award), sort_keys=True))
+            out.write('\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,443 @@
+"""
+Funding totals by directorate, division and program, kept up to date as
+awards are loaded.
+
+Totalling `Award.amount` by organization means joining `award`, `funding`,
+`program`, `division` and `directorate` over every award. Instead, the
+loaders `add` each batch of awards to the rollup tables before committing
+it, and `retract` awards before deleting them, so the totals always change
+in the same transaction as the awards. A query then reads a few rows of
+`funding_total` by key, however many awards there are.
+
+For each level (directorate, division or program), group and year,
+`funding_total` holds:
+
+    awards       number of awards effective in the year
+    amount       their total `amount`
+    arra_amount  their total `arra_amount`
+    pis          number of distinct people who were PI of one of them
+    active       number of awards active during the year: effective in or
+                 before it, and expiring in or after it
+
+An award funded by several programs of one division counts once for the
+division. `funding_pi` counts the awards of each PI per group and year, so
+the distinct PIs stay exact when awards are retracted. `rolled_award`
+records the awards included, which makes adding an award twice harmless.
+
+Awards without an effective date are left out. Programs without a division
+only count at the program level.
+
+Totals are added with an upsert (`INSERT ... ON CONFLICT DO UPDATE`) where
+SQLite supports it (3.24 and later), and by updating the existing totals and
+inserting the rest otherwise.
+
+Usage::
+
+    python rollup.py <level> [-y year] [-g id] [-n limit] [--db url]
+        [--rebuild]
+
+"""
+import sys
+import sqlite3
+import argparse
+from collections import namedtuple, defaultdict
+
+import sqlalchemy as sa
+from sqlalchemy import Column, String, Integer, Index
+
+import db
+from bulk import _chunks
+from mixins import BasicMixin
+
+
+LEVELS = ('directorate', 'division', 'program')
+
+# Roles counted as principal investigators of an award.
+PI_ROLES = ('pi', 'fpi')
+
+# Columns of `funding_total` that `totals` can order by.
+MEASURES = ('awards', 'amount', 'arra_amount', 'pis', 'active')
+
+# Whether SQLite has upserts, which came in 3.24.
+UPSERT = sqlite3.sqlite_version_info >= (3, 24, 0)
+
+
+class FundingTotal(BasicMixin, db.Base):
+    level = Column(String(11), primary_key=True)
+    group_id = Column(Integer, primary_key=True)
+    year = Column(Integer, primary_key=True)
+    awards = Column(Integer, nullable=False, default=0)
+    amount = Column(Integer, nullable=False, default=0)
+    arra_amount = Column(Integer, nullable=False, default=0)
+    pis = Column(Integer, nullable=False, default=0)
+    active = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index('ix_funding_total_year', 'level', 'year'),
+    )
+
+
+class FundingPi(BasicMixin, db.Base):
+    level = Column(String(11), primary_key=True)
+    group_id = Column(Integer, primary_key=True)
+    year = Column(Integer, primary_key=True)
+    person_id = Column(Integer, primary_key=True)
+    awards = Column(Integer, nullable=False)
+
+
+class RolledAward(BasicMixin, db.Base):
+    award_id = Column(Integer, primary_key=True)
+
+
+TABLES = (FundingTotal.__table__, FundingPi.__table__, RolledAward.__table__)
+
+_UPSERT_TOTAL = sa.text("""
+    INSERT INTO funding_total
+        (level, group_id, year, awards, amount, arra_amount, pis, active)
+    VALUES
+        (:level, :group_id, :year, :awards, :amount, :arra_amount, :pis,
+         :active)
+    ON CONFLICT (level, group_id, year) DO UPDATE SET
+        awards = awards + excluded.awards,
+        amount = amount + excluded.amount,
+        arra_amount = arra_amount + excluded.arra_amount,
+        pis = pis + excluded.pis,
+        active = active + excluded.active
+""")
+
+
+# Totals of one group in one year, as read by `totals`.
+Total = namedtuple('Total', ['level', 'group_id', 'name', 'year'] +
+                   list(MEASURES))
+
+
+def install(engine):
+    """Create the rollup tables if missing.
+
+    Tables created for a database that already has awards are filled from
+    them.
+
+    :return: True if the tables were created.
+    """
+    with engine.begin() as conn:
+        created = not engine.dialect.has_table(
+            conn, RolledAward.__tablename__)
+        for table in TABLES:
+            table.create(conn, checkfirst=True)
+        if created:
+            rebuild(conn)
+    return created
+
+
+def rebuild(conn):
+    """Recompute every total from the awards stored.
+
+    :param conn: A `Session` or `Connection`, as for all functions here.
+    """
+    for table in TABLES:
+        conn.execute(table.delete())
+    award = db.Award.__table__
+    ids = [row[0] for row in conn.execute(sa.select([award.c.id]))]
+    add(conn, ids)
+
+
+def _rolled(conn, award_ids):
+    table = RolledAward.__table__
+    rolled = set()
+    for chunk in _chunks(award_ids):
+        rolled.update(row[0] for row in conn.execute(
+            sa.select([table.c.award_id]).where(
+                table.c.award_id.in_(chunk))))
+    return rolled
+
+
+def _groups(conn, award_ids):
+    """Find the awards' dates, amounts and funding groups at every level.
+
+    :return: Map of award id to (effective, expires, amount, arra_amount,
+        {level: set of group ids}), for the awards with an effective date.
+    """
+    award = db.Award.__table__
+    funding = db.Funding.__table__
+    program = db.Program.__table__
+    division = db.Division.__table__
+    # program.div_id is a text column; join on division.id for an integer
+    joined = award.join(funding, funding.c.award_id == award.c.id).join(
+        program, program.c.id == funding.c.pgm_id).outerjoin(
+        division, division.c.id == program.c.div_id)
+
+    groups = {}
+    for chunk in _chunks(award_ids):
+        query = sa.select([
+            award.c.id, award.c.effective, award.c.expires, award.c.amount,
+            award.c.arra_amount, program.c.id, division.c.id,
+            division.c.dir_id
+        ]).select_from(joined).where(award.c.id.in_(chunk))
+        for row in conn.execute(query):
+            (award_id, effective, expires, amount, arra_amount,
+             pgm_id, div_id, dir_id) = row
+            if effective is None:
+                continue
+            if award_id not in groups:
+                groups[award_id] = (
+                    effective, expires, amount or 0, arra_amount or 0,
+                    dict((level, set()) for level in LEVELS))
+            levels = groups[award_id][-1]
+            for level, group_id in zip(LEVELS, (dir_id, div_id, pgm_id)):
+                if group_id is not None:
+                    levels[level].add(group_id)
+    return groups
+
+
+def _pis(conn, award_ids):
+    """Map each award to the people who were its PIs."""
+    role = db.Role.__table__
+    pis = defaultdict(set)
+    for chunk in _chunks(award_ids):
+        query = sa.select([role.c.award_id, role.c.person_id]).where(
+            role.c.award_id.in_(chunk) & role.c.role.in_(PI_ROLES))
+        for award_id, person_id in conn.execute(query):
+            pis[award_id].add(person_id)
+    return pis
+
+
+def _apply(conn, award_ids, sign):
+    """Add (`sign` 1) or subtract (-1) the awards from the totals."""
+    groups = _groups(conn, award_ids)
+    pis = _pis(conn, list(groups))
+
+    totals = defaultdict(lambda: dict.fromkeys(MEASURES, 0))
+    pi_awards = defaultdict(int)
+    for award_id, (effective, expires, amount, arra_amount,
+                   levels) in groups.items():
+        first = effective.year
+        last = max(first, expires.year if expires is not None else first)
+        for level, group_ids in levels.items():
+            for group_id in group_ids:
+                total = totals[level, group_id, first]
+                total['awards'] += sign
+                total['amount'] += sign * amount
+                total['arra_amount'] += sign * arra_amount
+                for year in range(first, last + 1):
+                    totals[level, group_id, year]['active'] += sign
+                for person_id in pis[award_id]:
+                    pi_awards[level, group_id, first, person_id] += sign
+
+    _apply_pis(conn, pi_awards, totals)
+    rows = [dict(total, level=level, group_id=group_id, year=year)
+            for (level, group_id, year), total in totals.items()]
+    if rows and UPSERT:
+        conn.execute(_UPSERT_TOTAL, rows)
+    elif rows:
+        _add_totals(conn, rows)
+
+
+def _add_totals(conn, rows):
+    """Add `rows` to `funding_total` without an upsert: update the totals
+    that exist, and insert the others.
+    """
+    table = FundingTotal.__table__
+    existing = set()
+    for level in LEVELS:
+        group_ids = set(row['group_id'] for row in rows
+                        if row['level'] == level)
+        for chunk in _chunks(list(group_ids)):
+            query = sa.select([table.c.group_id, table.c.year]).where(
+                (table.c.level == level) & table.c.group_id.in_(chunk))
+            existing.update((level, group_id, year)
+                            for group_id, year in conn.execute(query))
+
+    inserts, updates = [], []
+    for row in rows:
+        if (row['level'], row['group_id'], row['year']) in existing:
+            updates.append(dict(('b_' + key, value)
+                                for key, value in row.items()))
+        else:
+            inserts.append(row)
+
+    match = ((table.c.level == sa.bindparam('b_level')) &
+             (table.c.group_id == sa.bindparam('b_group_id')) &
+             (table.c.year == sa.bindparam('b_year')))
+    if inserts:
+        conn.execute(table.insert(), inserts)
+    if updates:
+        conn.execute(table.update().where(match).values(dict(
+            (measure, table.c[measure] + sa.bindparam('b_' + measure))
+            for measure in MEASURES)), updates)
+
+
+def _apply_pis(conn, pi_awards, totals):
+    """Change the award counts of PIs per group, and count the PIs that
+    the groups gain or lose in `totals`.
+    """
+    table = FundingPi.__table__
+    people = set(key[-1] for key in pi_awards)
+    before = {}
+    for chunk in _chunks(people):
+        query = table.select().where(table.c.person_id.in_(chunk))
+        for row in conn.execute(query):
+            key = (row.level, row.group_id, row.year, row.person_id)
+            if key in pi_awards:
+                before[key] = row.awards
+
+    inserts, updates, deletes = [], [], []
+    for key, change in pi_awards.items():
+        old = before.get(key, 0)
+        new = old + change
+        if new > 0 and old <= 0:
+            totals[key[:3]]['pis'] += 1
+        elif new <= 0 and old > 0:
+            totals[key[:3]]['pis'] -= 1
+        row = dict(zip(('b_level', 'b_group_id', 'b_year', 'b_person_id'),
+                       key), awards=new)
+        if key not in before:
+            if new > 0:
+                inserts.append(dict(zip(
+                    ('level', 'group_id', 'year', 'person_id'), key),
+                    awards=new))
+        elif new > 0:
+            updates.append(row)
+        else:
+            deletes.append(row)
+
+    match = ((table.c.level == sa.bindparam('b_level')) &
+             (table.c.group_id == sa.bindparam('b_group_id')) &
+             (table.c.year == sa.bindparam('b_year')) &
+             (table.c.person_id == sa.bindparam('b_person_id')))
+    if inserts:
+        conn.execute(table.insert(), inserts)
+    if updates:
+        conn.execute(table.update().where(match).values(
+            awards=sa.bindparam('awards')), updates)
+    if deletes:
+        conn.execute(table.delete().where(match), deletes)
+
+
+def add(conn, award_ids):
+    """Add stored awards to the totals, skipping any already included.
+
+    Flush the session first, so the awards and their fundings and roles
+    can be read back.
+    """
+    rolled = _rolled(conn, award_ids)
+    new = [award_id for award_id in set(award_ids) if award_id not in rolled]
+    if not new:
+        return 0
+    _apply(conn, new, 1)
+    conn.execute(RolledAward.__table__.insert(),
+                 [{'award_id': award_id} for award_id in new])
+    return len(new)
+
+
+def retract(conn, award_ids):
+    """Take awards out of the totals, before they are deleted."""
+    rolled = list(_rolled(conn, award_ids))
+    if not rolled:
+        return 0
+    _apply(conn, rolled, -1)
+    table = RolledAward.__table__
+    for chunk in _chunks(rolled):
+        conn.execute(table.delete().where(table.c.award_id.in_(chunk)))
+    total = FundingTotal.__table__
+    conn.execute(total.delete().where(
+        (total.c.awards == 0) & (total.c.active == 0)))
+    return len(rolled)
+
+
+def totals(conn, level, year=None, group_id=None, order='amount',
+           limit=None):
+    """Read the funding totals of the groups of a level.
+
+    :param str level: 'directorate', 'division' or 'program'.
+    :param int year: Only this year; all years by default.
+    :param int group_id: Only the directorate, division or program with
+        this id.
+    :param str order: Measure to order by, largest first within each year;
+        one of `MEASURES`.
+    :param int limit: Number of totals to return.
+    :return: List of `Total`, by year.
+    """
+    if level not in LEVELS:
+        raise ValueError('no such level: {}'.format(level))
+    if order not in MEASURES:
+        raise ValueError('cannot order by: {}'.format(order))
+
+    params = {'level': level, 'limit': -1 if limit is None else limit}
+    filters = ['funding_total.level = :level']
+    if year is not None:
+        params['year'] = year
+        filters.append('funding_total.year = :year')
+    if group_id is not None:
+        params['group_id'] = group_id
+        filters.append('funding_total.group_id = :group_id')
+
+    statement = sa.text("""
+        SELECT funding_total.level, funding_total.group_id,
+               coalesce({level}.name, {level}.code) AS name,
+               funding_total.year, {measures}
+        FROM funding_total
+        LEFT JOIN {level} ON {level}.id = funding_total.group_id
+        WHERE {filters}
+        ORDER BY funding_total.year, funding_total.{order} DESC,
+                 funding_total.group_id
+        LIMIT :limit
+    """.format(level=level, filters=' AND '.join(filters), order=order,
+               measures=', '.join('funding_total.' + measure
+                                  for measure in MEASURES)))
+    return [Total(*row) for row in conn.execute(statement, params)]
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser(
+        description='Show funding totals by organization and year.')
+    parser.add_argument(
+        'level', action='store', nargs='?', default=None, choices=LEVELS,
+        help='organization level to total by')
+    parser.add_argument(
+        '-y', '--year', action='store', type=int, default=None,
+        help='only this effective year')
+    parser.add_argument(
+        '-g', '--group', action='store', type=int, default=None,
+        metavar='ID', help='only the group with this id')
+    parser.add_argument(
+        '-o', '--order', action='store', default='amount', choices=MEASURES,
+        help='measure to order by within each year (default: amount)')
+    parser.add_argument(
+        '-n', '--limit', action='store', type=int, default=None,
+        help='number of totals to show (default: all)')
+    parser.add_argument(
+        '--db', action='store', default=None, metavar='URL',
+        help='database to read (default: the one in db.py)')
+    parser.add_argument(
+        '--rebuild', action='store_true',
+        help='recompute the totals from the award table first')
+    return parser
+
+
+def main():
+    args = setup_parser().parse_args()
+    if args.db:
+        db.use_database(args.db)
+    else:
+        db.engine.echo = False
+
+    if not install(db.engine) and args.rebuild:
+        with db.engine.begin() as conn:
+            rebuild(conn)
+    if not args.level:
+        return 0
+
+    rows = totals(db.engine, args.level, args.year, args.group, args.order,
+                  args.limit)
+    print '{:>4} {:>6}  {:<40} {:>7} {:>14} {:>12} {:>6} {:>7}'.format(
+        'year', 'id', 'name', 'awards', 'amount', 'arra', 'pis', 'active')
+    for row in rows:
+        line = u'{:>4} {:>6}  {:<40.40} {:>7} {:>14,} {:>12,} {:>6} {:>7}'
+        print line.format(
+            row.year, row.group_id, row.name or u'', row.awards, row.amount,
+            row.arra_amount, row.pis, row.active).encode('utf-8')
+    return 0 if rows else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""
+Parallel map-reduce scans over the award archives.
+
+Work is split into slices of archive members rather than whole years, since
+the years differ in size by orders of magnitude. Each task names only a year
+and a range of member positions. The archives are memory-mapped before the
+worker processes are forked, so the workers inflate the members of their
+slice from the shared mapping, map a function over them, and send back just
+the non-None results. Results are reduced in the calling process, so
+nothing is printed or written from the workers.
+
+The mapped function is handed to the workers when they start (they are
+forked), not pickled per task, so lambdas work::
+
+    from scan import find
+    multiple_orgs = find(
+        zipdir, lambda doc: len(doc.findall('.//Organization')) > 1)
+
+"""
+import os
+import sys
+import multiprocessing as mp
+
+from lxml import etree
+
+from awards import AwardExplorer, AwardXML, Soup
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from util.num_cpus import available_cpu_count
+
+
+# Archive members per task. Small enough to balance the load across workers,
+# large enough that re-reading an archive's directory per task is cheap.
+CHUNK_SIZE = 500
+
+# How each member is handed to the mapped function.
+FORMS = {
+    'raw': lambda data: data,
+    'lxml': etree.fromstring,
+    'soup': lambda data: Soup(data, 'xml'),
+    'award': AwardXML.from_lxml
+}
+
+
+def award_id(doc):
+    """The AwardID of an lxml document."""
+    return doc.findtext('.//AwardID')
+
+
+# State of each worker process, set by `_init_worker`.
+_worker = {}
+
+
+def _init_worker(archives, mapper, form):
+    _worker['archives'] = archives
+    _worker['mapper'] = mapper
+    _worker['convert'] = FORMS[form]
+
+
+def _scan_slice(task):
+    """Map over one slice of members; return [(year, member, value), ...]."""
+    year, start, stop = task
+    archive = _worker['archives'][year]
+    mapper = _worker['mapper']
+    convert = _worker['convert']
+
+    results = []
+    for member, data in archive.iterdata(range(start, stop)):
+        value = mapper(convert(data))
+        if value is not None:
+            results.append((year, member, value))
+    return results
+
+
+def tasks(explorer, years, chunk_size=CHUNK_SIZE):
+    """Split the members of the given years into (year, start, stop) slices.
+    """
+    for year in years:
+        count = len(explorer.infolist(year))
+        for start in range(0, count, chunk_size):
+            yield year, start, min(start + chunk_size, count)
+
+
+def scan(zipdir, mapper, reducer=None, initial=None, years=None,
+         form='lxml', workers=None, chunk_size=CHUNK_SIZE):
+    """Map `mapper` over every award in parallel and reduce the results.
+
+    :param str zipdir: Directory of the <year>.zip archives.
+    :param mapper: Function of one award document; None results are dropped.
+    :param reducer: Function (accumulated, (year, member, value)) ->
+        accumulated, applied in this process. By default the results are
+        collected into a list.
+    :param initial: Initial accumulated value for `reducer`.
+    :param list years: Years to scan; all by default.
+    :param str form: How awards are passed to `mapper`: 'lxml' (the root
+        element), 'raw' (bytes), 'soup' or 'award' (an `AwardXML`).
+    :param int workers: Number of processes; the available CPUs by default.
+    :param int chunk_size: Archive members per task.
+    """
+    if form not in FORMS:
+        raise ValueError('unknown form: {}'.format(form))
+    if reducer is None:
+        reducer = lambda acc, result: acc.append(result) or acc
+        initial = [] if initial is None else initial
+    if workers is None:
+        workers = available_cpu_count()
+
+    explorer = AwardExplorer(zipdir)
+    if years is None:
+        years = sorted(explorer.years())
+    archives = dict((year, explorer.archive(year)) for year in years)
+
+    pool = mp.Pool(workers, _init_worker, (archives, mapper, form))
+    try:
+        acc = initial
+        for results in pool.imap_unordered(
+                _scan_slice, tasks(explorer, years, chunk_size)):
+            for result in results:
+                acc = reducer(acc, result)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return acc
+
+
+def collect(zipdir, extract, **kwargs):
+    """Return sorted (year, member, value) for every non-None `extract`."""
+    return sorted(scan(zipdir, extract, **kwargs))
+
+
+def find(zipdir, predicate, **kwargs):
+    """Return sorted (year, member) for every award matching `predicate`."""
+    return [(year, member) for year, member, _ in
+            collect(zipdir, lambda doc: True if predicate(doc) else None,
+                    **kwargs)]
+
+
+def count(zipdir, predicate, **kwargs):
+    """Return the number of awards matching `predicate`."""
+    return scan(zipdir, lambda doc: True if predicate(doc) else None,
+                reducer=lambda acc, result: acc + 1, initial=0, **kwargs)
@@ -0,0 +1,266 @@
+"""
+Full-text search over award titles and abstracts.
+
+The index is an SQLite FTS5 table, `award_fts`, over the `title` and
+`abstract` columns of `award`. It is an external content table: it holds
+only the index, and reads the text from `award` itself. Triggers on `award`
+keep it in sync with every insert, delete and change of text, whichever way
+the awards are loaded (`parse_award`, `bulk.BulkLoader`, or the deletes of
+an incremental run).
+
+FTS5 is compiled into most SQLite builds but is optional; `available` tells
+whether the one in use has it, and `install` does nothing without it, so
+that awards can still be loaded, unindexed.
+
+Results are ranked with BM25, title matches weighing `TITLE_WEIGHT` times
+as much as abstract matches, and come with highlighted snippets of both.
+
+Usage::
+
+    python search.py <query> [-y year] [--directorate name]
+        [--division name] [-n limit] [--db url] [--rebuild]
+
+"""
+import re
+import sys
+import argparse
+import datetime
+from collections import namedtuple
+
+import sqlalchemy as sa
+
+import db
+
+
+TITLE_WEIGHT = 4.0
+
+# Markers around the matched terms in snippets, and the most tokens shown.
+HIGHLIGHT = ('[', ']')
+SNIPPET_TOKENS = 24
+
+_CREATE = """
+CREATE VIRTUAL TABLE award_fts USING fts5(
+    title, abstract,
+    content='award', content_rowid='id',
+    tokenize='porter unicode61'
+)
+"""
+
+_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS award_fts_insert AFTER INSERT ON award
+    BEGIN
+        INSERT INTO award_fts (rowid, title, abstract)
+        VALUES (new.id, new.title, new.abstract);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS award_fts_delete AFTER DELETE ON award
+    BEGIN
+        INSERT INTO award_fts (award_fts, rowid, title, abstract)
+        VALUES ('delete', old.id, old.title, old.abstract);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS award_fts_update
+    AFTER UPDATE OF title, abstract ON award
+    BEGIN
+        INSERT INTO award_fts (award_fts, rowid, title, abstract)
+        VALUES ('delete', old.id, old.title, old.abstract);
+        INSERT INTO award_fts (rowid, title, abstract)
+        VALUES (new.id, new.title, new.abstract);
+    END
+    """
+)
+
+
+# An award matching a search. `score` is the BM25 relevance, higher is
+# better; `title` and `abstract` are snippets with the matched terms between
+# the `HIGHLIGHT` markers.
+Hit = namedtuple('Hit', ['award', 'score', 'title', 'abstract'])
+
+
+def available(engine):
+    """Tell whether the SQLite of `engine` can create FTS5 tables."""
+    with engine.begin() as conn:
+        try:
+            conn.execute(
+                'CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(text)')
+        except sa.exc.OperationalError:
+            return False
+        conn.execute('DROP TABLE temp.fts5_probe')
+    return True
+
+
+def installed(engine):
+    """Tell whether the database of `engine` has the index."""
+    return bool(engine.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'award_fts'").scalar())
+
+
+def install(engine):
+    """Create the index and its triggers if missing.
+
+    An index created for a database that already has awards is filled from
+    them. Without FTS5 (see `available`) nothing is created.
+
+    :return: True if the index was created.
+    """
+    if not available(engine):
+        return False
+    with engine.begin() as conn:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'award_fts'").scalar()
+        if not exists:
+            conn.execute(_CREATE)
+        for trigger in _TRIGGERS:
+            conn.execute(trigger)
+        if not exists:
+            rebuild(conn)
+    return not exists
+
+
+def rebuild(conn):
+    """Rebuild the whole index from the `award` table."""
+    conn.execute("INSERT INTO award_fts (award_fts) VALUES ('rebuild')")
+
+
+def keywords(text):
+    """Turn free text into an FTS5 query matching all its words.
+
+    Each word is quoted, so punctuation and FTS5 operators in `text` are
+    searched for as text rather than parsed.
+    """
+    words = re.findall(r'\w+', text, re.UNICODE)
+    return u' '.join(u'"{}"'.format(word) for word in words)
+
+
+def _year_range(year):
+    return (datetime.date(year, 1, 1).isoformat(),
+            datetime.date(year + 1, 1, 1).isoformat())
+
+
+def search(session, query, year=None, directorate=None, division=None,
+           limit=20, offset=0, raw=False):
+    """Find awards by the words of their titles and abstracts.
+
+    :param session: A session on a database with the index installed.
+    :param str query: Words to search for, all of which must match; with
+        `raw`, an FTS5 query (phrases, prefixes, OR, NEAR, column filters).
+    :param int year: Only awards effective in this year.
+    :param str directorate: Only awards funded by programs of this
+        directorate (by name, in any case).
+    :param str division: Only awards funded by programs of this division.
+    :param int limit: Number of hits to return.
+    :param int offset: Number of best hits to skip, for paging.
+    :return: List of `Hit`, best first.
+    """
+    match = query if raw else keywords(query)
+    if not match:
+        return []
+
+    params = {
+        'match': match, 'limit': limit, 'offset': offset,
+        'open': HIGHLIGHT[0], 'close': HIGHLIGHT[1],
+        'tokens': SNIPPET_TOKENS, 'weight': TITLE_WEIGHT
+    }
+    filters = []
+    if year is not None:
+        params['start'], params['end'] = _year_range(year)
+        filters.append('award.effective >= :start '
+                       'AND award.effective < :end')
+    if directorate is not None or division is not None:
+        funded = ['SELECT funding.award_id FROM funding',
+                  'JOIN program ON program.id = funding.pgm_id',
+                  'JOIN division ON division.id = program.div_id']
+        conditions = []
+        if division is not None:
+            params['division'] = division.upper()
+            conditions.append('division.name = :division')
+        if directorate is not None:
+            params['directorate'] = directorate.upper()
+            funded.append(
+                'JOIN directorate ON directorate.id = division.dir_id')
+            conditions.append('directorate.name = :directorate')
+        filters.append('award.id IN ({} WHERE {})'.format(
+            ' '.join(funded), ' AND '.join(conditions)))
+
+    statement = sa.text("""
+        SELECT award_fts.rowid AS id,
+               -bm25(award_fts, :weight, 1.0) AS score,
+               snippet(award_fts, 0, :open, :close, '...', :tokens) AS title,
+               snippet(award_fts, 1, :open, :close, '...', :tokens)
+                   AS abstract
+        FROM award_fts JOIN award ON award.id = award_fts.rowid
+        WHERE award_fts MATCH :match {}
+        ORDER BY bm25(award_fts, :weight, 1.0)
+        LIMIT :limit OFFSET :offset
+    """.format(''.join(' AND ' + f for f in filters)))
+    rows = session.execute(statement, params).fetchall()
+    if not rows:
+        return []
+
+    awards = dict(
+        (award.id, award) for award in
+        session.query(db.Award).filter(db.Award.id.in_([r.id for r in rows])))
+    return [Hit(awards[row.id], row.score, row.title, row.abstract)
+            for row in rows]
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser(
+        description='Search award titles and abstracts.')
+    parser.add_argument(
+        'query', action='store', nargs='?', default=None,
+        help='words to search for')
+    parser.add_argument(
+        '-y', '--year', action='store', type=int, default=None,
+        help='only awards effective in this year')
+    parser.add_argument(
+        '--directorate', action='store', default=None,
+        help='only awards funded by this directorate')
+    parser.add_argument(
+        '--division', action='store', default=None,
+        help='only awards funded by this division')
+    parser.add_argument(
+        '-n', '--limit', action='store', type=int, default=10,
+        help='number of hits to show (default: 10)')
+    parser.add_argument(
+        '-r', '--raw', action='store_true',
+        help='pass the query to FTS5 as is, operators and all')
+    parser.add_argument(
+        '--db', action='store', default=None, metavar='URL',
+        help='database to search (default: the one in db.py)')
+    parser.add_argument(
+        '--rebuild', action='store_true',
+        help='rebuild the index from the award table first')
+    return parser
+
+
+def main():
+    args = setup_parser().parse_args()
+    if args.db:
+        db.use_database(args.db)
+    else:
+        db.engine.echo = False
+
+    if not available(db.engine):
+        print 'this SQLite was built without FTS5; search is unavailable'
+        return 2
+    if not install(db.engine) and args.rebuild:
+        with db.engine.begin() as conn:
+            rebuild(conn)
+    if not args.query:
+        return 0
+
+    hits = search(db.Session(), args.query, args.year, args.directorate,
+                  args.division, args.limit, raw=args.raw)
+    for hit in hits:
+        print u'{} {:>7.2f}  {}'.format(
+            hit.award.code, hit.score, hit.title).encode('utf-8')
+        print u'    {}'.format(hit.abstract).encode('utf-8')
+    return 0 if hits else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
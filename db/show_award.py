@@ -0,0 +1,52 @@
+"""
+Print single awards by AwardID, looked up in the `AwardIndex` of the archive
+directory rather than by scanning a year. The index is built on first use
+and refreshed whenever an archive is added or replaced.
+
+Usage::
+
+    python show_award.py <zipdir> <AwardID> [AwardID ...] [-r] [-e lxml]
+
+"""
+import sys
+import json
+import argparse
+
+from awards import AwardExplorer
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser(
+        description='Print awards by AwardID.')
+    parser.add_argument(
+        'zipdir', action='store',
+        help='directory containing the <year>.zip award archives')
+    parser.add_argument('award_ids', action='store', nargs='+')
+    parser.add_argument(
+        '-r', '--raw', action='store_true',
+        help='print the raw XML rather than the extracted fields')
+    parser.add_argument(
+        '-e', '--engine', action='store', default='lxml',
+        choices=AwardExplorer.ENGINES,
+        help='XML extraction engine (default: lxml)')
+    return parser
+
+
+def main():
+    args = setup_parser().parse_args()
+    awards = AwardExplorer(args.zipdir, args.engine)
+    found = awards.get_many(args.award_ids, raw=args.raw)
+    for award_id in args.award_ids:
+        award = found.get(award_id)
+        if award is None:
+            print '{}: not found'.format(award_id)
+        elif args.raw:
+            print award
+        else:
+            print json.dumps(award.__dict__, indent=2, sort_keys=True,
+                             default=str)
+    return 0 if len(found) == len(set(args.award_ids)) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,27 +1,32 @@
 from __future__ import division
 
+import os
 import sys
 import string
-import cPickle as pickle
+import zipfile
 
-import nameparser
-from jellyfish import jaro_winkler
+from bs4 import BeautifulSoup as Soup
 
-from db import parse
+from db.normalize import NameParser
+from personstore import BasePerson, PersonStoreWriter
 
-class Person(object):
+
+NAMES = NameParser()
+
+
+class Person(BasePerson):
 
     ID = 0
 
     def __init__(self, name, email='', directorate='', division='',
                  programs=None):
-        parsed_name = nameparser.HumanName(name)
-        self.fname = parsed_name.first.encode('utf-8')
-        self.lname = parsed_name.last.encode('utf-8')
-        self.mname = parsed_name.middle.strip('.').encode('utf-8')
-        self.title = parsed_name.title.strip('.').encode('utf-8')
-        self.suffix = parsed_name.suffix.strip('.').encode('utf-8')
-        self.nickname = parsed_name.nickname.encode('utf-8')
+        parts = NAMES(name)
+        self.fname = parts['first'].encode('utf-8')
+        self.lname = parts['last'].encode('utf-8')
+        self.mname = parts['middle'].strip('.').encode('utf-8')
+        self.title = parts['title'].strip('.').encode('utf-8')
+        self.suffix = parts['suffix'].strip('.').encode('utf-8')
+        self.nickname = parts['nickname'].encode('utf-8')
 
         self.email = email
         self.directorate = directorate.upper().strip(string.punctuation)
@@ -32,49 +37,9 @@ class Person(object):
         self.id = Person.ID
         Person.ID += 1
 
-    def num_shared_programs(self, other):
-        return len(self.programs & other.programs)
-
     def num_shared_divisions(self, other):
         return len(self.divisions & other.divisions)
 
-    def match(self, other):
-        attrs = {'fname': 0, 'lname': 0, 'mname': 0}
-        similarity = 0
-        for k, v in attrs.items():
-            attrs[k] = max(len(getattr(self, k)), len(getattr(other, k)))
-
-        total = sum(attrs.values())
-        weights = {k: v/total for (k,v) in attrs.items()}
-
-        #print 'attrs: {}'.format(attrs)
-        #print 'total: {}'.format(total)
-        #print 'weights: {}'.format(weights)
-
-        similarities = []
-        for k, v in weights.items():
-            similarities.append(
-                weights[k] * jaro_winkler(getattr(self, k), getattr(other, k))
-            )
-
-        #print similarities
-        return sum(similarities)
-
-    @property
-    def full_name(self):
-        pieces = []
-        if self.title:
-            pieces.append(self.title)
-        pieces.append(self.fname)
-        if self.nickname:
-            pieces.append('({})'.format(self.nickname))
-        if self.mname:
-            pieces.append(self.mname)
-        pieces.append(self.lname)
-        if self.suffix:
-            pieces.append(self.suffix)
-        return ' '.join(pieces)
-
 
 class People(object):
     """Retrieve people from award soup."""
@@ -107,20 +72,28 @@ def parse_award(soup):
     return people.people
 
 
+def itersoup(zipdir):
+    """Yield the soup of every award in every archive in `zipdir`."""
+    for filename in sorted(os.listdir(zipdir)):
+        if not filename.endswith('.zip'):
+            continue
+        with zipfile.ZipFile(os.path.join(zipdir, filename), 'r') as archive:
+            for member in archive.filelist:
+                yield filename, Soup(archive.read(member), 'xml')
+
+
 if __name__ == "__main__":
     try:
-        zipdir = sys.argv[2]
+        zipdir = sys.argv[1]
     except IndexError:
         zipdir = 'raw'
 
-    awards = parse.Awards(zipdir)
-    years = awards.years()
-
-    people = []
-    for year in years:
-        for soup in awards[year]:
-            print 'people parsed from {} awards: {}'.format(year, len(people))
-            people += parse_award(soup)
-
-    with open('people.pickle', 'w') as f:
-        pickle.dump(people, f)
+    # people are streamed into the store, never held in memory all at once
+    with PersonStoreWriter('people.store') as store:
+        for num, (filename, soup) in enumerate(itersoup(zipdir)):
+            for person in parse_award(soup):
+                store.add(person)
+            if num % 1000 == 0:
+                print 'people parsed from {} awards ({}): {}'.format(
+                    num, filename, store.count)
+    print 'name cache: {}'.format(NAMES.stats())
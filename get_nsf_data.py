@@ -6,49 +6,309 @@ for naming::
 
     <year>.zip
 
+Years are downloaded concurrently. Each download is streamed to a
+`<year>.zip.part` file, which is renamed into place once complete, so an
+interrupted run never leaves a truncated archive behind; the next run
+resumes the partial file with a range request where the server allows it.
+The size, SHA-1, ETag and Last-Modified of every completed archive are kept
+in `manifest.json` beside the archives, and years whose archive is intact
+and unchanged on the server are skipped.
+
 """
 import os
 import sys
+import json
+import time
+import hashlib
 import logging
 import argparse
+import datetime
+import threading
+from multiprocessing.pool import ThreadPool
+
 import requests
 
 
 NSF_AWARDS_URL = 'http://www.nsf.gov/awardsearch/download'
 REQUIRED_PARAMS = ('DownloadFileName', 'All')
 
+FIRST_YEAR = 1960
+MANIFEST = 'manifest.json'
+
+# Bytes read from the response per write to disk.
+CHUNK_SIZE = 1 << 16
+
+# Seconds to wait for the server to connect or send more data.
+TIMEOUT = 60
+
+# Downloads running at once; enough to hide latency, few enough to be polite.
+WORKERS = 4
+
+# Attempts per year, and the delay before the first retry, which doubles on
+# each subsequent one.
+RETRIES = 5
+BACKOFF = 2.0
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+DOWNLOADED = 'downloaded'
+UNCHANGED = 'unchanged'
+
+
+class RetryableError(Exception):
+    """A transient failure; the download should be attempted again."""
+
+
+class Manifest(object):
+    """Record of the archives already downloaded to a directory.
+
+    Maps each year to the size, SHA-1, ETag and Last-Modified of its
+    archive. Safe to share between download threads; every update is saved
+    immediately, by atomic rename.
+    """
+
+    def __init__(self, dirpath):
+        self.path = os.path.join(dirpath, MANIFEST)
+        self.lock = threading.Lock()
+        try:
+            with open(self.path, 'r') as f:
+                self.entries = json.load(f)
+        except (IOError, ValueError):
+            self.entries = {}
+
+    def get(self, year):
+        with self.lock:
+            return dict(self.entries.get(str(year), {}))
+
+    def update(self, year, **fields):
+        with self.lock:
+            self.entries.setdefault(str(year), {}).update(fields)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+            os.rename(tmp, self.path)
 
-def request_data(year, dirpath='./'):
-    """Request data from NSF. Write to disk on response. Note that
+
+def file_digest(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def is_intact(path, entry, verify=False):
+    """Check the archive at `path` against its manifest `entry`.
+
+    Sizes are always compared; with `verify`, the SHA-1 is as well.
+    """
+    if not entry.get('sha1') or not os.path.exists(path):
+        return False
+    if os.path.getsize(path) != entry.get('size'):
+        return False
+    return not verify or file_digest(path) == entry['sha1']
+
+
+def _validators(response):
+    return {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified')
+    }
+
+
+def _unchanged(response, entry):
+    """Whether a 200 response is the same archive as the manifest `entry`,
+    for servers that ignore conditional request headers.
+    """
+    validators = _validators(response)
+    if entry.get('etag') and validators['etag'] == entry['etag']:
+        return True
+    return bool(entry.get('last_modified') and
+                validators['last_modified'] == entry['last_modified'] and
+                response.headers.get('Content-Length') == str(entry['size']))
+
+
+def _fetch(year, outfile, entry, manifest, url, intact):
+    """Make one attempt at downloading `year` to `outfile`.
+
+    :raises RetryableError: On connection errors, timeouts and 5xx/429.
+    :raises :class:requests.exceptions.HTTPError: On other HTTP errors.
+    :return: `DOWNLOADED` or `UNCHANGED`.
+    """
+    partfile = outfile + '.part'
+    headers = {}
+    if intact:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    # resume a partial download if we know which version it belongs to
+    offset = os.path.getsize(partfile) if os.path.exists(partfile) else 0
+    partial = entry.get('partial') or {}
+    if_range = partial.get('etag') or partial.get('last_modified')
+    if offset and if_range:
+        headers['Range'] = 'bytes={}-'.format(offset)
+        headers['If-Range'] = if_range
+
+    params = {'DownloadFileName': year, 'All': 'true'}
+    try:
+        r = requests.post(url, params, headers=headers, stream=True,
+                          timeout=TIMEOUT)
+    except (requests.ConnectionError, requests.Timeout) as e:
+        raise RetryableError(str(e))
+
+    try:
+        if r.status_code == 304:
+            return UNCHANGED
+        if r.status_code in RETRY_STATUS:
+            raise RetryableError('HTTP {}'.format(r.status_code))
+        if r.status_code == 416:
+            # the partial file is no prefix of the archive; start over
+            os.remove(partfile)
+            raise RetryableError('HTTP 416, discarded partial download')
+
+        # will raise HTTP error if one occured
+        r.raise_for_status()
+
+        if intact and r.status_code == 200 and _unchanged(r, entry):
+            return UNCHANGED
+
+        sha1 = hashlib.sha1()
+        if r.status_code == 206:
+            validators = dict(partial)
+            validators.update((k, v) for k, v in _validators(r).items() if v)
+            logging.info('resuming {} at byte {}'.format(year, offset))
+            with open(partfile, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    sha1.update(chunk)
+            mode = 'ab'
+        else:
+            validators = _validators(r)
+            mode = 'wb'
+            manifest.update(year, partial=validators)
+
+        received = 0
+        try:
+            with open(partfile, mode) as f:
+                for chunk in r.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    sha1.update(chunk)
+                    received += len(chunk)
+        except (requests.ConnectionError, requests.Timeout,
+                requests.exceptions.ChunkedEncodingError) as e:
+            raise RetryableError(str(e))
+
+        # a dropped connection can look like a short but complete body
+        expected = r.headers.get('Content-Length')
+        if expected is not None and received != int(expected):
+            raise RetryableError('received {} of {} bytes'.format(
+                received, expected))
+    finally:
+        r.close()
+
+    os.rename(partfile, outfile)
+    fields = dict(validators, size=os.path.getsize(outfile),
+                  sha1=sha1.hexdigest(), partial=None)
+    manifest.update(year, **fields)
+    return DOWNLOADED
+
+
+def request_data(year, dirpath='./', manifest=None, url=NSF_AWARDS_URL,
+                 retries=RETRIES, backoff=BACKOFF, force=False, verify=False):
+    """Request data from NSF. Stream to disk on response. Note that
     the response will come back as a zipped XML file with all award
     data for the requested year.
 
     :param str year: The year to request data for.
     :param str dirpath: The directory to write the zip file to.
+    :param manifest: The `Manifest` of `dirpath`; loaded if not given.
+    :param str url: The download endpoint, e.g. a local stand-in server.
+    :param int retries: Attempts before giving up on transient errors; at
+        least 1.
+    :param float backoff: Seconds before the first retry; doubles each time.
+    :param bool force: Download even if the archive is unchanged.
+    :param bool verify: Check the SHA-1 of archives on disk, not just size.
     :raises :class:requests.exceptions.HTTPError: If an HTTP error
         occurs as a result of the request.
+    :raises RetryableError: If every attempt failed transiently.
+    :raises ValueError: If `retries` is less than 1.
+    :return: `DOWNLOADED`, or `UNCHANGED` if the download was skipped.
 
     """
-    params = {'DownloadFileName': year, 'All': 'true'}
-    logging.info('requesting award data for year: {}'.format(year))
-    r = requests.post(NSF_AWARDS_URL, params)
+    if retries < 1:
+        raise ValueError('retries must be at least 1, not {}'.format(retries))
+    dirpath = os.path.abspath(dirpath)
+    if manifest is None:
+        manifest = Manifest(dirpath)
 
-    # will raise HTTP error if one occured
-    r.raise_for_status()
-
-    # write results to zip file in designated directory
     fname = '{}.zip'.format(year)
-    outfile = os.path.join(os.path.abspath(dirpath), fname)
-    with open(outfile, 'wb') as f:
-        f.write(r.content)
+    outfile = os.path.join(dirpath, fname)
+    entry = manifest.get(year)
+    intact = not force and is_intact(outfile, entry, verify)
+
+    logging.info('requesting award data for year: {}'.format(year))
+    for attempt in range(retries):
+        try:
+            status = _fetch(year, outfile, entry, manifest, url, intact)
+            break
+        except RetryableError as e:
+            if attempt == retries - 1:
+                raise
+            delay = backoff * 2 ** attempt
+            logging.warning('{} failed ({}); retrying in {:.0f}s'.format(
+                year, e, delay))
+            time.sleep(delay)
+            entry = manifest.get(year)
+
+    if status == UNCHANGED:
+        logging.info('data for {} unchanged, skipped'.format(year))
+    else:
         logging.info('data for {} written to {}'.format(year, outfile))
+    return status
+
 
-def request_all(*args):
-    """Request data for all years."""
-    start = '1960'
-    end = '2014'  # TODO: get based on current date
-    for year in range(int(start), int(end) + 1):
-        request_data(str(year), *args)
+def all_years():
+    return [str(year) for year in
+            range(FIRST_YEAR, datetime.date.today().year + 1)]
+
+
+def request_all(years=None, dirpath='./', workers=WORKERS, **kwargs):
+    """Request data for the given years (default: all), `workers` at a time.
+
+    Keyword arguments are passed on to `request_data`.
+
+    :return: Dict of years that failed, mapped to their exceptions.
+    """
+    if years is None:
+        years = all_years()
+    manifest = Manifest(os.path.abspath(dirpath))
+
+    def download(year):
+        try:
+            return year, request_data(year, dirpath, manifest, **kwargs)
+        except Exception as e:
+            logging.error('download of {} failed: {}'.format(year, e))
+            return year, e
+
+    pool = ThreadPool(max(1, workers))
+    try:
+        results = dict(pool.imap_unordered(download, years))
+    finally:
+        pool.close()
+        pool.join()
+
+    return dict((year, result) for year, result in results.items()
+                if isinstance(result, Exception))
+
+
+def attempts(value):
+    """Parse a number of attempts per year for argparse."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            'must be at least 1, not {}'.format(value))
+    return number
 
 
 def setup_parser():
@@ -61,6 +321,21 @@ def setup_parser():
     parser.add_argument(
         '-o', '--outfile', action='store', default='./',
         help='write to a particular file, rather than the curdir')
+    parser.add_argument(
+        '-j', '--workers', action='store', type=int, default=WORKERS,
+        help='number of concurrent downloads')
+    parser.add_argument(
+        '-r', '--retries', action='store', type=attempts, default=RETRIES,
+        help='attempts per year before giving up')
+    parser.add_argument(
+        '-f', '--force', action='store_true',
+        help='download even if the archive on disk is unchanged')
+    parser.add_argument(
+        '--verify', action='store_true',
+        help='check hashes of archives on disk, not only their sizes')
+    parser.add_argument(
+        '--url', action='store', default=NSF_AWARDS_URL,
+        help='download endpoint to use instead of nsf.gov')
     parser.add_argument(
         '-v', '--verbose', action='store_true',
         help='print verbose output to console')
@@ -78,13 +353,11 @@ def main():
             format='[%(levelname)s\t%(asctime)s] %(message)s',
             handlers=[logging.StreamHandler()]
         )
-    if args.years:
-        for year in args.years:
-            request_data(year, args.outfile)
-    else:
-        request_all(args.outfile)
 
-    return 1
+    failed = request_all(
+        args.years or None, args.outfile, args.workers, url=args.url,
+        retries=args.retries, force=args.force, verify=args.verify)
+    return 1 if failed else 0
 
 
 if __name__ == "__main__":
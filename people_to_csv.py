@@ -1,5 +1,6 @@
 from csv import DictWriter
-import cPickle as pickle
+
+from personstore import PersonStore
 
 
 pfields = ['id', 'title', 'nickname', 'fname', 'mname', 'lname', 'suffix']
@@ -22,8 +23,9 @@ for writer in writers:
 
 def gen_person(people):
     for person in people:
-        person.__dict__['person_id'] = person.id
-        yield person.__dict__
+        record = person.asdict()
+        record['person_id'] = person.id
+        yield record
 
 def people_to_csv(people):
     for person in gen_person(people):
@@ -34,6 +36,5 @@ def people_to_csv(people):
 
 
 if __name__ == "__main__":
-    with open('people.pickle', 'r') as f:
-        people = pickle.load(f)
+    with PersonStore('people.store') as people:
         people_to_csv(people)
@@ -0,0 +1,279 @@
+"""
+Compact, columnar storage for the people parsed from the award data.
+
+A store is a directory of flat files, each of which is memory-mapped when
+read, so people are decoded lazily, one field at a time:
+
+    strings.dat     every distinct string, utf-8 encoded, back to back
+    strings.idx     uint32 start offset of each string, plus the end offset
+    <field>.col     one uint32 string code per person, for each of `FIELDS`
+    programs.dat    uint32 string codes of each person's programs
+    programs.idx    uint32 start offset into programs.dat per person, plus
+                    the end offset
+
+Code 0 is always the empty string. All integers are little-endian. The row
+number of a person is its id.
+
+Building a store holds only the table of distinct strings in memory, and
+reading one holds nothing but the maps, so both run in memory bounded by
+the number of distinct names, divisions and programs rather than the number
+of people.
+
+"""
+import os
+import mmap
+import struct
+
+from jellyfish import jaro_winkler
+
+
+FIELDS = ('title', 'fname', 'nickname', 'mname', 'lname', 'suffix', 'email',
+          'directorate', 'division')
+
+UINT = struct.Struct('<I')
+
+
+def _unicode(value):
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+class BasePerson(object):
+    """Name matching and formatting shared by all person representations.
+
+    Subclasses provide the name part attributes and `programs`.
+    """
+
+    __slots__ = ()
+
+    def num_shared_programs(self, other):
+        return len(self.programs & other.programs)
+
+    def match(self, other):
+        attrs = {'fname': 0, 'lname': 0, 'mname': 0}
+        for k, v in attrs.items():
+            attrs[k] = max(len(getattr(self, k)), len(getattr(other, k)))
+
+        total = sum(attrs.values())
+        if not total:
+            return 0.0
+        weights = {k: v / float(total) for (k, v) in attrs.items()}
+
+        similarities = []
+        for k, v in weights.items():
+            # names are stored as utf-8, newer jellyfish only takes unicode
+            similarities.append(weights[k] * jaro_winkler(
+                _unicode(getattr(self, k)), _unicode(getattr(other, k))))
+        return sum(similarities)
+
+    @property
+    def full_name(self):
+        pieces = []
+        if self.title:
+            pieces.append(self.title)
+        pieces.append(self.fname)
+        if self.nickname:
+            pieces.append('({})'.format(self.nickname))
+        if self.mname:
+            pieces.append(self.mname)
+        pieces.append(self.lname)
+        if self.suffix:
+            pieces.append(self.suffix)
+        return ' '.join(pieces)
+
+
+def _encode(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+class PersonStoreWriter(object):
+    """Append people to a new store in the directory `path`.
+
+    Use as a context manager, or call `close` when done.
+    """
+
+    def __init__(self, path):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.codes = {'': 0}
+        self.count = 0
+
+        def open_file(name):
+            return open(os.path.join(path, name), 'wb')
+
+        self.strings = open_file('strings.dat')
+        self.string_index = open_file('strings.idx')
+        self.columns = dict((field, open_file(field + '.col'))
+                            for field in FIELDS)
+        self.programs = open_file('programs.dat')
+        self.program_index = open_file('programs.idx')
+
+        # the empty string, code 0, starts and ends at offset 0
+        self.string_offset = 0
+        self.string_index.write(UINT.pack(0) * 2)
+        self.program_offset = 0
+        self.program_index.write(UINT.pack(0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _code(self, value):
+        value = _encode(value)
+        try:
+            return self.codes[value]
+        except KeyError:
+            code = len(self.codes)
+            self.codes[value] = code
+            self.strings.write(value)
+            self.string_offset += len(value)
+            self.string_index.write(UINT.pack(self.string_offset))
+            return code
+
+    def add(self, person):
+        """Append any object with the `FIELDS` and `programs` attributes.
+
+        :return: The id of the person in the store.
+        """
+        for field in FIELDS:
+            code = self._code(getattr(person, field, ''))
+            self.columns[field].write(UINT.pack(code))
+
+        programs = sorted(_encode(p) for p in (person.programs or ()))
+        for program in programs:
+            self.programs.write(UINT.pack(self._code(program)))
+        self.program_offset += len(programs)
+        self.program_index.write(UINT.pack(self.program_offset))
+
+        self.count += 1
+        return self.count - 1
+
+    def close(self):
+        files = [self.strings, self.string_index, self.programs,
+                 self.program_index] + self.columns.values()
+        for f in files:
+            f.close()
+
+
+class _Column(object):
+    """Descriptor decoding one field of a `PersonRecord` on access."""
+
+    def __init__(self, field):
+        self.field = field
+
+    def __get__(self, record, cls):
+        if record is None:
+            return self
+        return record.store.value(self.field, record.id)
+
+
+class PersonRecord(BasePerson):
+    """A person in a `PersonStore`, read from the store on attribute access.
+    """
+
+    __slots__ = ('store', 'id')
+
+    def __init__(self, store, id):
+        self.store = store
+        self.id = id
+
+    @property
+    def programs(self):
+        return self.store.programs(self.id)
+
+    def asdict(self):
+        record = dict((field, getattr(self, field)) for field in FIELDS)
+        record['id'] = self.id
+        record['programs'] = self.programs
+        return record
+
+    def __repr__(self):
+        return '<PersonRecord {}: {!r}>'.format(self.id, self.full_name)
+
+
+for _field in FIELDS:
+    setattr(PersonRecord, _field, _Column(_field))
+
+
+class PersonStore(object):
+    """Read-only, memory-mapped view of a store written by
+    `PersonStoreWriter`.
+
+    Supports `len`, indexing by id, and lazy iteration over `PersonRecord`s.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._files = []
+        self.strings = self._map('strings.dat')
+        self.string_index = self._map('strings.idx')
+        self.columns = dict((field, self._map(field + '.col'))
+                            for field in FIELDS)
+        self.program_codes = self._map('programs.dat')
+        self.program_index = self._map('programs.idx')
+        self._count = len(self.columns[FIELDS[0]]) // UINT.size
+
+    def _map(self, name):
+        f = open(os.path.join(self.path, name), 'rb')
+        self._files.append(f)
+        if not os.fstat(f.fileno()).st_size:
+            return ''  # empty files cannot be mapped
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        maps = [self.strings, self.string_index, self.program_codes,
+                self.program_index] + self.columns.values()
+        for m in maps:
+            if isinstance(m, mmap.mmap):
+                m.close()
+        for f in self._files:
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, id):
+        if not 0 <= id < self._count:
+            raise IndexError('person id out of range: {}'.format(id))
+        return PersonRecord(self, id)
+
+    def __iter__(self):
+        for id in xrange(self._count):
+            yield PersonRecord(self, id)
+
+    def string(self, code):
+        start, = UINT.unpack_from(self.string_index, code * UINT.size)
+        end, = UINT.unpack_from(self.string_index, (code + 1) * UINT.size)
+        return self.strings[start:end]
+
+    def code(self, field, id):
+        return UINT.unpack_from(self.columns[field], id * UINT.size)[0]
+
+    def value(self, field, id):
+        return self.string(self.code(field, id))
+
+    def programs(self, id):
+        start, = UINT.unpack_from(self.program_index, id * UINT.size)
+        end, = UINT.unpack_from(self.program_index, (id + 1) * UINT.size)
+        return set(
+            self.string(UINT.unpack_from(self.program_codes, i * UINT.size)[0])
+            for i in xrange(start, end))
+
+    def itercolumn(self, field):
+        """Lazily decode one field for every person, in id order."""
+        for id in xrange(self._count):
+            yield self.value(field, id)